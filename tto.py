@@ -9,7 +9,19 @@ Requirements
 ------------
 tto_globals : Program-wide global variable module for tto
 tto_midi : MIDI message handler for tto.
+tto_voices : Voice allocation between Key and TtoMidi.
+tto_harmonizer : Scale degree harmonizer for MIDI In notes.
+tto_arpeggiator : Clock synced arpeggiator.
+tto_looper : Clock synced pattern recorder and looper.
+tto_snapshot : Immutable musical state snapshots for the renderer.
+tto_sharedstate : Shared memory state block for external processes.
+tto_powermate : Rotary encoder input.
+tto_trace : Timeline tracing.
+tto_governor : Main loop load shedding.
+tto_watchdog : Main loop stall watchdog.
 atexit : Trap exit conditions to handle program termination gracefully.
+os : Session log path.
+time : Session log file name.
 
 Functions
 ---------
@@ -19,9 +31,22 @@ tto_terminate() : Gracefully terminate the program.
 """
 
 import tto_globals
+import tto_snapshot
+from tto_sharedstate import SharedStateWriter
+from tto_powermate import TtoPowermate
 from tto_midi import TtoMidi
+from tto_voices import VoiceManager, parse_channels
+from tto_harmonizer import TtoHarmonizer, parse_voices
+from tto_arpeggiator import TtoArpeggiator, parse_division
+from tto_looper import TtoLooper
 from tto_pygame import TtoPygame, pygame_terminate
+from tto_trace import TtoTracer, span_loop_pygame, span_loop_midi, \
+    span_loop_snapshot
+from tto_governor import LoadGovernor
+from tto_watchdog import StallWatchdog
 import atexit
+import os
+import time
 
 
 def tto_terminate():
@@ -33,15 +58,38 @@ def tto_terminate():
 
     tto_globals.debugger.message("INFO", "Beginning program termination")
 
+    if tto_globals.watchdog:
+        # Shutting down may block, and that's not a stall
+        tto_globals.watchdog.stop()
+        tto_globals.debugger.message("WDOG", "Main loop stalls: {}".format(
+            tto_globals.watchdog.stats()))
+
+    if tto_globals.voices:
+        # Send note offs for everything still sounding
+        tto_globals.voices.all_notes_off()
+
     if tto_globals.midi:
         # panic() the MIDI out port to abruptly stop all sounding notes
         tto_globals.midi.port_out_panic()
         # Try to close all open MIDI ports
         tto_globals.midi.ports_close()
 
+    if tto_globals.powermate:
+        tto_globals.powermate.stop()
+
     if tto_globals.pygame:
         pygame_terminate()
 
+    if tto_globals.shared_state:
+        tto_globals.shared_state.close()
+
+    if tto_globals.tracer:
+        tto_globals.tracer.write()
+
+    if tto_globals.governor:
+        tto_globals.debugger.message("LOAD", "Load shedding: {}".format(
+            tto_globals.governor.stats()))
+
     # Show a debugger summary
     tto_globals.debugger.summary()
 
@@ -53,9 +101,99 @@ def tto_init():
     # terminates for any reason, using the atexit library.
     atexit.register(tto_terminate)
 
+    # Record this session's messages to a binary log, if configured
+    session_log_dir = tto_globals.config['tto']['SessionLogDir'].strip('"')
+    if session_log_dir:
+        tto_globals.debugger.session_log_open(os.path.join(
+            os.path.expanduser(session_log_dir),
+            time.strftime("tto_%Y%m%d_%H%M%S.ttolog")))
+
+    # Record a timeline trace, if configured
+    if tto_globals.config['tto'].getboolean('TraceEnabled'):
+        tto_globals.tracer = TtoTracer(
+            tto_globals.config['tto'].getint('TraceSpans'),
+            tto_globals.config['tto'].getfloat('TraceMinUs') / 1000000,
+            tto_globals.config['tto']['TraceDir'].strip('"'))
+
+    # Shed UI and logging work if the main loop falls behind, if configured
+    if tto_globals.config['tto'].getboolean('GovernorEnabled'):
+        tto_globals.governor = LoadGovernor(
+            tto_globals.config['tto'].getfloat('GovernorBudgetMs') / 1000,
+            tto_globals.config['tto'].getfloat('GovernorWindowMs') / 1000)
+
+    # Log where the main loop was if it stalls, if configured
+    if tto_globals.config['tto'].getboolean('WatchdogEnabled'):
+        tto_globals.watchdog = StallWatchdog(
+            tto_globals.config['tto'].getfloat('WatchdogStallMs') / 1000)
+
     # Instanciate a mido object and init MIDI
     tto_globals.midi = TtoMidi()
 
+    # Allocate voices and MIDI channels for notes played
+    try:
+        channels = parse_channels(
+            tto_globals.config['tto']['MidiOutChannels'])
+    except ValueError as e:
+        tto_globals.debugger.message("EXCEPTION",
+                                     "MidiOutChannels: {}".format(e))
+        tto_globals.debugger.exit("Invalid MidiOutChannels in .cfg file.")
+    tto_globals.voices = VoiceManager(
+        tto_globals.config['tto'].getint('MaxPolyphony'),
+        tto_globals.config['tto']['VoiceStealing'].strip('"'),
+        channels)
+
+    # Harmonize MIDI In notes in to the current key, if configured
+    if tto_globals.config['tto'].getboolean('HarmonizerEnabled'):
+        try:
+            harmony_voices = parse_voices(
+                tto_globals.config['tto']['HarmonizerVoices'])
+        except ValueError as e:
+            tto_globals.debugger.message("EXCEPTION",
+                                         "HarmonizerVoices: {}".format(e))
+            tto_globals.debugger.exit("Invalid HarmonizerVoices in .cfg file.")
+        tto_globals.harmonizer = TtoHarmonizer(harmony_voices)
+
+    # The arpeggiator is always available from the fn buttons
+    try:
+        arp_division = parse_division(
+            tto_globals.config['tto']['ArpDivision'], tto_globals.midi.ppb)
+    except ValueError as e:
+        tto_globals.debugger.message("EXCEPTION",
+                                     "ArpDivision: {}".format(e))
+        tto_globals.debugger.exit("Invalid ArpDivision in .cfg file.")
+    tto_globals.arpeggiator = TtoArpeggiator(
+        tto_globals.config['tto']['ArpMode'].strip('"'),
+        arp_division,
+        tto_globals.config['tto'].getint('ArpGate'),
+        tto_globals.config['tto'].getboolean('ArpEnabled'))
+
+    # The looper too
+    try:
+        tto_globals.looper = TtoLooper(
+            tto_globals.config['tto'].getint('LoopBars'),
+            tto_globals.midi.ppb)
+    except ValueError as e:
+        tto_globals.debugger.message("EXCEPTION",
+                                     "LoopBars: {}".format(e))
+        tto_globals.debugger.exit("Invalid LoopBars in .cfg file.")
+
+    # Share live state with other local processes, if configured
+    shared_state_name = tto_globals.config['tto']['SharedStateName'].\
+        strip('"')
+    if shared_state_name:
+        tto_globals.debugger.message("INFO",
+                                     "Publishing shared state block: {}".
+                                     format(shared_state_name))
+        tto_globals.shared_state = SharedStateWriter(shared_state_name)
+
+    # Read a rotary encoder for turning the helm, if configured
+    if tto_globals.config['tto'].getboolean('Powermate'):
+        tto_globals.powermate = TtoPowermate(
+            tto_globals.config['tto']['PowermateDevice'].strip('"'))
+
+    # Publish an initial state snapshot for the first frame
+    tto_snapshot.publish()
+
     # Instanciate a pygame object and init graphics
     tto_globals.pygame = TtoPygame()
 
@@ -66,6 +204,14 @@ def tto_run():
     tto_globals.debugger.message("INFO", "Entering run state")
     tto_globals.running = True
 
+    tracer = tto_globals.tracer
+    governor = tto_globals.governor
+    if governor:
+        governor.start()
+    watchdog = tto_globals.watchdog
+    if watchdog:
+        watchdog.start()
+
     while tto_globals.running:
 
         #################
@@ -75,12 +221,33 @@ def tto_run():
         # Main run loop performance monitoring
         tto_globals.debugger.perf_monitor()
 
+        # Time the last run, and shed load if the loop is falling behind
+        if governor:
+            governor.tick()
+
+        # Heartbeat for the stall watchdog
+        if watchdog:
+            watchdog.beats += 1
+
         # Poll user input, update pygame, and populate tto_globals.events
+        if tracer:
+            phase_start = tracer.clock()
         tto_globals.pygame.handle_pygame()
 
         # Receive and send MIDI
+        if tracer:
+            tracer.phase(span_loop_pygame, phase_start)
+            phase_start = tracer.clock()
         tto_globals.midi.handle_messages()
 
+        # Hand the renderer an immutable copy of this tick's musical state
+        if tracer:
+            tracer.phase(span_loop_midi, phase_start)
+            phase_start = tracer.clock()
+        tto_snapshot.publish()
+        if tracer:
+            tracer.phase(span_loop_snapshot, phase_start)
+
         # Clear the events dict.  All events should have been handled.
         tto_globals.events = {}
 
@@ -0,0 +1,168 @@
+"""tto_arpeggiator - clock synced arpeggiator for tto
+
+While the arpeggiator is on, chord notes held on the keyboard don't sound
+as a chord.  Instead they're played one at a time, in turn, every ArpDivision
+of a beat, each sounding for ArpGate clock pulses.
+
+Steps are counted in MIDI clock pulses, from TtoMidi.clock_pulses_total,
+whether those come from MIDI In or from TtoMidi's internal clock.  pulse() is
+called by TtoMidi as each clock pulse is handled, not from the render loop,
+so steps land on the pulse they belong to however busy the UI is.
+
+Modes
+-----
+up : Lowest to highest held note.
+down : Highest to lowest.
+updown : Up then back down, without repeating the top and bottom notes.
+random : Any held note at random.
+played : In the order the notes were played.
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+random : For the random mode.
+
+Classes
+-------
+TtoArpeggiator : Clock synced arpeggiator.
+
+Functions
+---------
+parse_division() : Parse the ArpDivision config setting.
+"""
+
+import tto_globals
+import random
+
+arp_modes = ("up", "down", "updown", "random", "played")
+
+
+class TtoArpeggiator(object):
+    def __init__(self, mode="up", division=6, gate=3, enabled=False):
+        self.enabled = enabled
+
+        if mode not in arp_modes:
+            tto_globals.debugger.message("EXCEPTION",
+                                         "Unknown ArpMode '{}', using 'up'".
+                                         format(mode))
+            mode = "up"
+        self.mode = mode
+
+        # Clock pulses per step, and how many of them each note sounds for
+        self.division = max(1, division)
+        self.gate = max(1, gate)
+
+        # [MIDI note number] = how many keys are holding it for the arp.
+        # Kept while the arp's off, until those keys come up.
+        self.held_count = bytearray(128)
+        # Held notes, in the order they were played
+        self.held_played = []
+        # The held notes in the order the current mode steps through them.
+        # Rebuilt whenever the held notes or mode change, not every step.
+        self.sequence = []
+        self.step = 0
+
+        # The note the arp is sounding, and the pulse to turn it off on
+        self.note_sounding = None
+        self.note_off_pulse = 0
+
+    def set_enabled(self, enabled):
+        tto_globals.debugger.message("KEY_",
+                                     "Arpeggiator {}".format(
+                                         "on" if enabled else "off"))
+        self.enabled = enabled
+        if not enabled:
+            # Stop sounding, but keep counting the keys the keyboard handed
+            # over.  They were never held with Key.midi_note_hold(), so
+            # note_remove() still has to swallow their key ups, or they'd
+            # release some other holder of the same note.
+            self.notes_stop()
+
+    def set_mode(self, mode):
+        tto_globals.debugger.message("KEY_",
+                                     "Arpeggiator mode {}".format(mode))
+        self.mode = mode
+        self.sequence_build()
+
+    def mode_next(self):
+        self.set_mode(arp_modes[(arp_modes.index(self.mode) + 1) %
+                                len(arp_modes)])
+
+    def sequence_build(self):
+        notes = sorted(self.held_played)
+        if self.mode == "down":
+            notes.reverse()
+        elif self.mode == "updown":
+            notes = notes + notes[-2:0:-1]
+        elif self.mode == "played":
+            notes = list(self.held_played)
+        self.sequence = notes
+
+    def note_add(self, note):
+        if not self.held_count[note]:
+            self.held_played.append(note)
+            self.sequence_build()
+        if self.held_count[note] < 255:
+            self.held_count[note] += 1
+
+    def note_remove(self, note):
+        """Release a holder of note.  Returns False if the arp wasn't holding
+        it, e.g. it was played before the arp was switched on.
+        """
+        if not self.held_count[note]:
+            return False
+        self.held_count[note] -= 1
+        if not self.held_count[note]:
+            self.held_played.remove(note)
+            self.sequence_build()
+        return True
+
+    def notes_stop(self):
+        if self.note_sounding is not None:
+            tto_globals.key.midi_note_release(self.note_sounding)
+            self.note_sounding = None
+
+    def pulse(self, pulses_total):
+        """Handle MIDI clock pulse number pulses_total (from 1)."""
+        if self.note_sounding is not None and \
+                pulses_total >= self.note_off_pulse:
+            self.notes_stop()
+
+        # Pulse 1 is the downbeat, so steps fall on it, as the looper's do
+        if not self.enabled or (pulses_total - 1) % self.division:
+            return
+
+        if not self.sequence:
+            self.step = 0
+            return
+
+        if self.mode == "random":
+            note = random.choice(self.sequence)
+        else:
+            note = self.sequence[self.step % len(self.sequence)]
+            self.step = (self.step + 1) % len(self.sequence)
+
+        # Gate may be as long as the step, but a note always ends before
+        # the next one starts
+        self.notes_stop()
+        tto_globals.key.midi_note_hold(note)
+        self.note_sounding = note
+        self.note_off_pulse = pulses_total + min(self.gate, self.division)
+
+
+def parse_division(division_config, ppb=24):
+    """Parse an ArpDivision setting like "1/16", or "1/8t" for triplets, in
+    to clock pulses per step at ppb pulses per quarter note.
+    """
+    division_config = division_config.strip('"').strip().lower()
+    triplet = division_config.endswith("t")
+    if triplet:
+        division_config = division_config[:-1]
+    numerator, denominator = division_config.split("/")
+    pulses = ppb * 4 * int(numerator) / int(denominator)
+    if triplet:
+        pulses = pulses * 2 / 3
+    if pulses < 1 or pulses != int(pulses):
+        raise ValueError("{} is not a whole number of clock pulses".format(
+            division_config))
+    return int(pulses)
@@ -0,0 +1,432 @@
+"""tto_benchmark - performance benchmarks for tto
+
+Stand-alone benchmarks for measuring the cost of tto subsystems.  Graphics
+benchmarks run against SDL's dummy video driver so they work headless.
+
+Usage
+-----
+python tto_benchmark.py <benchmark> [--repeat N]
+python tto_benchmark.py --list
+
+Requirements
+------------
+argparse : Command line parsing.
+os : Environment set-up for child processes.
+subprocess : Benchmarks that need a fresh interpreter run in a child process.
+sys : Access the running interpreter.
+tempfile : Scratch directories for on-disk caches.
+time : perf_counter() for timing.
+
+Functions
+---------
+benchmark() : Decorator registering a bench_ function by name.
+report() : Print min / median / max of a list of timings in ms.
+bench_fonts() : Cold and warm font loading vs. plain SysFont() startup.
+bench_render_stall() : Worst-case main loop stall with and without the
+                       render thread.
+bench_render_scale() : Full-frame render time at several RenderScales.
+bench_helm_animation() : Helm draw time while animating key changes.
+bench_shapes() : Wheel geometry per Shape object vs. one WheelGeometry batch.
+bench_logging() : Hot path throughput with verbose vs. production log levels.
+bench_log_flood() : Redraw work during a log flood, per terminal refresh
+                    policy.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+benchmarks = {}  # benchmark name: bench_ function
+
+
+def benchmark(func):
+    benchmarks[func.__name__[len("bench_"):]] = func
+    return func
+
+
+def report(label, timings):
+    """Print min / median / max of a list of timings given in seconds."""
+    timings = sorted(timings)
+    print("{:<32} n={:<5} min {:9.3f} ms  median {:9.3f} ms  max {:9.3f} ms".
+          format(label, len(timings),
+                 timings[0] * 1000,
+                 timings[len(timings) // 2] * 1000,
+                 timings[-1] * 1000))
+
+
+def run_child(code, *child_args):
+    """Run code in a fresh interpreter and return the floats it prints on the
+    last line of its stdout prefixed with 'RESULT ', as a list.
+    """
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy")
+    output = subprocess.run([sys.executable, "-c", code] + list(child_args),
+                            env=env, capture_output=True, text=True,
+                            check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in reversed(output.stdout.splitlines()):
+        if line.startswith("RESULT "):
+            return [float(value) for value in line.split()[1:]]
+    raise RuntimeError("No result from child: {}".format(output.stderr))
+
+
+font_child_code = """
+import sys
+import time
+import pygame
+pygame.display.init()
+pygame.font.init()
+import tto_globals
+import tto_fonts
+tto_globals.debugger.printEnabled = False
+tto_globals.config['tto']['FontCache'] = sys.argv[2]
+start = time.perf_counter()
+if sys.argv[1] == "sysfont":
+    for name, size, bold in tto_fonts.font_specs.values():
+        pygame.font.SysFont(name, size, bold=bold)
+else:
+    tto_fonts.init_fonts()
+print("RESULT", time.perf_counter() - start)
+"""
+
+
+@benchmark
+def bench_fonts(args):
+    """Startup font loading with and without the on-disk font cache.
+
+    Every sample is a fresh interpreter, so pygame's in-process system font
+    table never carries over between samples.
+    """
+    timings = {"SysFont() x8 (no cache)": [],
+               "init_fonts() cold cache": [],
+               "init_fonts() warm cache": []}
+    for i in range(args.repeat):
+        timings["SysFont() x8 (no cache)"].append(
+            run_child(font_child_code, "sysfont", "")[0])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            timings["init_fonts() cold cache"].append(
+                run_child(font_child_code, "cached", cache_dir)[0])
+            timings["init_fonts() warm cache"].append(
+                run_child(font_child_code, "cached", cache_dir)[0])
+    for label in timings:
+        report(label, timings[label])
+
+
+render_stall_child_code = """
+import sys
+import time
+import tto_globals
+tto_globals.debugger.printEnabled = False
+tto_globals.config['tto']['FullScreen'] = 'False'
+tto_globals.config['tto']['RenderThread'] = sys.argv[1]
+import tto_snapshot
+from tto_pygame import TtoPygame
+tto_snapshot.publish()
+tto_globals.pygame = TtoPygame()
+clock = time.perf_counter
+gaps = []
+end = clock() + float(sys.argv[2])
+last = clock()
+while last < end:
+    # Keep every surface animating so a frame is always wanted
+    for gui_surface in tto_globals.pygame.gui_surfaces:
+        gui_surface.needs_rendering = True
+    tto_globals.pygame.handle_pygame()
+    tto_snapshot.publish()
+    now = clock()
+    gaps.append(now - last)
+    last = now
+tto_globals.pygame.render_thread_stop()
+gaps.sort()
+print("RESULT", gaps[-1], gaps[int(len(gaps) * 0.999)], len(gaps),
+      tto_globals.pygame.pacer.frames_rendered)
+"""
+
+
+@benchmark
+def bench_render_stall(args):
+    """Worst-case main loop stall while every surface redraws each frame.
+
+    Runs the real TtoPygame against the dummy video driver for a few seconds
+    per sample, once rendering on the main loop and once on the render
+    thread, and reports the longest gap between main loop iterations.
+    """
+    for render_thread in ("False", "True"):
+        stall_max = []
+        stall_p999 = []
+        for i in range(args.repeat):
+            result = run_child(render_stall_child_code, render_thread, "3")
+            stall_max.append(result[0])
+            stall_p999.append(result[1])
+            print("RenderThread={} loops {:.0f} frames {:.0f}".format(
+                render_thread, result[2], result[3]))
+        report("RenderThread={} max stall".format(render_thread),
+               stall_max)
+        report("RenderThread={} p99.9 stall".format(render_thread),
+               stall_p999)
+
+
+render_scale_child_code = """
+import sys
+import tto_globals
+tto_globals.debugger.printEnabled = False
+tto_globals.config['tto']['FullScreen'] = 'False'
+tto_globals.config['tto']['FpsMax'] = '0'
+tto_globals.config['tto']['RenderScale'] = sys.argv[1]
+import tto_snapshot
+from tto_pygame import TtoPygame
+tto_snapshot.publish()
+tto_globals.pygame = TtoPygame()
+frames = int(sys.argv[2])
+for i in range(frames + 1):
+    for gui_surface in tto_globals.pygame.gui_surfaces:
+        gui_surface.needs_rendering = True
+    tto_globals.pygame.handle_graphics()
+# Leave out the first frame, which builds the static layers
+timings = list(tto_globals.pygame.pacer.frame_times)[1:]
+print("RESULT", " ".join(str(t[1] + t[2] + t[3]) for t in timings))
+"""
+
+
+@benchmark
+def bench_render_scale(args):
+    """Full-frame render time at several RenderScales.
+
+    Every surface is redrawn every frame at the default 1920x1080 canvas, so
+    this is the worst case.  Times include the final scale to the display.
+    """
+    for render_scale in ("0.33", "0.5", "1.0"):
+        timings = []
+        for i in range(args.repeat):
+            timings.extend(run_child(render_scale_child_code, render_scale,
+                                     "60"))
+        report("RenderScale={} frame".format(render_scale), timings)
+
+
+helm_animation_child_code = """
+import sys
+import time
+import tto_globals
+tto_globals.debugger.printEnabled = False
+tto_globals.config['tto']['FullScreen'] = 'False'
+tto_globals.config['tto']['HelmAnimationMs'] = sys.argv[1]
+import tto_snapshot
+from tto_pygame import TtoPygame
+from tto_pygame_helm import GUISurfaceHelm
+tto_snapshot.publish()
+tto_globals.pygame = TtoPygame()
+helm = [gui_surface for gui_surface in tto_globals.pygame.gui_surfaces
+        if isinstance(gui_surface, GUISurfaceHelm)][0]
+# The first frame renders every layer from nothing, as at startup.  That's
+# not animation, so it isn't timed.
+helm.update_control()
+helm.needs_rendering = False
+helm.state = tto_globals.snapshot
+helm.draw_control()
+timings = []
+for key_change in range(int(sys.argv[2])):
+    # Alternate single steps and long jumps around the circle of fifths
+    tto_globals.key.set_key((tto_globals.key.current_key +
+                             (1 if key_change % 2 else 5)) % 12)
+    tto_snapshot.publish()
+    helm.update_control()
+    while helm.needs_rendering:
+        helm.needs_rendering = False
+        helm.state = tto_globals.snapshot
+        start = time.perf_counter()
+        helm.draw_control()
+        timings.append(time.perf_counter() - start)
+        helm.update_control()
+print("RESULT", " ".join(str(t) for t in timings))
+"""
+
+
+@benchmark
+def bench_helm_animation(args):
+    """Helm draw time while animating key changes.
+
+    Changes key repeatedly and draws helm frames back to back until each
+    animation settles, after one untimed startup frame.  HelmAnimationMs=0
+    is the old instant redraw.
+    """
+    for animation_ms in ("0", "250"):
+        timings = []
+        for i in range(args.repeat):
+            timings.extend(run_child(helm_animation_child_code,
+                                     animation_ms, "12"))
+        report("HelmAnimationMs={} frame".format(animation_ms), timings)
+
+
+@benchmark
+def bench_shapes(args):
+    """Wheel geometry per Shape object vs. one WheelGeometry batch.
+
+    Builds the ring, every slice and every ray of a wheel at 8 radii, for
+    several circle divisions.
+    """
+    import tto_globals
+    tto_globals.debugger.printEnabled = False
+    import tto_shapes
+
+    radii = [480 - (i * 40) for i in range(8)]
+    for circle_divisions in (12, 19, 24, 31):
+        per_object = []
+        batch = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            for r in radii:
+                tto_shapes.ShapeWheel(canvas_size=1000, r=r,
+                                      circle_divisions=circle_divisions)
+                for slice_no in range(circle_divisions):
+                    tto_shapes.ShapeWheelSlice(
+                        canvas_size=1000, r=r, slice_no=slice_no,
+                        circle_divisions=circle_divisions)
+                    tto_shapes.ShapeWheelRay(
+                        canvas_size=1000, r=r, slice_no=slice_no,
+                        circle_divisions=circle_divisions)
+            per_object.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            tto_shapes.WheelGeometry(1000, radii, circle_divisions)
+            batch.append(time.perf_counter() - start)
+        report("{} divisions per Shape".format(circle_divisions), per_object)
+        report("{} divisions WheelGeometry{}".format(
+            circle_divisions,
+            "" if tto_shapes.numpy is not None else " (no numpy)"), batch)
+
+
+logging_child_code = """
+import sys
+import time
+import mido
+import tto_globals
+tto_globals.debugger.printEnabled = False
+tto_globals.debugger.set_levels(sys.argv[1])
+from tto_debugger import category_keyb
+from tto_midi import TtoMidi
+from tto_voices import VoiceManager
+tto_globals.midi = TtoMidi()
+tto_globals.voices = VoiceManager()
+clock = mido.Message("clock")
+iterations = int(sys.argv[2])
+timings = []
+for sample in range(5):
+    start = time.perf_counter()
+    for i in range(iterations):
+        # A key press and release, a clock pulse, and an input event: the
+        # messages logged on every busy main loop
+        tto_globals.debugger.message(category_keyb, "saw event: {}", i)
+        tto_globals.key.trigger(i % 7, i, mode="play")
+        tto_globals.midi.handle_clock(clock)
+        tto_globals.key.trigger(i % 7, i, mode="stop")
+    timings.append((time.perf_counter() - start) / iterations)
+print("RESULT", " ".join(str(t) for t in timings))
+"""
+
+
+@benchmark
+def bench_logging(args):
+    """Hot path throughput with verbose vs. production log levels.
+
+    Each iteration logs what a busy main loop does: an input event, a note
+    on and off through Key, the voices and TtoMidi, and a clock pulse.
+    Printing is off, so this is the cost of keeping or dropping messages.
+    """
+    for log_level in ("debug", "info"):
+        timings = []
+        for i in range(args.repeat):
+            timings.extend(run_child(logging_child_code, log_level, "20000"))
+        report("LogLevel={} iteration".format(log_level), timings)
+        print("LogLevel={} {:.0f} iterations/s".format(
+            log_level, 1 / sorted(timings)[len(timings) // 2]))
+
+
+log_flood_child_code = """
+import sys
+import time
+import tto_globals
+tto_globals.debugger.printEnabled = False
+# Every message kept, none folded in to a "Repeated" entry or dropped, so
+# the terminal really has a new line each main loop
+tto_globals.debugger.set_rates(0, "", coalesce_ms=0)
+tto_globals.config['tto']['FullScreen'] = 'False'
+import tto_snapshot
+from tto_pygame import TtoPygame
+from tto_pygame_terminal import GUISurfaceTerminal
+tto_snapshot.publish()
+tto_globals.pygame = TtoPygame()
+terminal_draws = [0]
+for gui_surface in tto_globals.pygame.gui_surfaces:
+    if isinstance(gui_surface, GUISurfaceTerminal):
+        gui_surface.refresh_policy = sys.argv[1]
+        draw_control = gui_surface.draw_control
+
+        def draw_control_counted():
+            terminal_draws[0] += 1
+            draw_control()
+        gui_surface.draw_control = draw_control_counted
+pacer = tto_globals.pygame.pacer
+draw_time = [0]
+frame_end = pacer.frame_end
+
+def frame_end_counted():
+    draw_time[0] += pacer.time_draw
+    frame_end()
+pacer.frame_end = frame_end_counted
+clock = time.perf_counter
+end = clock() + float(sys.argv[2])
+key_change = clock()
+loops = 0
+while clock() < end:
+    # A message every main loop, and now and then a key change for the
+    # helm to keep up with
+    tto_globals.debugger.message("INFO", "flood {}", loops)
+    if clock() > key_change:
+        key_change += 1
+        tto_globals.key.set_key((tto_globals.key.current_key + 1) % 12)
+    tto_globals.pygame.handle_pygame()
+    tto_snapshot.publish()
+    tto_globals.events = {}
+    loops += 1
+seconds = float(sys.argv[2])
+print("RESULT", pacer.frames_rendered / seconds, terminal_draws[0] / seconds,
+      draw_time[0] / seconds)
+"""
+
+
+@benchmark
+def bench_log_flood(args):
+    """Redraw work during a log flood, per terminal refresh policy.
+
+    Logs a message on every main loop while the key changes now and then,
+    and measures frames, terminal redraws and total draw time per second.
+    With the terminal on "change" it's redrawn every frame; on "hz", at
+    TerminalHz.
+    """
+    for policy in ("change", "hz"):
+        draw_times = []
+        for i in range(args.repeat):
+            frames, terminal_draws, draw_time = run_child(
+                log_flood_child_code, policy, "3")
+            draw_times.append(draw_time)
+            print("terminal {} frames/s {:.1f} terminal draws/s {:.1f}".
+                  format(policy, frames, terminal_draws))
+        report("terminal {} draw time per s".format(policy), draw_times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="tto benchmarks")
+    parser.add_argument("benchmark", nargs="?", choices=sorted(benchmarks))
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of samples per measurement")
+    parser.add_argument("--list", action="store_true",
+                        help="List available benchmarks")
+    arguments = parser.parse_args()
+    if arguments.list or not arguments.benchmark:
+        for name in sorted(benchmarks):
+            print("{:<16} {}".format(name, benchmarks[name].__doc__.
+                                     split("\n")[0]))
+    else:
+        benchmarks[arguments.benchmark](arguments)
@@ -2,11 +2,45 @@
 
 This module handles error and info messages produced during tto runtime.
 
+Every message has a category, like "MIDI", and a level, like DEBUG.  Each
+category has a threshold level, and messages below it are dropped before
+anything else happens.  Messages are a template and arguments, and the
+template is only formatted for messages that are kept, so a disabled debug
+message in a hot path costs a couple of lookups and one integer comparison.
+
+Categories can be given by label, or for hot paths by integer code, e.g.
+category_midi.
+
+A run of the same message template in the same category, e.g. from a stuck
+key or a noisy controller, is folded into one "Repeated N more times" entry per
+coalescing window instead of one entry each.  Each category also has a
+token bucket rate limit.  Messages over it are dropped and counted, and the
+count is logged once the category is back under its limit.  ERROR and above
+are never dropped.
+
+While deferring is set, by tto_governor when the main loop falls behind,
+messages below WARNING are put aside unformatted instead of being stored and
+written out, and deferred_flush() records them later, a few at a time.
+
+Every kept message gets a sequence number, counting from 0 for the whole
+run.  Alongside self.messages, each category label has an index of the
+sequence numbers of its messages, appended to as messages arrive, so the
+terminal can page through one category without rescanning everything.
+
+Messages can come from other threads too, like the watchdog, the background
+trace writer and the Powermate reader.  Everything from the repeat check on
+is done holding self.lock, as is reading self.messages from elsewhere.  The
+threshold check before it isn't, so dropped messages never wait for it.
 
 Requirements
 ------------
 time : Needed to timestamp events and track execution times.
+array : Compact per-category message indexes.
+bisect : Trimming the per-category message indexes.
+collections : deque for deferred messages.
+threading : Lock for messages from other threads.
 sys : Allow the debugger to access exit() and others
+tto_sessionlog : Binary session log writer.
 
 Classes
 -------
@@ -15,22 +49,119 @@ TtoDebugger : Logging class for tto.
 
 import time
 import sys
+import collections
+import threading
+from array import array
+from bisect import bisect_left
+from tto_sessionlog import SessionLogWriter, label_categories
+from tto_sessionlog import DEBUG, INFO, WARNING, ERROR, CRITICAL
+
+# Integer category codes, for hot call sites
+category_debg = label_categories["DEBG"][0]
+category_info = label_categories["INFO"][0]
+category_midi = label_categories["MIDI"][0]
+category_key = label_categories["KEY_"][0]
+category_pyga = label_categories["PYGA"][0]
+category_keyb = label_categories["KEYB"][0]
+category_clck = label_categories["CLCK"][0]
+
+# Level names accepted by set_levels()
+level_codes = {"debug": DEBUG,
+               "info": INFO,
+               "warning": WARNING,
+               "error": ERROR,
+               "critical": CRITICAL}
 
 
 class TtoDebugger(object):
     def __init__(self):
         self.stats = {}
 
-        # self.messages contains every logged message sent to the debugger
+        # Held while changing any message state.  Reentrant, as message()
+        # records through repeats_flush() and the like.
+        self.lock = threading.RLock()
+
+        # When logging began
+        self.time_started = time.time()
+
+        # self.messages contains the most recent logged messages sent to the
+        # debugger.  self.messages[0] is message number messages_first, and
+        # messages_total have been kept in all, so message number n is
+        # self.messages[n - self.messages_first].
         self.messages = []
+        self.messages_first = 0
+        self.messages_total = 0
 
         # If there are more than messages_size_limit elements in self.messages,
-        # begin trimming self.messages at index [1].  Retain [0] because it
-        # has the timestamp of when logging began
+        # the oldest messages_trim_size are trimmed in one go.  Deleting from
+        # the front of a list is a copy of the rest of it, so this keeps
+        # that to once every messages_trim_size messages.
         self.messages_size_limit = 10000
+        self.messages_trim_size = 1000
+        self.messages_trimmed = 0
+
+        # [label] = array of the message numbers in self.messages with that
+        # label, oldest first
+        self.messages_index = {}
 
         self.printEnabled = True
 
+        # Per category code 0-255: its label, the level its messages are
+        # logged at by default, and the threshold below which they're
+        # dropped.  Everything is kept until set_levels() says otherwise.
+        self.category_codes = {}  # [label] = category code
+        self.category_labels = [""] * 256
+        self.category_levels = [INFO] * 256
+        self.category_thresholds = [DEBUG] * 256
+        for label in label_categories:
+            code, level = label_categories[label]
+            self.category_codes[label] = code
+            self.category_labels[code] = label
+            self.category_levels[code] = level
+        self.threshold_default = DEBUG
+
+        # Repeated messages.  The category, level and template of the last
+        # message kept, and how many times it's been repeated since it, or
+        # since the last "Repeated" entry, which is at most coalesce_window
+        # seconds ago.  Only repeats less than coalesce_window apart are
+        # counted, so a message that just comes round regularly is still
+        # logged each time.
+        self.coalesce_window = 0.1
+        self.repeat_category = None
+        self.repeat_level = None
+        self.repeat_template = None
+        self.repeat_args = ()
+        self.repeat_count = 0
+        self.repeat_started = 0
+        self.repeat_last = 0
+        self.messages_coalesced = 0
+        # When perf_monitor() last looked for repeats or drops to log
+        self.flush_checked = 0
+
+        # Per category code token buckets.  Each refills at rate messages a
+        # second, up to a burst of one second's worth.  A rate of 0 is
+        # unlimited.
+        self.category_rates = [0.0] * 256
+        self.category_tokens = [0.0] * 256
+        self.category_refilled = [0.0] * 256
+        self.category_dropped = [0] * 256
+        self.rate_default = 0.0
+        self.drops_pending = False
+        self.messages_dropped = 0
+
+        # Deferred messages, as record() arguments, oldest first.  Up to
+        # deferred_limit are held, and any more are dropped and counted.
+        self.deferring = False
+        self.deferred = collections.deque()
+        self.deferred_limit = 10000
+        self.messages_deferred = 0
+        self.deferred_dropped = 0
+        self.deferred_dropped_reported = 0
+
+        # If set by session_log_open(), a tto_sessionlog.SessionLogWriter
+        # also recording every message to disk
+        self.session_log = None
+
         # self.time_format for how to display timestamps on-screen
         # https://docs.python.org/3/library/time.html#time.strftime
         self.time_format = "%Y-%m-%d %H:%M:%S %z"
@@ -52,12 +183,21 @@ class TtoDebugger(object):
         # Tracks and reports loop execution speed
         sample_size = 10000000
         self.runtime_ticks += 1
+        if self.repeat_count or self.drops_pending:
+            # Don't leave a run of repeats or drops unreported just because
+            # nothing else has been logged since.  Checked once a window.
+            now = time.time()
+            if now - self.flush_checked >= self.coalesce_window:
+                self.flush_checked = now
+                if now - self.repeat_started >= self.coalesce_window:
+                    self.repeats_flush(now)
+                self.drops_flush(now)
         if self.runtime_ticks > sample_size:
             self.runtime_mhz = ((sample_size / (time.time() -
                                                 self.runtime_tick_time)) /
                                 1000000)  # Divide by a million for MHz
-            self.message("DEBG", "(Counter) Main loop execution MHz: {}".
-                         format(self.runtime_mhz))
+            self.message("DEBG", "(Counter) Main loop execution MHz: {}",
+                         self.runtime_mhz, level=INFO)
             self.runtime_ticks = 0
             self.runtime_tick_time = time.time()
 
@@ -77,39 +217,283 @@ class TtoDebugger(object):
         if self.printEnabled and statistic in self.stats:
             if (self.stats[statistic] == 1) or \
                     (self.stats[statistic] % mod == 0):
-                self.message("DEBG", "(Counter) {}: {}".format(
-                    statistic, self.stats[statistic]))
+                self.message("DEBG", "(Counter) {}: {}", statistic,
+                             self.stats[statistic], level=INFO)
+
+    def category_code(self, label):
+        code = self.category_codes.get(label)
+        if code is None:
+            # First time this label's been used.  Give it the next free
+            # code, logged at INFO.
+            with self.lock:
+                code = self.category_codes.get(label)
+                if code is None:
+                    code = min(max(self.category_codes.values()) + 1, 255)
+                    self.category_codes[label] = code
+                    self.category_labels[code] = label
+                    self.category_thresholds[code] = self.threshold_default
+                    self.category_rates[code] = self.rate_default
+                    self.category_tokens[code] = self.rate_default
+        return code
+
+    def set_levels(self, threshold_default, thresholds=""):
+        """Set the level below which messages are dropped, for every
+        category, then per category from a string like
+        "MIDI=debug, KEY_=warning".
+        """
+        self.threshold_default = level_codes[
+            threshold_default.strip('"').strip().lower()]
+        for code in range(256):
+            self.category_thresholds[code] = self.threshold_default
+        for setting in thresholds.strip('"').split(","):
+            if "=" in setting:
+                label, level = setting.split("=", 1)
+                self.category_thresholds[self.category_code(label.strip())] = \
+                    level_codes[level.strip().lower()]
+
+    def set_rates(self, rate_default, rates="", coalesce_ms=100):
+        """Set the token bucket rate limit, in messages a second, for every
+        category, then per category from a string like "MIDI=20, KEY_=0".
+        0 is unlimited.  Also set the coalescing window for repeats.
+        """
+        self.coalesce_window = max(0, float(coalesce_ms)) / 1000
+        self.rate_default = max(0, float(rate_default))
+        for code in range(256):
+            self.category_rates[code] = self.rate_default
+        for setting in rates.strip('"').split(","):
+            if "=" in setting:
+                label, rate = setting.split("=", 1)
+                self.category_rates[self.category_code(label.strip())] = \
+                    max(0, float(rate))
+        for code in range(256):
+            self.category_tokens[code] = self.category_rates[code]
+
+    def message(self, category, template, *args, level=None):
+        """Log template.format(*args) under category, a label like "MIDI" or
+        a category code like category_midi, at level, or the category's
+        usual level if not given.
+        """
+        if category.__class__ is str:
+            category = self.category_code(category)
+        if level is None:
+            level = self.category_levels[category]
+        if level < self.category_thresholds[category]:
+            return
+
+        with self.lock:
+            timestamp = time.time()
+
+            # The same as the last message, and hard on its heels?  Count it
+            # instead.
+            if template == self.repeat_template and \
+                    category == self.repeat_category and \
+                    level == self.repeat_level and \
+                    timestamp - self.repeat_last < self.coalesce_window:
+                self.repeat_last = timestamp
+                self.repeat_count += 1
+                self.repeat_args = args
+                self.messages_coalesced += 1
+                if timestamp - self.repeat_started >= self.coalesce_window:
+                    self.repeats_flush(timestamp)
+                return
+            if self.repeat_count:
+                self.repeats_flush(timestamp)
+
+            rate = self.category_rates[category]
+            if rate and level < ERROR:
+                tokens = min(rate, self.category_tokens[category] +
+                             ((timestamp - self.category_refilled[category]) *
+                              rate))
+                self.category_refilled[category] = timestamp
+                if tokens < 1:
+                    self.category_tokens[category] = tokens
+                    self.category_dropped[category] += 1
+                    self.messages_dropped += 1
+                    self.drops_pending = True
+                    return
+                self.category_tokens[category] = tokens - 1
+            if self.category_dropped[category]:
+                self.drop_report(timestamp, category)
+
+            self.repeat_category = category
+            self.repeat_level = level
+            self.repeat_template = template
+            self.repeat_started = timestamp
+            self.repeat_last = timestamp
+            self.record(timestamp, category, level, template, args)
+
+    def repeats_flush(self, timestamp):
+        # Log the run of repeats counted so far as one entry
+        with self.lock:
+            if not self.repeat_count:
+                return
+            if self.repeat_args:
+                last = self.repeat_template.format(*self.repeat_args)
+            else:
+                last = self.repeat_template
+            self.record(timestamp, self.repeat_category, self.repeat_level,
+                        "Repeated {} more times, last: {}",
+                        (self.repeat_count, last))
+            self.repeat_count = 0
+            self.repeat_started = timestamp
+
+    def drops_flush(self, timestamp):
+        # Log the drop counts of categories that have been quiet long
+        # enough to have a token again
+        with self.lock:
+            if not self.drops_pending:
+                return
+            self.drops_pending = False
+            for category in range(256):
+                if self.category_dropped[category]:
+                    rate = self.category_rates[category]
+                    if self.category_tokens[category] + \
+                            ((timestamp - self.category_refilled[category]) *
+                             rate) >= 1:
+                        self.drop_report(timestamp, category)
+                    else:
+                        self.drops_pending = True
+
+    def drop_report(self, timestamp, category):
+        self.record(timestamp, category, WARNING,
+                    "Dropped {} messages over the {:g}/s rate limit",
+                    (self.category_dropped[category],
+                     self.category_rates[category]))
+        self.category_dropped[category] = 0
+        # A different message now, so the next one can't fold in to the
+        # one before the drops
+        self.repeat_template = None
+
+    def record(self, timestamp, category, level, template, args):
+        # Keep a message: store it, index it, and write it out
+        with self.lock:
+            if self.deferring and level < WARNING:
+                # Or later, if the main loop has no time for it now
+                if len(self.deferred) < self.deferred_limit:
+                    self.deferred.append((timestamp, category, level, template,
+                                          args))
+                    self.messages_deferred += 1
+                else:
+                    self.deferred_dropped += 1
+                return
+            severity = self.category_labels[category]
+            if args:
+                message = template.format(*args)
+            else:
+                message = template
+            self.new_messages = True
+            self.messages.append({"severity": severity,
+                                  "level": level,
+                                  "message": message,
+                                  "timestamp": timestamp})
+            index = self.messages_index.get(severity)
+            if index is None:
+                index = self.messages_index[severity] = array('Q')
+            index.append(self.messages_total)
+            self.messages_total += 1
+
+            # Trim self.messages if it's grown over self.messages_size_limit
+            # Otherwise the logged messages list would just grow indefinitely
+            if len(self.messages) > self.messages_size_limit:
+                self.messages_trim()
+
+            if self.session_log:
+                if args:
+                    self.session_log.write_template(timestamp, severity,
+                                                    template, args, level)
+                else:
+                    self.session_log.write_literal(timestamp, severity,
+                                                   message, level)
+
+            if self.printEnabled:
+                message_string = "{}- {}".format(severity, message)
+                print(time.strftime(self.time_format,
+                                    time.localtime(timestamp)),
+                      message_string)
+
+    def deferred_flush(self, count=None):
+        """Record up to count deferred messages, or all of them if count is
+        None.  Only while not deferring.
+        """
+        with self.lock:
+            if count is None:
+                count = len(self.deferred)
+            for i in range(min(count, len(self.deferred))):
+                self.record(*self.deferred.popleft())
+            if not self.deferred and \
+                    self.deferred_dropped > self.deferred_dropped_reported:
+                self.record(time.time(), self.category_code("LOAD"), WARNING,
+                            "Dropped {} deferred messages over the limit "
+                            "of {}",
+                            (self.deferred_dropped -
+                             self.deferred_dropped_reported,
+                             self.deferred_limit))
+                self.deferred_dropped_reported = self.deferred_dropped
 
-    def message(self, severity, message):
-        timestamp = time.time()
-        self.new_messages = True
-        self.messages.append({"severity": severity,
-                              "message": message,
-                              "timestamp": timestamp})
+    def messages_trim(self):
+        trim = min(self.messages_trim_size, len(self.messages))
+        del self.messages[:trim]
+        self.messages_first += trim
+        self.messages_trimmed += trim
+        for index in self.messages_index.values():
+            del index[:bisect_left(index, self.messages_first)]
 
-        # Trim self.messages if it's grown over self.messages_size_limit
-        # del at index [1] so that we always retain the very first message,
-        # which contains the timestamp of the beginning of logging.
-        # Otherwise the logged messages list would just grow indefinitely
+    def messages_view(self, severity=None):
+        """The message numbers of the messages still held with label
+        severity, or of all of them if severity is None, oldest first.
+        A sequence, not a copy, so only take slices of it.
+        """
+        if severity is None:
+            return range(self.messages_first, self.messages_total)
+        return self.messages_index.get(severity, ())
 
-        if len(self.messages) > self.messages_size_limit:
-            del self.messages[1]
+    def session_log_open(self, path):
+        """Start recording messages to a binary session log at path,
+        beginning with everything logged so far.
+        """
+        try:
+            session_log = SessionLogWriter(path)
+        except OSError as e:
+            self.message("EXCEPTION", "Opening session log {}: {}".format(
+                path, e))
+            return
+        with self.lock:
+            for logged in self.messages:
+                session_log.write_literal(logged["timestamp"],
+                                          logged["severity"],
+                                          logged["message"],
+                                          logged["level"])
+            self.session_log = session_log
+        self.message("INFO", "Session log: {}".format(path))
 
-        if self.printEnabled:
-            message_string = "{}- {}".format(severity, message)
-            print(time.strftime(self.time_format, time.localtime(timestamp)),
-                  message_string)
+    def session_log_close(self):
+        with self.lock:
+            if self.session_log:
+                self.session_log.close()
+                self.session_log = None
 
     def exit(self, message):
+        self.deferring = False
+        self.deferred_flush()
         self.message("EXIT", message)
+        self.session_log_close()
         sys.exit(message)
 
     def summary(self):
+        now = time.time()
+        self.deferring = False
+        self.deferred_flush()
+        self.repeats_flush(now)
+        self.drops_flush(now)
+        # INFO, so the summary is kept at the default LogLevel
         for stat in self.stats:
-            self.message("DEBG",
-                         "{}: {}".format(stat, self.stats[stat]))
-        self.message("DEBG",
-                     "Runtime: {} seconds".format((
-                             self.messages[-1]["timestamp"] -
-                             self.messages[0]["timestamp"])))
+            self.message("DEBG", "{}: {}", stat, self.stats[stat],
+                         level=INFO)
+        self.message("DEBG", "Runtime: {} seconds",
+                     time.time() - self.time_started, level=INFO)
+        self.message("DEBG", "Messages: {} kept, {} trimmed, {} coalesced, "
+                     "{} dropped, {} deferred", self.messages_total,
+                     self.messages_trimmed, self.messages_coalesced,
+                     self.messages_dropped, self.messages_deferred,
+                     level=INFO)
 
@@ -1,40 +1,324 @@
 """tto_fonts - pygame graphic interface fonts for tto
 
-This module handles pygame SysFonts.
+This module handles pygame fonts and their on-disk cache.
+
+pygame.font.SysFont() scans the system font list the first time it's called
+(on Linux that means shelling out to fc-list), and every label is then
+rasterized from scratch.  To keep cold starts fast, the resolved font file
+paths and a pre-rasterized glyph atlas for each monospace font in font_specs
+are cached on disk under the FontCache config directory.  Cache entries are
+keyed by the font file's mtime and size, so upgrading or swapping a font file
+invalidates them.  A second launch skips font discovery and rasterization
+entirely.
 
 Requirements
 ------------
 tto_globals : Program-wide global variable module for tto.
 pygame : library for the development of multimedia applications
+json : Read and write the font cache manifest.
+os : Font file stat() and cache directory handling.
+
+Classes
+-------
+GlyphAtlas : One font's printable ASCII glyphs rasterized on a single surface.
 
 Functions
 ---------
-init_fonts() : call pygame.font.SysFont() to initialize each desired typeface
+init_fonts() : Load each desired typeface and its glyph atlas, using the cache
+draw_text() : Compose a string from glyph atlas cells onto a surface.
+text_size() : The (width, height) draw_text() will draw a string at.
 """
 
 import pygame
 import tto_globals
+import json
+import os
 
 font = {}  # Fonts used throughout the project stored here as a dict
 
+atlas = {}  # GlyphAtlas objects for each font, using the same keys as font
+
+# The fixed font set used throughout the project:
+#   font key: (SysFont name, point size, bold)
+font_specs = {'x_small': ('courier', 12, False),
+              'small': ('courier', 16, False),
+              'small_bold': ('courier', 16, True),
+              'medium': ('courier', 24, False),
+              'medium_bold': ('courier', 24, True),
+              'large': ('courier', 40, False),
+              'large_bold': ('courier', 40, True),
+              'x_large': ('courier', 60, False)}
+
+# Bump this whenever the manifest or atlas layout changes so that old caches
+# are ignored instead of misread
+font_cache_version = 1
+
+
+class GlyphAtlas(object):
+    """Printable ASCII glyphs for one font, rasterized once in white.
+
+    Glyphs are laid out left to right on a single SRCALPHA surface, each in a
+    cell of fixed width (advance) and height.  Character code first_char is
+    at x=0, first_char+1 at x=advance, and so on.
+    """
+
+    first_char = 32  # ' '
+    char_count = 95  # Through '~'
+
+    def __init__(self, surface, advance, height):
+        self.surface = surface
+        self.advance = advance
+        self.height = height
+
+        # The source rect of every glyph, indexed by ord(char) - first_char
+        self.rects = [pygame.Rect(i * advance, 0, advance, height)
+                      for i in range(self.char_count)]
+
+        # Copies of surface tinted to each color drawn so far: {color: surface}
+        self.tinted = {}
+
+    @staticmethod
+    def monospace(font_object):
+        """True if every glyph of font_object is the same width, so a fixed
+        advance spaces them as font.render() would.  A proportional font,
+        e.g. pygame's default when courier isn't installed, would come out
+        clipped and unevenly spaced, so it gets no atlas.
+        """
+        return font_object.size("i")[0] == font_object.size("M")[0]
+
+    @classmethod
+    def rasterize(cls, font_object):
+        advance = font_object.size("M")[0]
+        height = font_object.get_height()
+        surface = pygame.Surface((advance * cls.char_count, height),
+                                 pygame.SRCALPHA)
+        for i in range(cls.char_count):
+            glyph = font_object.render(chr(cls.first_char + i), False,
+                                       (255, 255, 255))
+            surface.blit(glyph, (i * advance, 0))
+        return cls(surface, advance, height)
+
+    def has_glyphs(self, text):
+        for char in text:
+            code = ord(char) - self.first_char
+            if code < 0 or code >= self.char_count:
+                return False
+        return True
+
+    def glyph_rect(self, char):
+        return self.rects[ord(char) - self.first_char]
+
+    def tinted_surface(self, color):
+        """The atlas with every glyph in color.  Each color is tinted once
+        and kept, so composing a string is nothing but blits.
+        """
+        if color not in self.tinted:
+            tinted = self.surface.copy()
+            tinted.fill((color[0], color[1], color[2], 255),
+                        special_flags=pygame.BLEND_RGBA_MULT)
+            if pygame.display.get_surface() is not None:
+                # Match the display pixel format for faster blits
+                tinted = tinted.convert_alpha()
+            self.tinted[color] = tinted
+        return self.tinted[color]
+
+
+def font_file_key(path):
+    """(mtime, size) of a font file, or None if it can't be stat()ed.
+    A None path is pygame's built-in default font, which never changes.
+    """
+    if path is None:
+        return [0, 0]
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+
+def resolve_font(name, bold):
+    """Find a font file the way SysFont() would.
+    Returns (path, bold_synthetic).  If there is no dedicated bold face,
+    SysFont() falls back to the regular face with synthetic bold.
+    """
+    path = pygame.font.match_font(name, bold=bold)
+    bold_synthetic = False
+    if bold and path is not None and \
+            path == pygame.font.match_font(name, bold=False):
+        bold_synthetic = True
+    return path, bold_synthetic
+
 
-def init_fonts():
+def font_cache_dir():
+    cache_dir = tto_globals.config['tto']['FontCache'].strip('"')
+    if not cache_dir:
+        return None
+    return os.path.expanduser(cache_dir)
+
+
+def font_cache_load(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "fonts.json")) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('version') == font_cache_version:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'version': font_cache_version, 'fonts': {}, 'atlases': {}}
+
+
+def font_cache_save(cache_dir, manifest):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write then rename, so a crash mid-write never leaves a torn manifest
+        manifest_path = os.path.join(cache_dir, "fonts.json")
+        with open(manifest_path + ".tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    except OSError as e:
+        tto_globals.debugger.message("FONT",
+                                     "Could not write font cache: {}".
+                                     format(e))
+
+
+def init_fonts(scale=1.0):
     # Don't call this until after pygame.init() in the master module.
+    # scale multiplies every point size in font_specs, for rendering at a
+    # lower (or higher) internal resolution.  Atlases for each size are
+    # cached separately.
     global font
-    #print(pygame.font.get_fonts())
-    #exit()
+    global atlas
     try:
-        tto_globals.debugger.message("FONT", "Loading SysFonts")
-        font = {'x_small': pygame.font.SysFont('courier', 12),
-                'small': pygame.font.SysFont('courier', 16),
-                'small_bold': pygame.font.SysFont('courier', 16, bold=True),
-                'medium': pygame.font.SysFont('courier', 24),
-                'medium_bold': pygame.font.SysFont('courier', 24, bold=True),
-                'large': pygame.font.SysFont('courier', 40),
-                'large_bold': pygame.font.SysFont('courier', 40, bold=True),
-                'x_large': pygame.font.SysFont('courier', 60)}
+        tto_globals.debugger.message("FONT", "Loading fonts")
+        cache_dir = font_cache_dir()
+        manifest = {'version': font_cache_version, 'fonts': {},
+                    'atlases': {}}
+        if cache_dir:
+            manifest = font_cache_load(cache_dir)
+        manifest_changed = False
+
+        font = {}
+        atlas = {}
+        for font_key, (name, size, bold) in font_specs.items():
+            size = max(6, int(round(size * scale)))
+            # Resolve the font file, skipping the system font scan if the
+            # cached path is still the same file
+            resolve_key = "{}|{}".format(name, int(bold))
+            resolved = manifest['fonts'].get(resolve_key)
+            if resolved is None or \
+                    font_file_key(resolved['path']) != resolved['file_key']:
+                path, bold_synthetic = resolve_font(name, bold)
+                resolved = {'path': path,
+                            'bold_synthetic': bold_synthetic,
+                            'file_key': font_file_key(path)}
+                manifest['fonts'][resolve_key] = resolved
+                manifest_changed = True
+
+            font[font_key] = pygame.font.Font(resolved['path'], size)
+            if resolved['bold_synthetic']:
+                font[font_key].set_bold(True)
+
+            if not GlyphAtlas.monospace(font[font_key]):
+                tto_globals.debugger.message("FONT",
+                                             "{} is not monospace, drawing "
+                                             "it without a glyph atlas".
+                                             format(font_key))
+                continue
+
+            # Load the glyph atlas, or rasterize and cache it.  Each point
+            # size is cached separately, so switching render scales back and
+            # forth never re-rasterizes.
+            atlas_key = "{}_{}".format(font_key, size)
+            cached = manifest['atlases'].get(atlas_key)
+            if cached is not None and \
+                    cached['path'] == resolved['path'] and \
+                    cached['file_key'] == resolved['file_key'] and \
+                    cached['bold'] == bold:
+                try:
+                    atlas[font_key] = GlyphAtlas(
+                        pygame.image.load(os.path.join(cache_dir,
+                                                       cached['file'])),
+                        cached['advance'],
+                        cached['height'])
+                except (pygame.error, OSError):
+                    pass
+
+            if font_key not in atlas:
+                atlas[font_key] = GlyphAtlas.rasterize(font[font_key])
+                if cache_dir:
+                    atlas_file = "{}.png".format(atlas_key)
+                    try:
+                        os.makedirs(cache_dir, exist_ok=True)
+                        pygame.image.save(atlas[font_key].surface,
+                                          os.path.join(cache_dir, atlas_file))
+                        manifest['atlases'][atlas_key] = {
+                            'file': atlas_file,
+                            'path': resolved['path'],
+                            'file_key': resolved['file_key'],
+                            'bold': bold,
+                            'advance': atlas[font_key].advance,
+                            'height': atlas[font_key].height}
+                        manifest_changed = True
+                    except (pygame.error, OSError) as e:
+                        tto_globals.debugger.message(
+                            "FONT", "Could not cache glyph atlas {}: {}".
+                            format(font_key, e))
+
+        if cache_dir and manifest_changed:
+            tto_globals.debugger.message("FONT",
+                                         "Updating font cache in {}".
+                                         format(cache_dir))
+            font_cache_save(cache_dir, manifest)
     except Exception as e:
         tto_globals.debugger.message("EXCEPTION",
-                                     "Error loading SysFonts: {}".
+                                     "Error loading fonts: {}".
                                      format(e))
         tto_globals.debugger.exit("Could not load fonts.")
+
+
+def draw_text(surface, coordinates, text_label, font_key, color,
+              align="left"):
+    """Draw text_label onto surface using the glyph atlas for font_key.
+
+    Each glyph is blit from the (font, color) atlas at a fixed advance, so
+    no string is ever rasterized.  Fonts without an atlas, and strings with
+    characters outside it, fall back to font.render().  Returns the (width,
+    height) drawn.
+    """
+    glyphs = atlas.get(font_key)
+    if glyphs is None or not glyphs.has_glyphs(text_label):
+        text = font[font_key].render(text_label, False, color)
+        text_x = 0
+        text_y = 0
+        if align == "center":
+            text_x = int(text.get_width() / 2)
+            text_y = int(text.get_height() / 2)
+        surface.blit(text, [coordinates[0] - text_x,
+                            coordinates[1] - text_y])
+        return text.get_size()
+
+    advance = glyphs.advance
+    x = coordinates[0]
+    y = coordinates[1]
+    if align == "center":
+        x -= int(len(text_label) * advance / 2)
+        y -= int(glyphs.height / 2)
+
+    source = glyphs.tinted_surface(color)
+    rects = glyphs.rects
+    first_char = glyphs.first_char
+    surface.blits([(source, (x + (i * advance), y), rects[ord(char) -
+                                                          first_char])
+                   for i, char in enumerate(text_label) if char != " "],
+                  False)
+    return len(text_label) * advance, glyphs.height
+
+
+def text_size(text_label, font_key):
+    """The (width, height) draw_text() draws text_label at.  Atlas glyphs
+    are a fixed advance apart, which needn't match font.size() exactly.
+    """
+    glyphs = atlas.get(font_key)
+    if glyphs is None or not glyphs.has_glyphs(text_label):
+        return font[font_key].size(text_label)
+    return len(text_label) * glyphs.advance, glyphs.height
@@ -57,13 +57,66 @@ config['DEFAULT'] = {'MidiOutEnabled': 'False',
                      'CanvasWidth': '1920',
                      'CanvasHeight': '1080',
                      'GraphicsEnabled': 'True',
-                     'Powermate': 'False'}
+                     'Powermate': 'False',
+                     'FontCache': '~/.cache/tto',
+                     'FpsMax': '60',
+                     'VSync': 'False',
+                     'RenderThread': 'False',
+                     'SharedStateName': '',
+                     'RenderScale': '1.0',
+                     'PowermateDevice': '/dev/input/powermate',
+                     'PowermateDetents': '4',
+                     'HelmAnimationMs': '250',
+                     'HelmFrameBudgetMs': '8',
+                     'MaxPolyphony': '16',
+                     'VoiceStealing': 'oldest',
+                     'MidiOutChannels': '',
+                     'HarmonizerEnabled': 'False',
+                     'HarmonizerVoices': '',
+                     'ClockSource': 'midi',
+                     'ClockBpm': '120',
+                     'ArpEnabled': 'False',
+                     'ArpMode': 'up',
+                     'ArpDivision': '1/16',
+                     'ArpGate': '3',
+                     'LoopBars': '2',
+                     'SessionLogDir': '',
+                     'LogLevel': 'info',
+                     'LogLevels': '',
+                     'TraceEnabled': 'False',
+                     'TraceDir': '',
+                     'TraceSpans': '65536',
+                     'TraceMinUs': '20',
+                     'TerminalHz': '10',
+                     'LogCoalesceMs': '100',
+                     'LogRate': '100',
+                     'LogRates': '',
+                     'MidiBackend': 'hardware',
+                     'MidiVirtualTraffic': 'clock=120',
+                     'GovernorEnabled': 'True',
+                     'GovernorBudgetMs': '2',
+                     'GovernorWindowMs': '250',
+                     'MidiOutBaud': '0',
+                     'MidiOutRunningStatus': 'True',
+                     'WatchdogEnabled': 'True',
+                     'WatchdogStallMs': '200'}
 # Create a ['tto'] section containing the above defaults:
 config['tto'] = {}
 
 # Load the config file values overtop of the defaults above:
 config_file_load("tto.cfg")
 
+# Drop debug messages etc. as configured from here on
+try:
+    debugger.set_levels(config['tto']['LogLevel'], config['tto']['LogLevels'])
+except KeyError as e:
+    debugger.message("EXCEPTION", "Unknown log level {} in .cfg file", e)
+try:
+    debugger.set_rates(config['tto']['LogRate'], config['tto']['LogRates'],
+                       config['tto']['LogCoalesceMs'])
+except ValueError as e:
+    debugger.message("EXCEPTION", "Invalid log rate in .cfg file: {}", e)
+
 # Define some colors for convenience and readability
 color_black = (0, 0, 0)
 color_white = (64, 23, 4)
@@ -105,9 +158,49 @@ events = {}
 #    'NA' = Unknown event type
 #    'KU' = KeyUp with keycode in 'keycode'
 #    'KD' = KeyDown with keycode in 'keycode'
+#    'RO' = Powermate rotation, net detents since last time in 'delta'
+#           (positive is clockwise).  'keycode' is None.
+#    'PB' = Powermate button, number of presses in 'presses'.
+#           'keycode' is None.
 
 running = False  # Main loop running boolean.  Set to false and program ends.
 
 midi = None  # None until this is set-up by tto.py
 
+voices = None  # tto_voices.VoiceManager between key and midi, set-up by tto.py
+
+# If HarmonizerEnabled, a tto_harmonizer.TtoHarmonizer remapping MIDI In notes
+# in to the current key and scale degree.  Set-up by tto.py
+harmonizer = None
+
+# tto_arpeggiator.TtoArpeggiator, stepped by midi clock pulses.  Set-up by
+# tto.py, and switched on and off from the keyboard fn buttons.
+arpeggiator = None
+
+# tto_looper.TtoLooper, stepped by midi clock pulses.  Set-up by tto.py, and
+# controlled from the keyboard fn buttons.
+looper = None
+
 pygame = None  # None until set-up by tto.py
+
+# If TraceEnabled, a tto_trace.TtoTracer recording timeline spans.  Set-up by
+# tto.py.  Call sites check it's not None before recording.
+tracer = None
+
+# If GovernorEnabled, a tto_governor.LoadGovernor shedding UI and logging
+# work when the main loop falls behind.  Set-up by tto.py.
+governor = None
+
+# If WatchdogEnabled, a tto_watchdog.StallWatchdog logging where the main
+# loop was when it stalls.  Set-up by tto.py, started by tto_run().
+watchdog = None
+
+powermate = None  # If Powermate enabled, TtoPowermate set-up by tto.py
+
+# Immutable tto_snapshot.StateSnapshot of key and midi state.  Republished
+# once per main loop run by tto.py.  Renderers read this, never key or midi.
+snapshot = None
+
+# If SharedStateName is configured, a tto_sharedstate.SharedStateWriter
+# mirroring each changed snapshot for external processes.  Set-up by tto.py
+shared_state = None
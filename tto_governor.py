@@ -0,0 +1,213 @@
+"""tto_governor - load shedding for the tto main loop
+
+MIDI In is only read once per main loop run, so anything that makes a run
+long, like rendering a frame or printing a burst of log messages, holds up
+clock and note relay.  The governor watches how long each main loop run
+takes and, when the loop falls behind, sheds the work that can wait, in
+priority order:
+
+1 frames : Only render one in every shed_frame_divisor due frames.
+2 terminal : Refresh "hz" surfaces like the terminal shed_refresh_stretch
+             times less often, so more log messages are merged in to each
+             redraw.
+3 logging : Defer messages below WARNING.  They're kept, and written out
+            a few at a time once the loop has caught up.
+
+Each level sheds everything the levels below it do.  MIDI handling is never
+shed, delayed or reordered.
+
+A MIDI message arrives at a random moment, and waits for the main loop run
+in progress to finish before it's read.  So the load measured is the mean
+wait, the sum of each run's duration squared over twice the total, per
+window.  A loop spinning through quick runs with an occasional long frame
+scores the long frame, not the average run.  Over GovernorBudgetMs, the
+level goes up one a window.  Under half of it for shed_hold windows in a row,
+it comes down one.
+
+Only a window in which MIDI In delivered messages can go over budget.  With
+nothing arriving, nothing waited, however long the runs were, so a quiet
+window counts as under budget and rendering at full rate is left alone.
+
+Level changes are logged under LOAD, and stats() has the counters, which are
+logged on exit.
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+tto_sessionlog : Log level codes.
+time : perf_counter() for timing main loop runs.
+
+Classes
+-------
+LoadGovernor : Main loop load monitor and shedding levels.
+"""
+
+import tto_globals
+import time
+from tto_sessionlog import INFO, WARNING
+
+# Shedding levels
+shed_none = 0
+shed_frames = 1
+shed_terminal = 2
+shed_logging = 3
+
+shed_level_names = ("none", "frames", "terminal", "logging")
+
+# At shed_frames and up, one of every this many due frames is rendered
+shed_frame_divisor = 4
+
+# At shed_terminal and up, "hz" surfaces refresh this many times less often
+shed_refresh_stretch = 4
+
+# Windows in a row under half the budget before the level comes down one
+shed_hold = 4
+
+# Deferred log messages written out per main loop run, once caught up
+deferred_per_run = 20
+
+
+class LoadGovernor(object):
+    def __init__(self, budget=0.002, window=0.25):
+        # Mean wait for MIDI In, in seconds, that counts as falling behind
+        self.budget = budget
+        self.window = window
+
+        self.clock = time.perf_counter
+        self.level = shed_none
+
+        # Multiplier for "hz" surface refresh intervals.  1 unless shedding
+        # terminal updates.
+        self.refresh_stretch = 1
+
+        # The current window.  Sums of main loop run durations, and of their
+        # squares.
+        self.run_last = self.clock()
+        self.window_start = self.run_last
+        self.window_total = 0.0
+        self.window_squares = 0.0
+        self.windows_under = 0
+        # TtoMidi.messages_received as the current window started
+        self.window_received = 0
+
+        # The last window's mean wait for MIDI In, and the worst seen
+        self.wait = 0.0
+        self.wait_max = 0.0
+
+        # Frames due while shedding frames, for picking which to render
+        self.frames_due = 0
+
+        # Counters
+        self.windows = 0
+        self.windows_over = 0
+        self.windows_quiet = 0
+        self.level_entered = [0] * len(shed_level_names)
+        self.level_time = [0.0] * len(shed_level_names)
+        self.level_since = self.run_last
+        self.frames_shed = 0
+        self.refreshes_stretched = 0
+
+    def start(self):
+        """Call as the main loop starts, so set-up time isn't counted as a
+        main loop run.
+        """
+        self.run_last = self.clock()
+        self.window_start = self.run_last
+        self.window_total = 0.0
+        self.window_squares = 0.0
+        self.window_received = self.midi_received()
+
+    def midi_received(self):
+        midi = tto_globals.midi
+        return midi.messages_received if midi else 0
+
+    def tick(self):
+        """Call once at the top of every main loop run."""
+        now = self.clock()
+        duration = now - self.run_last
+        self.run_last = now
+        self.window_total += duration
+        self.window_squares += duration * duration
+        if now - self.window_start >= self.window:
+            self.window_end(now)
+        elif self.level < shed_logging and tto_globals.debugger.deferred:
+            tto_globals.debugger.deferred_flush(deferred_per_run)
+
+    def window_end(self, now):
+        self.windows += 1
+        if self.window_total:
+            self.wait = self.window_squares / (2 * self.window_total)
+        else:
+            self.wait = 0.0
+        if self.wait > self.wait_max:
+            self.wait_max = self.wait
+        self.window_start = now
+        self.window_total = 0.0
+        self.window_squares = 0.0
+        received = self.midi_received()
+        quiet = received == self.window_received
+        self.window_received = received
+        if quiet:
+            self.windows_quiet += 1
+
+        if self.wait > self.budget and not quiet:
+            self.windows_over += 1
+            self.windows_under = 0
+            if self.level < shed_logging:
+                self.level_set(self.level + 1, now)
+        elif self.wait < self.budget / 2 or quiet:
+            self.windows_under += 1
+            if self.level > shed_none and self.windows_under >= shed_hold:
+                self.windows_under = 0
+                self.level_set(self.level - 1, now)
+        else:
+            self.windows_under = 0
+
+    def level_set(self, level, now):
+        self.level_time[self.level] += now - self.level_since
+        self.level_since = now
+        self.level_entered[level] += 1
+        rising = level > self.level
+        self.level = level
+
+        self.refresh_stretch = 1
+        if level >= shed_terminal:
+            self.refresh_stretch = shed_refresh_stretch
+        tto_globals.debugger.deferring = level >= shed_logging
+
+        # WARNING going up, so it's never deferred itself
+        tto_globals.debugger.message(
+            "LOAD", "Shedding {}, MIDI In wait {:.2f} ms over {:.2f} ms budget"
+            if rising else
+            "Shedding {}, MIDI In wait {:.2f} ms under {:.2f} ms budget",
+            shed_level_names[level], self.wait * 1000, self.budget * 1000,
+            level=WARNING if rising else INFO)
+
+    def frame_shed(self):
+        """Whether to skip a frame that's due.  Counts it if so."""
+        if self.level < shed_frames:
+            return False
+        self.frames_due += 1
+        if self.frames_due % shed_frame_divisor:
+            self.frames_shed += 1
+            return True
+        return False
+
+    def stats(self):
+        level_time = list(self.level_time)
+        level_time[self.level] += self.clock() - self.level_since
+        return {'level': shed_level_names[self.level],
+                'wait_ms': round(self.wait * 1000, 3),
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+                'windows': self.windows,
+                'windows_over': self.windows_over,
+                'windows_quiet': self.windows_quiet,
+                'level_entered': dict(zip(shed_level_names,
+                                          self.level_entered)),
+                'level_seconds': {shed_level_names[level]:
+                                  round(level_time[level], 1)
+                                  for level in range(len(shed_level_names))},
+                'frames_shed': self.frames_shed,
+                'refreshes_stretched': self.refreshes_stretched,
+                'messages_deferred': tto_globals.debugger.messages_deferred,
+                'deferred_dropped': tto_globals.debugger.deferred_dropped}
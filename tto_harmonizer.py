@@ -0,0 +1,185 @@
+"""tto_harmonizer - scale degree harmonizer for incoming MIDI notes
+
+This module puts notes arriving on MIDI In through the same key and scale
+degree logic as the computer keyboard.  Each incoming note is quantized down
+to the nearest tone of the current key, moved up the scale to the mode the
+current scale degree selects, and optionally doubled by diatonic harmony
+voices, e.g. a third and a fifth above.
+
+The scale degree is a position around the circle of fifths, the same one
+Key.trigger() uses, so degree 1 in C is G Mixolydian.  Its mode's step in
+Key.fifths says how far up the scale to move: the key's tonic comes out as
+the note the keyboard's first chord key plays.
+
+All of that is worked out ahead of time.  There's one 128-entry table per
+voice mapping incoming note number to outgoing note number, rebuilt only when
+Key.set_key() or Key.set_scale_degree() changes the key or scale degree.
+Handling a message is then one index per voice, however dense the incoming
+controller stream is.
+
+A note off has to turn off what its note on turned on, even if the key has
+changed since.  So each held note remembers the tables it was played with.
+
+Usage
+-----
+python tto_harmonizer.py
+
+Checks, for every key and scale degree, that the harmonizer maps the key's
+tonic to the keyboard's first chord note and plays the same pitch set as the
+keyboard.  Exits 1 on a mismatch.
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+sys : Exit status of the check.
+
+Classes
+-------
+TtoHarmonizer : Incoming MIDI note remapper with precomputed tables.
+
+Functions
+---------
+parse_voices() : Parse the HarmonizerVoices config setting.
+keyboard_check() : Compare the harmonizer with the keyboard.
+"""
+
+import tto_globals
+import sys
+
+# Semitones above the tonic of each tone of the major scale.  Going around
+# tto's circle of fifths, the diatonic positions 11, 0-5 of a key are exactly
+# these tones.
+major_scale = (0, 2, 4, 5, 7, 9, 11)
+
+# For each semitone above the tonic 0-11, the scale tone at or below it
+quantize_down = [max(i for i, tone in enumerate(major_scale)
+                     if tone <= semitone)
+                 for semitone in range(12)]
+
+# Table entry for an outgoing note that would fall outside 0-127
+note_none = 0xFF
+
+
+class TtoHarmonizer(object):
+    def __init__(self, voices=None):
+        # Diatonic steps above the played note for each voice.  Voice 0 is
+        # the played note itself.
+        self.voices = [0] + (voices or [])
+
+        # Tables for the current key and scale degree, one per voice.
+        # A tuple, replaced whole on rebuild, so a held note's reference to
+        # the tables it played with stays valid.
+        self.tables = ()
+
+        # [incoming note number] = the tables it was played with, or None
+        self.held = [None] * 128
+
+        self.rebuild()
+
+    def rebuild(self):
+        key = tto_globals.key
+        tonic = key.notes[key.current_key]['kbNum']
+        # Diatonic steps from the key's tonic up to the mode's, as
+        # Key.trigger() would play it
+        mode_steps = key.fifths[key.fifths_position(0)]["step"] - 1
+        tables = []
+        for steps in self.voices:
+            table = bytearray(128)
+            for note in range(128):
+                semitone = (note - tonic) % 12
+                octave_base = note - semitone
+                degree = quantize_down[semitone] + mode_steps + steps
+                note_out = octave_base + (12 * (degree // 7)) + \
+                    major_scale[degree % 7]
+                if 0 <= note_out <= 127:
+                    table[note] = note_out
+                else:
+                    table[note] = note_none
+            tables.append(table)
+        self.tables = tuple(tables)
+
+        tto_globals.debugger.message("MIDI",
+                                     "Harmonizer tables rebuilt: key {}, "
+                                     "degree {}".format(
+                                         key.current_key,
+                                         key.current_scale_degree))
+
+    def note_on(self, note, velocity):
+        if self.held[note] is not None:
+            # Retriggered without a note off in between
+            self.note_off(note)
+        tables = self.tables
+        self.held[note] = tables
+        for table in tables:
+            note_out = table[note]
+            if note_out != note_none:
+                tto_globals.key.midi_note_hold(note_out, velocity)
+
+    def note_off(self, note):
+        tables = self.held[note]
+        if tables is None:
+            return
+        self.held[note] = None
+        for table in tables:
+            note_out = table[note]
+            if note_out != note_none:
+                tto_globals.key.midi_note_release(note_out)
+
+    def handle_message(self, midi_msg):
+        """Harmonize a note_on or note_off mido message."""
+        if midi_msg.type == "note_on" and midi_msg.velocity > 0:
+            self.note_on(midi_msg.note, midi_msg.velocity)
+        else:
+            self.note_off(midi_msg.note)
+
+
+def parse_voices(voices_config):
+    """Parse a HarmonizerVoices setting, a list of intervals above the played
+    note like "3,5" (a third and a fifth), into diatonic steps [2, 4].
+    """
+    voices = []
+    for interval in voices_config.strip('"').split(","):
+        interval = interval.strip()
+        if interval:
+            if int(interval) < 1:
+                raise ValueError("Harmony interval {} must be 1 or more".
+                                 format(interval))
+            voices.append(int(interval) - 1)
+    return voices
+
+
+def keyboard_check():
+    """For every key and scale degree, compare the harmonizer's output for
+    the key's seven tones with the notes the seven chord keys play.  Returns
+    a list of mismatches, empty if they agree.
+    """
+    key = tto_globals.key
+    harmonizer = TtoHarmonizer()
+    mismatches = []
+    for current_key in range(12):
+        key.current_key = current_key
+        tonic = key.notes[current_key]['kbNum']
+        for scale_degree in range(7):
+            key.current_scale_degree = scale_degree
+            harmonizer.rebuild()
+            keyboard = [key.notes[(key.fifths_position(note_index) +
+                                   current_key) % 12]['kbNum']
+                        for note_index in range(7)]
+            harmonized = [harmonizer.tables[0][60 + tonic + tone] % 12
+                          for tone in major_scale]
+            if harmonized[0] != keyboard[0] or \
+                    set(harmonized) != set(keyboard):
+                mismatches.append((current_key, scale_degree, harmonized,
+                                   keyboard))
+    return mismatches
+
+
+if __name__ == "__main__":
+    tto_globals.debugger.printEnabled = False
+    check_mismatches = keyboard_check()
+    for check_key, check_degree, check_harmonized, check_keyboard in \
+            check_mismatches:
+        print("key {} degree {}: harmonizer {} keyboard {}".format(
+            check_key, check_degree, check_harmonized, check_keyboard))
+    print("{} of 84 keys and degrees differ".format(len(check_mismatches)))
+    sys.exit(1 if check_mismatches else 0)
@@ -8,6 +8,7 @@ available program-wide.
 Requirements
 ------------
 tto_globals : Program-wide global variable module for tto.
+tto_debugger : Log message category codes.
 
 Classes
 -------
@@ -15,6 +16,7 @@ Key : key, scale, and chord data class
 """
 
 import tto_globals
+from tto_debugger import category_key
 
 
 class Key(object):
@@ -31,8 +33,21 @@ class Key(object):
         # c0 = 24
         self.c0_offset = 24
 
-        self.notes_on = {}  # dict containing key.notes indices currently
-        # playing 0-11
+        # Notes currently playing, as a 12 bit mask.  Bit n is set while
+        # key.notes index n (0-11, arranged by fifths) has at least one
+        # holder.  An int, so it's cheap to copy into snapshots and to
+        # test or rotate as a whole.
+        self.notes_on_mask = 0
+
+        # Counts every change to the state snapshots copy from Key, so
+        # tto_snapshot.publish() can tell when there's nothing new
+        self.state_changes = 0
+
+        # How many keys are holding each key.notes index 0-11, and each MIDI
+        # note number 0-127.  Two keyboard keys can land on the same note,
+        # so a note is only turned off once its last holder lets go.
+        self.notes_on_count = bytearray(12)
+        self.midi_notes_on = bytearray(128)
 
         self.keyboard_keys_down = {}  # dict containing event keycodes which
         # previously triggered a keydown.  So they're presumably still down.
@@ -88,30 +103,35 @@ class Key(object):
         self.key_scale_ordered = [0, 2, 4, 11, 1, 3, 5]
 
     def set_key(self, new_key):
-        tto_globals.debugger.message(
-            "KEY_",
-            "Set Scale Degree to {}".format(new_key)
-        )
+        tto_globals.debugger.message(category_key,
+                                     "Set Key to {}", new_key)
         self.current_key = new_key
+        self.state_changes += 1
+        if tto_globals.harmonizer:
+            tto_globals.harmonizer.rebuild()
 
     def set_scale_degree(self, scale_degree):
-        tto_globals.debugger.message(
-            "KEY_",
-            "Set Scale Degree to {}".format(scale_degree)
-        )
+        tto_globals.debugger.message(category_key,
+                                     "Set Scale Degree to {}", scale_degree)
         self.current_scale_degree = scale_degree
+        self.state_changes += 1
+        if tto_globals.harmonizer:
+            tto_globals.harmonizer.rebuild()
 
-    def trigger(self, note_index, keycode, mode="play"):
-
+    def fifths_position(self, note_index):
         # The keyboard will be sending an index of note from the key binding
         # Need to add the scale degree and wrap at 7 because the scale will be
         # 0-6 (7 tones)
-        target_note = ((note_index +
-                        self.current_scale_degree)
-                       % 7)
+        position = (note_index + self.current_scale_degree) % 7
         # If it's 6, it's 11.  We skip the non-diatonics 6,7,8,9,10
-        if target_note == 6:
-            target_note = 11
+        if position == 6:
+            position = 11
+        return position
+
+    def trigger(self, note_index, keycode, mode="play"):
+
+        # Position around the circle of fifths, relative to the key
+        target_note = self.fifths_position(note_index)
 
         # now offset by the key and wrap at 12.  all chromatic tones are 0-11
         target_note = (target_note + self.current_key) % 12
@@ -122,16 +142,20 @@ class Key(object):
         # otherwise the stops will be against the position of the note NOW
         # instead of what it was THEN
         if mode == "stop":
-            if keycode in self.keyboard_keys_down:
-                target_note = self.keyboard_keys_down[keycode]
+            if keycode not in self.keyboard_keys_down:
+                return
+            target_note = self.keyboard_keys_down.pop(keycode)
+        elif keycode in self.keyboard_keys_down:
+            # Key autorepeat.  This key is already holding its note.
+            return
 
         tto_globals.debugger.message(
-            "KEY_",
-            "MidiCalc Mode: {}, kbcode: {}, index: {}, t_note: {}".
-            format(mode,
-                   keycode,
-                   note_index,
-                   target_note)
+            category_key,
+            "MidiCalc Mode: {}, kbcode: {}, index: {}, t_note: {}",
+            mode,
+            keycode,
+            note_index,
+            target_note
         )
 
         # calculate the midi note to target
@@ -140,26 +164,72 @@ class Key(object):
         midi_kbnum_adj = midi_kbnum_base + self.c0_offset + (12 * self.octave)
 
         tto_globals.debugger.message(
-            "KEY_",
-            "MidiCalc Name: {}, Base: {}, Oct: {}, c0: {}, ** ADJ: {}".
-            format(midi_note_name,
-                   midi_kbnum_base,
-                   self.octave,
-                   self.c0_offset,
-                   midi_kbnum_adj)
+            category_key,
+            "MidiCalc Name: {}, Base: {}, Oct: {}, c0: {}, ** ADJ: {}",
+            midi_note_name,
+            midi_kbnum_base,
+            self.octave,
+            self.c0_offset,
+            midi_kbnum_adj
         )
 
         if mode == "play":
             self.keyboard_keys_down[keycode] = target_note
 
-            if target_note in self.notes_on:
-                self.trigger(note_index, keycode, mode="stop")
+            if self.notes_on_count[target_note] < 255:
+                self.notes_on_count[target_note] += 1
+            self.notes_on_mask |= 1 << target_note
+            self.state_changes += 1
+
+            if tto_globals.looper:
+                tto_globals.looper.record(midi_kbnum_adj, 100)
 
-            tto_globals.midi.send(midi_kbnum_adj, mode)
-            self.notes_on[target_note] = True
+            if tto_globals.arpeggiator and tto_globals.arpeggiator.enabled:
+                # The arpeggiator plays it, in time
+                tto_globals.arpeggiator.note_add(midi_kbnum_adj)
+            else:
+                self.midi_note_hold(midi_kbnum_adj)
 
         if mode == "stop":
-            if keycode in self.keyboard_keys_down:
-                tto_globals.midi.send(midi_kbnum_adj, mode)
-                del self.notes_on[self.keyboard_keys_down[keycode]]
-                del self.keyboard_keys_down[keycode]
+            if self.notes_on_count[target_note]:
+                self.notes_on_count[target_note] -= 1
+            if not self.notes_on_count[target_note]:
+                self.notes_on_mask &= ~(1 << target_note)
+                self.state_changes += 1
+
+            if tto_globals.looper:
+                tto_globals.looper.record(midi_kbnum_adj, 0)
+
+            if not (tto_globals.arpeggiator and
+                    tto_globals.arpeggiator.note_remove(midi_kbnum_adj)):
+                self.midi_note_release(midi_kbnum_adj)
+
+    def midi_note_hold(self, midi_note, velocity=100):
+        # Add a holder to MIDI note midi_note.  Only the first holder sends
+        # the note on.
+        if self.midi_notes_on[midi_note] < 255:
+            self.midi_notes_on[midi_note] += 1
+        if self.midi_notes_on[midi_note] == 1:
+            tto_globals.voices.note_on(midi_note, velocity)
+
+    def midi_note_release(self, midi_note):
+        # Remove a holder from MIDI note midi_note.  Only the last holder
+        # sends the note off.
+        if self.midi_notes_on[midi_note]:
+            self.midi_notes_on[midi_note] -= 1
+            if not self.midi_notes_on[midi_note]:
+                tto_globals.voices.note_off(midi_note)
+
+    def note_is_on(self, note_index):
+        """True if key.notes index note_index 0-11 is currently playing."""
+        return bool(self.notes_on_mask & (1 << note_index))
+
+    def notes_on_rotated(self, offset, mask=None):
+        """Return the 12 bit notes on mask (or mask, if given) rotated so
+        that bit n is key.notes index (n + offset) % 12.  With offset
+        current_key, bit n is then wheel position n.
+        """
+        if mask is None:
+            mask = self.notes_on_mask
+        offset %= 12
+        return ((mask >> offset) | (mask << (12 - offset))) & 0xFFF
@@ -0,0 +1,278 @@
+"""tto_latency - keypress to MIDI latency harness for tto
+
+Measures how long a key press takes to come out of tto as a note_on, and a
+key release as a note_off, through the real program.  tto_init() and
+tto_run() run as usual against SDL's dummy video driver, with an in-process
+capture port standing in for MIDI Out.  A script thread posts KEYDOWN and
+KEYUP events for the chord row in to pygame's event queue, and each one is
+timestamped at four stages:
+
+inject : Posted to pygame's event queue.
+input : Seen by TtoPygame.handle_input_key().
+trigger : Key.trigger() called for it by the keyboard map.
+send : The resulting note message sent to the MIDI Out port.
+
+and the time between stages is reported as a distribution, per stage and
+end to end.  inject to input is mostly waiting for the next input poll, so
+it moves with FpsMax and with anything that holds up the main loop.
+
+Usage
+-----
+python tto_latency.py [--presses N] [--hold MS] [--gap MS]
+                      [--fps N] [--render-thread] [--fail-over MS]
+
+With --fail-over, exits 1 if the end to end 99th percentile is slower than
+MS milliseconds, for catching regressions in CI.
+
+Requirements
+------------
+argparse : Command line parsing.
+atexit : Take tto's own exit handler out of the way.
+os : Select SDL's dummy video driver.
+random : Jitter between scripted key presses.
+sys : Exit status.
+threading : The script thread posting key events.
+time : perf_counter() for timestamps.
+mido : Base class for the capture port.
+pygame : Event injection.
+tto : The program under test.
+
+Classes
+-------
+CapturePort : In-process MIDI Out port recording when notes are sent.
+LatencyHarness : Scripted key input and per-stage timestamps.
+
+Functions
+---------
+report() : Print the distribution of a list of latencies in ms.
+"""
+
+import argparse
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import mido
+import pygame
+import tto
+import tto_globals
+
+# The stages each key event is timestamped at, in order
+stages = ("inject", "input", "trigger", "send")
+
+# Chord row key codes, a s d f g h j, played in turn
+chord_keycodes = (97, 115, 100, 102, 103, 104, 106)
+
+
+class CapturePort(mido.ports.BaseOutput):
+    """A MIDI Out port that sends nowhere, and tells the harness when each
+    note message was sent.
+    """
+    def __init__(self, harness):
+        self.harness = harness
+        super(CapturePort, self).__init__(name="tto_latency capture")
+
+    def _send(self, midi_msg):
+        if midi_msg.type in ("note_on", "note_off"):
+            self.harness.stage("send", self.harness.triggering)
+
+
+class LatencyHarness(object):
+    def __init__(self, presses=200, hold=0.05, gap=0.05):
+        self.presses = presses
+        self.hold = hold
+        self.gap = gap
+
+        # [event id] = {stage: perf_counter() time}.  Even ids are key
+        # downs, odd ids key ups.
+        self.timestamps = {}
+
+        # [(event type, keycode)] = id of the injected event handle_input_key
+        # has seen, waiting for its Key.trigger()
+        self.waiting = {}
+
+        # The id of the event whose Key.trigger() is running, so sends
+        # during it are put down to it
+        self.triggering = None
+
+        self.script_thread = None
+
+    def stage(self, stage, event_id):
+        if event_id is None:
+            return
+        self.timestamps[event_id].setdefault(stage, time.perf_counter())
+
+    def instrument(self):
+        # Wrap the two stages inside tto.  Instance attributes, so only
+        # this run is affected.
+        handle_input_key = tto_globals.pygame.handle_input_key
+        trigger = tto_globals.key.trigger
+        harness = self
+
+        def handle_input_key_timed(event):
+            event_id = getattr(event, "latency_id", None)
+            if event_id is not None:
+                harness.stage("input", event_id)
+                harness.waiting[("play" if event.type == pygame.KEYDOWN
+                                 else "stop", event.key)] = event_id
+            handle_input_key(event)
+
+        def trigger_timed(note_index, keycode, mode="play"):
+            event_id = harness.waiting.pop((mode, keycode), None)
+            harness.stage("trigger", event_id)
+            harness.triggering = event_id
+            try:
+                trigger(note_index, keycode, mode=mode)
+            finally:
+                harness.triggering = None
+
+        tto_globals.pygame.handle_input_key = handle_input_key_timed
+        tto_globals.key.trigger = trigger_timed
+        tto_globals.midi.ports["MidiOutPort"] = CapturePort(self)
+
+    def inject(self, event_id, event_type, keycode):
+        self.timestamps[event_id] = {}
+        self.stage("inject", event_id)
+        pygame.event.post(pygame.event.Event(event_type, key=keycode,
+                                             mod=0, latency_id=event_id))
+
+    def script(self):
+        # Give the main loop a moment to get going
+        time.sleep(0.5)
+        for press in range(self.presses):
+            if not tto_globals.running:
+                break
+            keycode = chord_keycodes[press % len(chord_keycodes)]
+            self.inject(press * 2, pygame.KEYDOWN, keycode)
+            time.sleep(self.hold)
+            self.inject((press * 2) + 1, pygame.KEYUP, keycode)
+            # Jitter, so presses land all over the input poll interval
+            time.sleep(self.gap * random.uniform(0.5, 1.5))
+        # Let the last events through
+        time.sleep(0.25)
+        tto_globals.running = False
+
+    def run(self):
+        self.instrument()
+        self.script_thread = threading.Thread(target=self.script,
+                                              name="tto latency script",
+                                              daemon=True)
+        tto_globals.running = True
+        self.script_thread.start()
+        tto.tto_run()
+        self.script_thread.join()
+
+    def latencies(self, event_types=(0, 1)):
+        """{stage pair label: [seconds]} for key downs (0) and/or ups (1)"""
+        latencies = {}
+        for event_id in sorted(self.timestamps):
+            if event_id % 2 not in event_types:
+                continue
+            timestamps = self.timestamps[event_id]
+            for first, second in zip(stages, stages[1:]):
+                if first in timestamps and second in timestamps:
+                    latencies.setdefault("{} -> {}".format(first, second),
+                                         []).append(timestamps[second] -
+                                                    timestamps[first])
+            if "send" in timestamps:
+                latencies.setdefault("inject -> send (total)", []).append(
+                    timestamps["send"] - timestamps["inject"])
+        return latencies
+
+    def lost(self):
+        return [event_id for event_id in self.timestamps
+                if "send" not in self.timestamps[event_id]]
+
+
+def report(label, latencies):
+    """Print min / median / p90 / p99 / max of latencies given in seconds."""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    print("{:<28} n={:<5} min {:7.3f}  p50 {:7.3f}  p90 {:7.3f}  "
+          "p99 {:7.3f}  max {:7.3f} ms".format(
+              label, count,
+              latencies[0] * 1000,
+              latencies[count // 2] * 1000,
+              latencies[int(count * 0.9)] * 1000,
+              latencies[min(count - 1, int(count * 0.99))] * 1000,
+              latencies[-1] * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="tto keypress to MIDI latency harness")
+    parser.add_argument("--presses", type=int, default=200,
+                        help="Number of key presses to script")
+    parser.add_argument("--hold", type=float, default=50,
+                        help="How long each key is held, in ms")
+    parser.add_argument("--gap", type=float, default=50,
+                        help="Average gap between presses, in ms")
+    parser.add_argument("--fps", type=int,
+                        help="FpsMax to run with, default from tto.cfg")
+    parser.add_argument("--render-thread", action="store_true",
+                        help="Run with RenderThread = True")
+    parser.add_argument("--fail-over", type=float,
+                        help="Exit 1 if the total p99 is over this many ms")
+    arguments = parser.parse_args()
+
+    # tto as configured, but windowed, quiet, and with no real MIDI ports,
+    # arpeggiator or harmonizer between the keys and MIDI Out
+    tto_globals.debugger.printEnabled = False
+    tto_globals.config['tto']['FullScreen'] = 'False'
+    tto_globals.config['tto']['GraphicsEnabled'] = 'True'
+    tto_globals.config['tto']['MidiInEnabled'] = 'False'
+    tto_globals.config['tto']['MidiOutEnabled'] = 'False'
+    tto_globals.config['tto']['ArpEnabled'] = 'False'
+    tto_globals.config['tto']['HarmonizerEnabled'] = 'False'
+    tto_globals.config['tto']['Powermate'] = 'False'
+    tto_globals.config['tto']['SessionLogDir'] = ''
+    tto_globals.config['tto']['SharedStateName'] = ''
+    if arguments.fps is not None:
+        tto_globals.config['tto']['FpsMax'] = str(arguments.fps)
+    if arguments.render_thread:
+        tto_globals.config['tto']['RenderThread'] = 'True'
+
+    tto.tto_init()
+    # Clean up here instead, without tto_terminate()'s sys.exit()
+    atexit.unregister(tto.tto_terminate)
+
+    harness = LatencyHarness(arguments.presses,
+                             arguments.hold / 1000,
+                             arguments.gap / 1000)
+    try:
+        harness.run()
+    finally:
+        try:
+            tto.tto_terminate()
+        except SystemExit:
+            pass
+
+    print("FpsMax {}  RenderThread {}".format(
+        tto_globals.config['tto']['FpsMax'],
+        tto_globals.config['tto']['RenderThread']))
+    status = 0
+    for event_types, title in (((0,), "KEYDOWN -> note_on"),
+                               ((1,), "KEYUP -> note_off")):
+        print(title)
+        latencies = harness.latencies(event_types)
+        for label in latencies:
+            report("  " + label, latencies[label])
+    total = harness.latencies().get("inject -> send (total)")
+    if not total:
+        print("No notes captured")
+        status = 1
+    elif arguments.fail_over is not None:
+        p99 = sorted(total)[min(len(total) - 1, int(len(total) * 0.99))]
+        if p99 * 1000 > arguments.fail_over:
+            print("FAIL: total p99 {:.3f} ms over {:.3f} ms".format(
+                p99 * 1000, arguments.fail_over))
+            status = 1
+    if harness.lost():
+        print("{} key events never reached MIDI Out".format(
+            len(harness.lost())))
+    sys.exit(status)
@@ -0,0 +1,179 @@
+"""tto_looper - clock synced pattern recorder and looper for tto
+
+The looper records what's played on the chord row for LoopBars bars and
+plays it back round and round, in time with the MIDI clock.  The loop
+position comes from TtoMidi.clock_pulses_total, so the loop starts over
+whenever the transport does.
+
+Recording starts at the top of the next loop after Rec is pressed, and lasts
+exactly one loop.  Dub overdubs more notes on to the loop while it plays.
+
+Events are stored in parallel arrays (pulse offset, note, velocity) sorted by
+pulse, not as a list of dicts.  A per-pulse index gives the range of events
+on each pulse of the loop, so playback is a slice lookup per clock pulse.
+Overdubbed events collect in a separate buffer, already in time order, and
+are inserted into the loop in place at the top of the next loop.  Only the
+index entries after the first inserted event's pulse move, so a short
+overdub on a long loop costs little.
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+array : Compact typed arrays for event storage.
+
+Classes
+-------
+TtoLooper : Pulse quantized pattern recorder and looper.
+"""
+
+import tto_globals
+from array import array
+
+# Looper states
+looper_states = ("idle",  # Nothing recorded, or cleared
+                 "armed",  # Will start recording at the top of the loop
+                 "record",  # Recording the first pass
+                 "play",  # Playing back
+                 "overdub")  # Playing back and recording more on top
+
+
+class TtoLooper(object):
+    def __init__(self, bars=2, ppb=24, beats_per_bar=4):
+        # Loop length in clock pulses
+        self.loop_length = max(1, bars) * beats_per_bar * ppb
+        if self.loop_length > 0xFFFF:
+            raise ValueError("{} bars is too long to loop".format(bars))
+
+        self.state = "idle"
+
+        # Pulse offset within the loop of the current clock pulse
+        self.position = 0
+
+        # The loop: events sorted by pulse.  A velocity of 0 is a note off.
+        self.event_pulses = array('H')
+        self.event_notes = array('B')
+        self.event_velocities = array('B')
+
+        # Events on loop pulse p are
+        # event_pulses[pulse_index[p]:pulse_index[p + 1]]
+        self.pulse_index = array('I', [0]) * (self.loop_length + 1)
+
+        # Events being recorded this pass, in time order
+        self.pending_pulses = array('H')
+        self.pending_notes = array('B')
+        self.pending_velocities = array('B')
+
+        # [MIDI note number] = how many times the looper is holding it
+        self.notes_sounding = bytearray(128)
+
+    def set_state(self, state):
+        tto_globals.debugger.message("KEY_", "Looper {}".format(state))
+        self.state = state
+
+    def record_toggle(self):
+        if self.state in ("armed", "record"):
+            # Cancel the recording
+            self.clear()
+        else:
+            self.clear()
+            self.set_state("armed")
+
+    def overdub_toggle(self):
+        if self.state == "play":
+            self.set_state("overdub")
+        elif self.state == "overdub":
+            # Anything dubbed this pass is still merged at the top of
+            # the loop
+            self.set_state("play")
+
+    def clear(self):
+        self.notes_stop()
+        del self.event_pulses[:]
+        del self.event_notes[:]
+        del self.event_velocities[:]
+        del self.pending_pulses[:]
+        del self.pending_notes[:]
+        del self.pending_velocities[:]
+        self.pulse_index = array('I', [0]) * (self.loop_length + 1)
+        self.set_state("idle")
+
+    def record(self, note, velocity):
+        """Record a note on (velocity > 0) or off (velocity 0) at the
+        current pulse, if recording.
+        """
+        if self.state not in ("record", "overdub"):
+            return
+        if not tto_globals.midi or not tto_globals.midi.transport_playing:
+            return
+        self.pending_pulses.append(self.position)
+        self.pending_notes.append(note)
+        self.pending_velocities.append(velocity)
+
+    def merge(self):
+        # Insert the pending events into the loop in place.  Both are sorted
+        # by pulse, pending events go after existing ones on the same pulse.
+        pending = self.pending_pulses
+        if not pending:
+            return
+        pulse_index = self.pulse_index
+        # Every pending event already inserted has an earlier or equal
+        # pulse, so sits before this one's place in the unshifted index
+        for inserted in range(len(pending)):
+            pulse = pending[inserted]
+            event = pulse_index[pulse + 1] + inserted
+            self.event_pulses.insert(event, pulse)
+            self.event_notes.insert(event, self.pending_notes[inserted])
+            self.event_velocities.insert(event,
+                                         self.pending_velocities[inserted])
+
+        # Shift the index entries after the first pending pulse by the
+        # number of events inserted before them
+        inserted = 0
+        for pulse in range(pending[0], self.loop_length):
+            while inserted < len(pending) and pending[inserted] == pulse:
+                inserted += 1
+            pulse_index[pulse + 1] += inserted
+
+        del self.pending_pulses[:]
+        del self.pending_notes[:]
+        del self.pending_velocities[:]
+
+        tto_globals.debugger.message("KEY_",
+                                     "Looper merged, {} events".format(
+                                         len(self.event_pulses)))
+
+    def notes_stop(self):
+        # Release everything the looper is holding
+        for note in range(128):
+            while self.notes_sounding[note]:
+                self.notes_sounding[note] -= 1
+                tto_globals.key.midi_note_release(note)
+
+    def pulse(self, pulses_total):
+        """Handle MIDI clock pulse number pulses_total (from 1)."""
+        self.position = (pulses_total - 1) % self.loop_length
+
+        if self.position == 0:
+            # Top of the loop.  Close any notes left hanging over the end,
+            # so a missing note off can't stick.
+            self.notes_stop()
+            self.merge()
+            if self.state == "armed":
+                self.set_state("record")
+            elif self.state == "record":
+                self.set_state("play")
+
+        if self.state not in ("play", "overdub"):
+            return
+
+        for event in range(self.pulse_index[self.position],
+                           self.pulse_index[self.position + 1]):
+            note = self.event_notes[event]
+            velocity = self.event_velocities[event]
+            if velocity:
+                if self.notes_sounding[note] < 255:
+                    self.notes_sounding[note] += 1
+                tto_globals.key.midi_note_hold(note, velocity)
+            elif self.notes_sounding[note]:
+                self.notes_sounding[note] -= 1
+                tto_globals.key.midi_note_release(note)
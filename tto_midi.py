@@ -6,6 +6,10 @@ This module handles midi messages received and produced during tto runtime.
 Requirements
 ------------
 tto_globals : Program-wide global variable module for tto.
+tto_debugger : Log message category codes.
+tto_trace : Timeline span names.
+tto_virtualmidi : In-process virtual ports, with MidiBackend = virtual.
+tto_midischeduler : Link paced MIDI Out, with MidiOutBaud set.
 mido : A library for working with MIDI message and ports.
 python-rtmidi : rtmidi backend for mido.
 time : to calculate math around bpm
@@ -17,8 +21,15 @@ TtoMidi : MIDI class for tto.
 
 import mido
 import tto_globals
+from tto_debugger import category_midi, category_clck
+from tto_trace import span_midi_relay, span_midi_send, span_midi_clock_out
+from tto_virtualmidi import VirtualInput, VirtualOutput, parse_traffic
+from tto_midischeduler import MidiOutScheduler
 import time
 
+# The clock message, made once and reused for every internal clock pulse
+clock_message = mido.Message("clock")
+
 
 class TtoMidi(object):
     def __init__(self):
@@ -27,6 +38,11 @@ class TtoMidi(object):
         self.channel_out = 0  # 0-15, but in the Real World it's 1-16. So add 1
         self.channel_in = 0
 
+        # With MidiBackend = virtual, ports are tto_virtualmidi stand-ins
+        # making MidiVirtualTraffic, instead of real hardware
+        self.backend_virtual = tto_globals.config['tto']['MidiBackend'].\
+            strip('"') == "virtual"
+
         # Show MIDI port names in the console logs
         self.detect_midi_ports()
 
@@ -43,11 +59,35 @@ class TtoMidi(object):
         # a message has been seen by the midi module in the meantime.
         self.transport_new_messages = False
 
+        # Counts every change to the transport and clock state snapshots
+        # copy from TtoMidi, so tto_snapshot.publish() can tell when there's
+        # nothing new
+        self.state_changes = 0
+
+        # Counts every message read from MIDI In, so tto_governor can tell
+        # whether anything was waiting on the main loop
+        self.messages_received = 0
+
         # The heart of the clock is clock_pulses.
         # Each time we receive a MIDI clock message, this increments
         # When this is equal to the ppb, one beat has elapsed
         self.clock_pulses = 0
 
+        # clock_pulses_total counts every clock pulse since transport play
+        # and never wraps.  Clock synced things like the arpeggiator count
+        # their steps from this.
+        self.clock_pulses_total = 0
+
+        # With ClockSource = internal, tto makes its own clock at ClockBpm
+        # instead of following MIDI In, and sends it to MIDI Out
+        self.clock_internal = tto_globals.config['tto']['ClockSource'].\
+            strip('"') == "internal"
+        self.clock_internal_interval = 60 / (
+            tto_globals.config['tto'].getfloat('ClockBpm') * self.ppb)
+        # Starts on the first main loop, not now, so startup time doesn't
+        # count as pulses owed
+        self.clock_internal_next = None
+
         # Three bits will allow me to track at a resolution of 1/16-notes.
         self.downbeat_whole = False  # clock_pulses mod self.ppb == 1
         self.downbeat_half = False  # clock_pulses mod (self.ppb / 2) == 1
@@ -58,6 +98,18 @@ class TtoMidi(object):
         self.clock_pulse_delta = time.time()
         self.bpm_detected = 0
 
+        # A gap between clock pulses longer than clock_dropout_pulses times
+        # the usual pulse interval, and at least clock_dropout_min seconds,
+        # is logged as a clock dropout.  MIDI In is read once per main loop,
+        # so pulses arrive in bunches; the floor keeps that from counting.
+        self.clock_dropout_pulses = 4
+        self.clock_dropout_min = 0.1
+        self.clock_dropouts = 0
+        self.clock_pulse_last = 0  # perf_counter() of the last pulse
+        # Running average of the pulse interval, 0 until there's been a
+        # beat's worth of pulses to average
+        self.clock_pulse_interval = 0
+
         # Check the program config options and attempt to open MIDI ports if
         # they are enabled.  We need an In for receiving upstream MIDI, and
         # an Out to relaying that MIDI downstream + our own inserted messages:
@@ -74,6 +126,22 @@ class TtoMidi(object):
 
                 self.port_open(midi_port_config_attrib_name, midi_direction)
 
+        # [message type] = trace span name id for receiving it, interned
+        # the first time each type arrives while tracing
+        self.trace_receive_ids = {}
+
+        # With MidiOutBaud set, MIDI Out is paced to a link of that speed,
+        # e.g. 31250 for 5-pin DIN, by a MidiOutScheduler
+        self.out_scheduler = None
+        midi_out_baud = tto_globals.config['tto'].getint('MidiOutBaud')
+        if midi_out_baud > 0 and "MidiOutPort" in self.ports:
+            tto_globals.debugger.message("MIDI",
+                                         "Pacing MIDI Out to {} baud".format(
+                                             midi_out_baud))
+            self.out_scheduler = MidiOutScheduler(
+                self.ports["MidiOutPort"], midi_out_baud,
+                tto_globals.config['tto'].getboolean('MidiOutRunningStatus'))
+
     def detect_midi_ports(self):
         """Informational method to log MIDI port names detected on the system.
 
@@ -83,6 +151,10 @@ class TtoMidi(object):
         method just helps keep me updated on status during program startup.
         """
 
+        if self.backend_virtual:
+            tto_globals.debugger.message("MIDI", "Using virtual MIDI ports")
+            return
+
         try:
             if tto_globals.config['tto'].getboolean('MidiInEnabled'):
                 tto_globals.debugger.message("MIDI",
@@ -112,12 +184,21 @@ class TtoMidi(object):
             tto_globals.debugger.message("MIDI",
                                          "    Opening MIDI {}: '{}'".format(
                                              direction, midi_port_name))
-            if direction == "In":
-                self.ports[midi_port_config_attrib_name] = mido.open_input(
-                    midi_port_name)
-            if direction == "Out":
-                self.ports[midi_port_config_attrib_name] = mido.open_output(
-                    midi_port_name)
+            if self.backend_virtual:
+                if direction == "In":
+                    self.ports[midi_port_config_attrib_name] = VirtualInput(
+                        midi_port_name, parse_traffic(
+                            tto_globals.config['tto']['MidiVirtualTraffic']))
+                if direction == "Out":
+                    self.ports[midi_port_config_attrib_name] = VirtualOutput(
+                        midi_port_name)
+            else:
+                if direction == "In":
+                    self.ports[midi_port_config_attrib_name] = \
+                        mido.open_input(midi_port_name)
+                if direction == "Out":
+                    self.ports[midi_port_config_attrib_name] = \
+                        mido.open_output(midi_port_name)
 
             tto_globals.debugger.message("MIDI",
                                          "    Successfully opened: '{}'".
@@ -130,9 +211,22 @@ class TtoMidi(object):
                 "'{}' specified in .cfg file, but could not open port.".format(
                     midi_port_name))
 
+    def port_out_send(self, midi_msg):
+        # Through the scheduler if there is one, else straight out
+        if self.out_scheduler:
+            self.out_scheduler.send(midi_msg)
+        else:
+            self.ports["MidiOutPort"].send(midi_msg)
+
     def port_out_panic(self):
         if "MidiOutPort" in self.ports:
             try:
+                if self.out_scheduler:
+                    # Let everything queued out first, note offs included
+                    self.out_scheduler.flush()
+                    tto_globals.debugger.message(
+                        "MIDI", "MIDI Out scheduler: {}".format(
+                            self.out_scheduler.stats()))
                 tto_globals.debugger.message("MIDI",
                                              "Sending panic() to MIDI Out")
                 self.ports["MidiOutPort"].panic()
@@ -157,63 +251,119 @@ class TtoMidi(object):
         # Non-blocking method run once per main-loop execution cycle
         # Handle everything needed for MIDI during the course of normal runtime
 
+        if self.clock_internal:
+            self.handle_clock_internal()
+
         # Process incoming MIDI In, handle clock, and relay to MIDI Out ASAP
+        tracer = tto_globals.tracer
         try:
             if "MidiInPort" in self.ports:
-                for midi_msg in self.ports["MidiInPort"].\
-                        receive(block=False):
+                for midi_msg in self.ports["MidiInPort"].iter_pending():
+                    self.messages_received += 1
+                    if tracer:
+                        receive_start = tracer.clock()
+                        receive_id = self.trace_receive_ids.get(
+                            midi_msg.type)
+                        if receive_id is None:
+                            receive_id = tracer.name_id(
+                                "midi_receive " + midi_msg.type)
+                            self.trace_receive_ids[midi_msg.type] = \
+                                receive_id
+
+                    # Notes go through the harmonizer, if it's on, in place
+                    # of being relayed
+                    if tto_globals.harmonizer and \
+                            midi_msg.type in ("note_on", "note_off"):
+                        tto_globals.harmonizer.handle_message(midi_msg)
+                        if tracer:
+                            tracer.span(receive_id, receive_start)
+                        continue
+
+                    midi_msg_clock = midi_msg.type in ("clock",
+                                                       "songpos",
+                                                       "start",
+                                                       "continue",
+                                                       "stop",
+                                                       "reset")
+                    if midi_msg_clock and self.clock_internal:
+                        # We're the clock.  Drop the upstream one.
+                        continue
 
                     # Relay MIDI In to MIDI Out
                     if "MidiOutPort" in self.ports:
-                        self.ports["MidiOutPort"].send(midi_msg)
+                        if tracer:
+                            relay_start = tracer.clock()
+                        self.port_out_send(midi_msg)
+                        if tracer:
+                            tracer.span(span_midi_relay, relay_start)
 
                     # Handle clock-related stuff:
-                    if midi_msg.type in ("clock",
-                                         "songpos",
-                                         "start",
-                                         "continue",
-                                         "stop",
-                                         "reset"):
+                    if midi_msg_clock:
                         self.handle_clock(midi_msg)
+
+                    if tracer:
+                        tracer.span(receive_id, receive_start)
+
+            # Send whatever MIDI Out has room for now
+            if self.out_scheduler:
+                self.out_scheduler.pump()
         except Exception as e:
             tto_globals.debugger.message("EXCEPTION",
                                          "Error processing MIDI: {}".
                                          format(e))
 
     def transport_play(self, midi_msg=None):
-        tto_globals.debugger.message("MIDI",
-                                     "transport_playing TRUE: {}".format(
-                                         midi_msg))
+        tto_globals.debugger.message(category_midi,
+                                     "transport_playing TRUE: {}", midi_msg)
         self.transport_playing = True
         self.transport_new_messages = True
+        self.state_changes += 1
 
     def transport_stop(self, midi_msg=None):
-        tto_globals.debugger.message("MIDI",
-                                     "transport_playing FALSE: {}".format(
-                                         midi_msg))
+        tto_globals.debugger.message(category_midi,
+                                     "transport_playing FALSE: {}", midi_msg)
         self.transport_playing = False
         self.transport_new_messages = True
+        self.state_changes += 1
         self.clock_pulses = 0
-
-    def send(self, note, mode="stop"):
+        self.clock_pulses_total = 0
+        self.clock_pulse_last = 0
+        self.clock_pulse_interval = 0
+        if tto_globals.arpeggiator:
+            tto_globals.arpeggiator.notes_stop()
+        if tto_globals.looper:
+            tto_globals.looper.notes_stop()
+
+    def send(self, note, mode="stop", channel=None, velocity=None):
+        # channel defaults to self.channel_out, velocity to 100 for play
+        if channel is None:
+            channel = self.channel_out
         mido_message = "note_off"
-        velocity = 0
         if mode == "play":
             mido_message = "note_on"
-            velocity = 100
+            if velocity is None:
+                velocity = 100
+        else:
+            velocity = 0
 
-        tto_globals.debugger.message("MIDI",
-                                     "send: {}, vel: {}, mido_msg: {}".format(
-                                         note, velocity, mido_message))
+        tto_globals.debugger.message(category_midi,
+                                     "send: {}, ch: {}, vel: {}, mido_msg: {}",
+                                     note, channel + 1, velocity,
+                                     mido_message)
 
         midi_msg = mido.Message(mido_message,
-                                channel=self.channel_out,
+                                channel=channel,
                                 note=note,
                                 velocity=velocity)
 
         try:
             if "MidiOutPort" in self.ports:
-                self.ports["MidiOutPort"].send(midi_msg)
+                tracer = tto_globals.tracer
+                if tracer:
+                    send_start = tracer.clock()
+                self.port_out_send(midi_msg)
+                if tracer:
+                    tracer.span(span_midi_send, send_start, note)
 
         except Exception as e:
             tto_globals.debugger.message("EXCEPTION",
@@ -233,6 +383,8 @@ class TtoMidi(object):
                 # playing yet, then lets start thinking that we're playing:
                 self.transport_play(midi_msg)
 
+            self.handle_clock_dropout()
+
             # Turn off all downbeat booleans.
             self.downbeat_whole = False
             self.downbeat_half = False
@@ -245,6 +397,15 @@ class TtoMidi(object):
             # resolution.
 
             self.clock_pulses = (self.clock_pulses + 1) % self.ppb
+            self.state_changes += 1
+            self.clock_pulses_total += 1
+
+            # Step the arpeggiator and looper on the pulse itself, not on a
+            # frame
+            if tto_globals.arpeggiator:
+                tto_globals.arpeggiator.pulse(self.clock_pulses_total)
+            if tto_globals.looper:
+                tto_globals.looper.pulse(self.clock_pulses_total)
 
             if (self.clock_pulses % self.ppb) == 1:
                 self.downbeat_whole = True
@@ -259,9 +420,9 @@ class TtoMidi(object):
                 self.bpm_detected = 60 / (self.clock_pulse_timestamp -
                                           self.clock_pulse_delta)
 
-                tto_globals.debugger.message("MIDI",
-                                             "Clock Downbeat: {} bpm detected".
-                                             format(self.bpm_detected))
+                tto_globals.debugger.message(category_midi,
+                                             "Clock Downbeat: {} bpm detected",
+                                             self.bpm_detected)
 
             if (self.clock_pulses % int(self.ppb / 2)) == 1:
                 self.downbeat_half = True
@@ -269,3 +430,52 @@ class TtoMidi(object):
             if (self.clock_pulses % int(self.ppb / 4)) == 1:
                 self.downbeat_quarter = True
                 self.transport_new_messages = True
+
+    def handle_clock_dropout(self):
+        # Log a warning if the clock pulses stopped for a while, but the
+        # transport didn't
+        now = time.perf_counter()
+        if self.clock_pulse_last:
+            gap = now - self.clock_pulse_last
+            if self.clock_pulse_interval and \
+                    gap > self.clock_dropout_min and \
+                    gap > self.clock_pulse_interval * \
+                    self.clock_dropout_pulses:
+                self.clock_dropouts += 1
+                tto_globals.debugger.log_stat("Clock dropouts", 1)
+                tto_globals.debugger.message(
+                    category_clck,
+                    "Clock dropout: {:.1f} ms gap, {:.1f} ms expected",
+                    gap * 1000, self.clock_pulse_interval * 1000)
+            elif self.clock_pulses_total >= self.ppb:
+                if self.clock_pulse_interval:
+                    self.clock_pulse_interval += \
+                        (gap - self.clock_pulse_interval) / self.ppb
+                else:
+                    self.clock_pulse_interval = gap
+        self.clock_pulse_last = now
+
+    def handle_clock_internal(self):
+        # Run every internal clock pulse that has come due since the last
+        # main loop.  Scheduled from a fixed start, so pulses don't drift
+        # with main loop timing.
+        now = time.perf_counter()
+        if self.clock_internal_next is None or \
+                now - self.clock_internal_next > 1:
+            # Way behind, e.g. the machine was suspended.  Don't burst.
+            self.clock_internal_next = now
+        while now >= self.clock_internal_next:
+            self.clock_internal_next += self.clock_internal_interval
+            if "MidiOutPort" in self.ports:
+                try:
+                    tracer = tto_globals.tracer
+                    if tracer:
+                        send_start = tracer.clock()
+                    self.port_out_send(clock_message)
+                    if tracer:
+                        tracer.span(span_midi_clock_out, send_start)
+                except Exception as e:
+                    tto_globals.debugger.message("EXCEPTION",
+                                                 "Error sending clock: {}".
+                                                 format(e))
+            self.handle_clock(clock_message)
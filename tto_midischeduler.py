@@ -0,0 +1,202 @@
+"""tto_midischeduler - bandwidth aware MIDI Out scheduler for tto
+
+A 5-pin DIN MIDI link runs at 31250 baud, 10 bits a byte, so it carries
+3125 bytes a second, about 1000 three byte messages.  Sent any faster,
+messages back up inside the MIDI interface, and a clock pulse stuck behind a
+burst of notes and CCs arrives late.
+
+With MidiOutBaud set, TtoMidi sends MIDI Out through a MidiOutScheduler
+instead of straight to the port.  It models when the link will have finished
+sending everything so far, and only hands the port a message once the link
+is nearly free, so the queueing happens here where it can be prioritized:
+
+realtime : clock, start, continue, stop and songpos.  Always sent at once,
+           ahead of anything queued.
+notes : note_on and note_off, in order.
+other : Everything else, in order.  A control_change, pitchwheel,
+        aftertouch or polytouch that's still queued when a newer value for
+        the same controller arrives is replaced by it, in place, so under
+        pressure only the latest value of each controller goes out.
+
+With MidiOutRunningStatus, note_off is sent as note_on with velocity 0,
+which keeps the status byte the same through runs of notes, and the link
+model leaves out status bytes that repeat the last one, the way a DIN
+interface using running status sends them.  mido ports take whole messages,
+so the status bytes themselves are left to the interface.
+
+Requirements
+------------
+collections : deque and OrderedDict queues.
+time : perf_counter() for the link model.
+mido : Messages.
+
+Classes
+-------
+MidiOutScheduler : Prioritized, link paced MIDI Out queue.
+"""
+
+import collections
+import time
+
+import mido
+
+# Bits on the wire per byte, with start and stop bits
+link_bits_per_byte = 10
+
+# How far ahead of the link the port is given messages, in seconds.  A
+# little slack keeps the link busy between main loop runs without building
+# a queue inside the interface.
+link_slack = 0.002
+
+# Message types in each priority tier.  Anything not listed is "other".
+realtime_types = ("clock", "start", "continue", "stop", "songpos")
+note_types = ("note_on", "note_off")
+
+# Status bytes from here up don't change running status: realtime messages
+# can go between the bytes of anything.  From status_system to just below
+# it, system messages cancel running status.
+status_realtime = 0xF8
+status_system = 0xF0
+
+
+class MidiOutScheduler(object):
+    def __init__(self, port, baud=31250, running_status=True):
+        self.port = port
+        self.byte_time = link_bits_per_byte / baud
+        self.running_status = running_status
+
+        self.clock = time.perf_counter
+
+        # When the link will have sent everything handed to the port so far,
+        # and the last channel status byte on it
+        self.link_free = 0.0
+        self.link_status = None
+
+        # Queued (time queued, message).  other is keyed by controller for
+        # the messages that can be replaced by a newer value, and by an
+        # ever increasing number for the rest.
+        self.queue_notes = collections.deque()
+        self.queue_other = collections.OrderedDict()
+        self.queue_other_next = 0
+        self.queued = 0
+
+        # Counters
+        self.messages_sent = 0
+        self.realtime_sent = 0
+        self.notes_sent = 0
+        self.other_sent = 0
+        self.bytes_sent = 0
+        self.bytes_saved = 0
+        self.messages_replaced = 0
+        self.queued_max = 0
+        self.queue_delay_max = 0.0
+
+    def send(self, midi_msg):
+        """Send midi_msg now if the link has room and nothing's ahead of it,
+        or queue it.
+        """
+        midi_type = midi_msg.type
+        if midi_type in realtime_types:
+            # Never waits behind anything
+            self.transmit(midi_msg, self.clock())
+            self.realtime_sent += 1
+            return
+
+        if self.running_status and midi_type == "note_off":
+            midi_msg = mido.Message("note_on", channel=midi_msg.channel,
+                                    note=midi_msg.note, velocity=0,
+                                    time=midi_msg.time)
+            midi_type = "note_on"
+
+        now = self.clock()
+        if not self.queued and self.link_free - now <= link_slack:
+            self.transmit(midi_msg, now)
+            if midi_type in note_types:
+                self.notes_sent += 1
+            else:
+                self.other_sent += 1
+            return
+
+        if midi_type in note_types:
+            self.queue_notes.append((now, midi_msg))
+        else:
+            if midi_type == "control_change":
+                key = (midi_type, midi_msg.channel, midi_msg.control)
+            elif midi_type == "polytouch":
+                key = (midi_type, midi_msg.channel, midi_msg.note)
+            elif midi_type in ("pitchwheel", "aftertouch"):
+                key = (midi_type, midi_msg.channel)
+            else:
+                key = self.queue_other_next
+                self.queue_other_next += 1
+            queued = self.queue_other.get(key)
+            if queued:
+                # Only the newest value matters.  Keep the older one's place
+                # in the queue, and time.
+                self.queue_other[key] = (queued[0], midi_msg)
+                self.messages_replaced += 1
+                return
+            self.queue_other[key] = (now, midi_msg)
+        self.queued += 1
+        if self.queued > self.queued_max:
+            self.queued_max = self.queued
+
+    def pump(self):
+        """Hand the port as many queued messages as the link has room for,
+        notes first.  Call once per main loop.
+        """
+        if not self.queued:
+            return
+        now = self.clock()
+        while self.queued and self.link_free - now <= link_slack:
+            self.transmit(self.dequeue(now), now)
+
+    def flush(self):
+        """Send everything queued straight away, e.g. before a panic."""
+        now = self.clock()
+        while self.queued:
+            self.transmit(self.dequeue(now), now)
+
+    def dequeue(self, now):
+        # The next message due, notes first
+        if self.queue_notes:
+            queued_time, midi_msg = self.queue_notes.popleft()
+            self.notes_sent += 1
+        else:
+            queued_time, midi_msg = self.queue_other.popitem(last=False)[1]
+            self.other_sent += 1
+        self.queued -= 1
+        if now - queued_time > self.queue_delay_max:
+            self.queue_delay_max = now - queued_time
+        return midi_msg
+
+    def transmit(self, midi_msg, now):
+        self.port.send(midi_msg)
+        self.messages_sent += 1
+
+        # How long the link takes over it
+        midi_data = midi_msg.bytes()
+        midi_bytes = len(midi_data)
+        status = midi_data[0]
+        if status < status_system:
+            if self.running_status and status == self.link_status:
+                midi_bytes -= 1
+                self.bytes_saved += 1
+            self.link_status = status
+        elif status < status_realtime:
+            self.link_status = None
+        self.bytes_sent += midi_bytes
+        self.link_free = max(self.link_free, now) + \
+            (midi_bytes * self.byte_time)
+
+    def stats(self):
+        return {'messages_sent': self.messages_sent,
+                'realtime_sent': self.realtime_sent,
+                'notes_sent': self.notes_sent,
+                'other_sent': self.other_sent,
+                'messages_replaced': self.messages_replaced,
+                'bytes_sent': self.bytes_sent,
+                'bytes_saved': self.bytes_saved,
+                'queued': self.queued,
+                'queued_max': self.queued_max,
+                'queue_delay_max_ms': round(self.queue_delay_max * 1000, 3)}
@@ -0,0 +1,153 @@
+"""tto_powermate - rotary encoder input for tto
+
+This module reads a Griffin PowerMate (or any evdev rotary encoder) so the
+helm can be turned by hand.
+
+The device file is read on a background thread, so the main loop never
+blocks on it.  The reader only ever adds to running totals of rotation and
+button presses.  Once per input tick, poll() takes the difference since the
+last poll and posts at most one net rotation event to tto_globals.events, so
+a fast spin costs one event and one redraw, not one per detent.
+
+Any file that yields Linux input_event structs works as a device, including
+a FIFO, which makes the reader testable without hardware:
+
+    mkfifo /tmp/powermate
+    (set PowermateDevice = /tmp/powermate in tto.cfg, then write
+     input_event structs to the FIFO)
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+os : Low-level non-blocking device file reads.
+select : Wait for device input with a timeout.
+struct : Decode Linux input_event structs.
+threading : Background reader thread.
+
+Classes
+-------
+TtoPowermate : Background evdev reader with per-tick event coalescing.
+"""
+
+import tto_globals
+import os
+import select
+import struct
+import threading
+
+# struct input_event from linux/input.h:
+#   struct timeval time; __u16 type; __u16 code; __s32 value;
+input_event = struct.Struct('llHHi')
+
+EV_KEY = 0x01  # Button press / release, value 1 / 0
+EV_REL = 0x02  # Relative axis, value is the signed number of detents
+REL_DIAL = 0x07  # The PowerMate's knob
+BTN_0 = 0x100  # The PowerMate's push button
+
+
+class TtoPowermate(object):
+    def __init__(self, device_path):
+        self.device_path = device_path
+
+        # Running totals.  Only the reader thread writes these, so the main
+        # loop can read them without a lock.
+        self.rotation_total = 0
+        self.presses_total = 0
+        self.button_down = False
+
+        # What poll() has already reported
+        self.rotation_polled = 0
+        self.presses_polled = 0
+
+        self.running = True
+        self.thread = threading.Thread(target=self.reader_run,
+                                       name="tto powermate",
+                                       daemon=True)
+        tto_globals.debugger.message("INFO",
+                                     "Reading Powermate from {}".format(
+                                         self.device_path))
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def reader_run(self):
+        device = None
+        pending = b""
+        # Whether the last open failed.  Only the first failure in a row is
+        # logged, not one a second for as long as the device is missing.
+        open_failed = False
+        while self.running:
+            if device is None:
+                try:
+                    # O_NONBLOCK so opening a FIFO doesn't wait for a writer
+                    device = os.open(self.device_path,
+                                     os.O_RDONLY | os.O_NONBLOCK)
+                    pending = b""
+                    if open_failed:
+                        open_failed = False
+                        tto_globals.debugger.message(
+                            "INFO", "Opened Powermate {}".format(
+                                self.device_path))
+                except OSError as e:
+                    if not open_failed:
+                        open_failed = True
+                        tto_globals.debugger.message(
+                            "EXCEPTION", "Opening Powermate {}: {}, "
+                            "retrying quietly".format(self.device_path, e))
+                    # Try again shortly, e.g. once it's plugged back in
+                    select.select([], [], [], 1)
+                    continue
+
+            readable = select.select([device], [], [], 0.25)[0]
+            if not readable:
+                continue
+            try:
+                data = os.read(device, input_event.size * 64)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                data = b""
+                tto_globals.debugger.message(
+                    "EXCEPTION", "Reading Powermate: {}".format(e))
+            if not data:
+                # Device unplugged, or the FIFO writer went away
+                os.close(device)
+                device = None
+                continue
+
+            pending += data
+            whole = len(pending) - (len(pending) % input_event.size)
+            for event_sec, event_usec, event_type, event_code, event_value \
+                    in input_event.iter_unpack(pending[:whole]):
+                if event_type == EV_REL and event_code == REL_DIAL:
+                    self.rotation_total += event_value
+                elif event_type == EV_KEY and event_code == BTN_0:
+                    self.button_down = bool(event_value)
+                    if event_value:
+                        self.presses_total += 1
+            pending = pending[whole:]
+
+        if device is not None:
+            os.close(device)
+
+    def poll(self):
+        """Post this tick's net rotation and button presses to
+        tto_globals.events.  Call once per input tick from the main loop.
+        """
+        rotation_total = self.rotation_total
+        delta = rotation_total - self.rotation_polled
+        if delta:
+            self.rotation_polled = rotation_total
+            tto_globals.events['RO_powermate'] = {'type': 'RO',
+                                                  'keycode': None,
+                                                  'delta': delta}
+
+        presses_total = self.presses_total
+        presses = presses_total - self.presses_polled
+        if presses:
+            self.presses_polled = presses_total
+            tto_globals.events['PB_powermate'] = {'type': 'PB',
+                                                  'keycode': None,
+                                                  'presses': presses}
@@ -8,8 +8,13 @@ Requirements
 tto_globals : Program-wide global variable module for tto.
 tto_fonts : Pygame Sysfonts
 tto_shapes : Class and methods for calculating polygons
+tto_pygame_framepacer : Frame pacing and frame-time telemetry
+tto_debugger : Log message category codes.
+tto_trace : Timeline span names.
+math : Rounding scaled display areas.
 pygame : library for the development of multimedia applications
-time : to calculate math around frame rate.
+threading : Optional render thread.
+time : Render thread sleeps until the next frame is due.
 
 Classes
 -------
@@ -22,9 +27,14 @@ pygame_terminate() : Gracefully terminate pygame.
 
 import tto_globals
 import tto_fonts
+import math
 import pygame
+import threading
 import time
 from pygame.locals import *
+from tto_debugger import category_pyga
+from tto_trace import span_frame, span_display_update
+from tto_pygame_framepacer import FramePacer
 from tto_pygame_helm import GUISurfaceHelm
 from tto_pygame_keyboardmap import GUISurfaceKeyboardMap
 from tto_pygame_transportstrip import GUISurfaceTransportStrip
@@ -38,6 +48,10 @@ def pygame_terminate():
     used by pygame.
     """
     try:
+        if tto_globals.pygame:
+            tto_globals.pygame.render_thread_stop()
+            tto_globals.debugger.message("PYGA", "Frame timings: {}".format(
+                tto_globals.pygame.pacer.stats()))
         tto_globals.debugger.message("PYGA", "Quitting Pygame")
         pygame.quit()
     except Exception as e:
@@ -53,12 +67,56 @@ class TtoPygame(object):
         self.canvas_height = tto_globals.config['tto'].\
             getint('CanvasHeight')
         self.init_gfx = tto_globals.config['tto'].getboolean('GraphicsEnabled')
+        self.vsync = tto_globals.config['tto'].getboolean('VSync')
 
         self.canvas = None  # Gfx display will be attached here
 
-        self.fps = 60  # Poll/Render pygame no faster than this many fps
-        self.fps_sec_per_frame = (1 / self.fps)
-        self.fps_tick = time.time()  # Tracking time for fps here
+        # Every GUISurface is drawn at render_scale times the display
+        # resolution onto render_canvas, which is then scaled up to the
+        # display once per frame.  On slow machines, rendering at e.g. 0.5
+        # cuts the software rendering cost by about 4x.
+        # RenderScale is rounded to 1/n, e.g. 0.5 or 0.33.  Scaling up by
+        # a whole number is cheap, but by anything else it costs more than
+        # drawing fewer pixels saves: 0.75 renders slower than 1.0.
+        render_scale = tto_globals.config['tto'].getfloat('RenderScale')
+        render_divisor = max(1, int(round(1 / render_scale))) \
+            if render_scale > 0 else 1
+        self.render_scale = 1 / render_divisor
+        if self.render_scale != render_scale:
+            tto_globals.debugger.message("INFO",
+                                         "RenderScale {} rounded to 1/{}",
+                                         render_scale, render_divisor)
+        self.render_width = int(round(self.canvas_width / render_divisor))
+        self.render_height = int(round(self.canvas_height / render_divisor))
+        self.render_canvas = None
+
+        # The GUI layout is designed around a 1920x1080 canvas.  ui_scale
+        # converts those design pixels to render_canvas pixels, for
+        # GUISurfaces' internal measurements, fonts and margins.
+        self.ui_scale = min(self.render_width / 1920,
+                            self.render_height / 1080)
+        tto_globals.canvas_margin = max(1, int(round(10 * self.ui_scale)))
+
+        # Poll input and render pygame no faster than this many fps.
+        # Frames are only rendered when some gui_surface needs it.
+        self.fps = tto_globals.config['tto'].getint('FpsMax')
+        self.pacer = FramePacer(fps_max=self.fps, vsync=self.vsync)
+        self.input_tick = self.pacer.clock()  # Tracking input poll time here
+
+        # If RenderThread, drawing happens on its own thread, working from
+        # tto_globals.snapshot.  The main loop polls input, runs
+        # update_control(), requests frames, and shows each finished frame
+        # with display.update(), which SDL only supports on the main thread.
+        # A slow draw never holds up MIDI.  Off by default.
+        self.render_threaded = tto_globals.config['tto'].\
+            getboolean('RenderThread')
+        self.render_thread = None
+        self.render_thread_running = False
+        self.frame_requested = threading.Event()
+        # A drawn frame's update rects, waiting for the main loop to show
+        # them, and set once it has
+        self.frame_rects = None
+        self.frame_presented = threading.Event()
 
         try:
             tto_globals.debugger.message("PYGA", "Starting Pygame")
@@ -71,7 +129,7 @@ class TtoPygame(object):
             # pygame.mixer.init()  # Do not init
 
             # Set up global fonts for the program interface
-            tto_fonts.init_fonts()
+            tto_fonts.init_fonts(self.ui_scale)
 
         except Exception as e:
             tto_globals.debugger.message("EXCEPTION",
@@ -82,16 +140,40 @@ class TtoPygame(object):
         if self.init_gfx:
             # If this is being run headless, turn initGfx to False
             # This is useful for headless CI testing
+            display_flags = 0
             if self.fullscreen:
+                display_flags = pygame.NOFRAME
+            if self.vsync:
+                # SDL only honors vsync on a renderer-backed display
+                display_flags |= pygame.SCALED
+            try:
                 self.canvas = pygame.display.set_mode(
-                    [self.canvas_width, self.canvas_height], pygame.NOFRAME)
+                    [self.canvas_width, self.canvas_height], display_flags,
+                    vsync=int(self.vsync))
+            except pygame.error as e:
+                tto_globals.debugger.message("PYGA",
+                                             "VSync unavailable: {}".
+                                             format(e))
+                self.vsync = False
+                self.pacer.vsync = False
+                self.canvas = pygame.display.set_mode(
+                    [self.canvas_width, self.canvas_height],
+                    display_flags & ~pygame.SCALED)
+            if self.fullscreen:
                 pygame.display.toggle_fullscreen()
                 # Workaround for pygame.FULLSCREEN going blank in Ubuntu
-            else:
-                self.canvas = pygame.display.set_mode(
-                    [self.canvas_width, self.canvas_height])
             pygame.display.set_caption('tto')  # Set the window title
 
+            if self.render_scale == 1:
+                self.render_canvas = self.canvas
+            else:
+                tto_globals.debugger.message("PYGA",
+                                             "Rendering at {}x{}".format(
+                                                 self.render_width,
+                                                 self.render_height))
+                self.render_canvas = pygame.Surface(
+                    (self.render_width, self.render_height)).convert()
+
         # gui_surfaces list contains each controlSystem object that is
         # rendered.
         # Declare GUISurface objects, set them up and init them,
@@ -102,53 +184,263 @@ class TtoPygame(object):
 
         self.init_gui_surfaces()
 
+        # The gui_surfaces with refresh_policy "clock", and the transport
+        # state and clock pulse they were last checked at
+        self.clock_surfaces = [gui_surface for gui_surface in
+                               self.gui_surfaces
+                               if gui_surface.refresh_policy == "clock"]
+        for gui_surface in self.clock_surfaces:
+            gui_surface.refresh_seen = None
+        self.clock_seen = None
+
+        # False until the first frame has drawn every surface
+        self.canvas_drawn = False
+
+        if self.canvas and self.render_threaded:
+            self.render_thread_start()
+
+    def render_thread_start(self):
+        tto_globals.debugger.message("PYGA", "Starting render thread")
+        self.render_thread_running = True
+        self.render_thread = threading.Thread(target=self.render_thread_run,
+                                              name="tto render",
+                                              daemon=True)
+        self.render_thread.start()
+
+    def render_thread_stop(self):
+        if self.render_thread:
+            tto_globals.debugger.message("PYGA", "Stopping render thread")
+            self.render_thread_running = False
+            self.frame_requested.set()
+            self.frame_presented.set()
+            self.render_thread.join()
+            self.render_thread = None
+
+    def render_thread_run(self):
+        """Render thread main loop.  Sleeps until the main loop requests a
+        frame, then waits for the frame pacer, draws it, and hands it to the
+        main loop to show.
+        """
+        try:
+            while self.render_thread_running:
+                self.frame_requested.wait()
+                self.frame_requested.clear()
+                if not self.render_thread_running:
+                    break
+                frame_wait = self.pacer.frame_next - self.pacer.clock()
+                if frame_wait > 0:
+                    time.sleep(frame_wait)
+                self.handle_graphics()
+        except SystemExit:
+            # handle_graphics() gave up.  Take the main loop down with it.
+            tto_globals.running = False
+
     def handle_pygame(self):
         """Non-blocking method to handle all pygame internals at a safe
         framerate.  Call this from the program main run loop.
         """
-        time_since_last_ui = (time.time() - self.fps_tick)
-        if time_since_last_ui > self.fps_sec_per_frame:
-            self.handle_graphics()
+        now = self.pacer.clock()
+        updated = False
+        if (now - self.input_tick) > self.pacer.frame_interval:
             self.handle_input()
-            self.handle_updates()
-            self.fps_tick = time.time()
+            self.handle_updates(now)
+            self.input_tick = now
+            updated = True
+        if self.clock_surfaces and tto_globals.midi:
+            # Clock synced surfaces are checked every main loop, which is
+            # one comparison unless the clock has moved on
+            midi = tto_globals.midi
+            clock_seen = (midi.transport_playing, midi.clock_pulses_total)
+            if clock_seen != self.clock_seen:
+                self.clock_seen = clock_seen
+                self.handle_updates_clock()
+                updated = True
+        if updated and self.render_thread:
+            for gui_surface in self.gui_surfaces:
+                if gui_surface.needs_rendering:
+                    self.frame_requested.set()
+                    break
+        if self.frame_rects is not None:
+            self.frame_present()
+        if not self.render_thread and self.pacer.frame_due(now):
+            self.handle_graphics()
+
+    def frame_present(self):
+        """Show the frame the render thread has drawn, on the main thread.
+        """
+        update_rects = self.frame_rects
+        self.frame_rects = None
+        try:
+            self.display_update(update_rects)
+        except Exception as e:
+            tto_globals.debugger.message("EXCEPTION",
+                                         "Error drawing pygame: {}".
+                                         format(e))
+            tto_globals.debugger.exit("Pygame render error.")
+        finally:
+            self.frame_presented.set()
+
+    def display_update(self, update_rects):
+        """Show update_rects of the canvas, or all of it the first time.
+        Main thread only.
+        """
+        tracer = tto_globals.tracer
+        phase_start = self.pacer.clock()
+        if self.canvas_drawn:
+            pygame.display.update(update_rects)
+        else:
+            pygame.display.update()
+            self.canvas_drawn = True
+        self.pacer.time_flip = self.pacer.clock() - phase_start
+        if tracer:
+            tracer.span(span_display_update, phase_start)
 
     def handle_graphics(self):
         if self.canvas:
-            # Check if any gui_surface reports that it needs rendering
-            needs_rendering = False
-            for gui_surface in self.gui_surfaces:
-                if gui_surface.needs_rendering:
-                    needs_rendering = True
+            # Only the gui_surfaces that report they need rendering are
+            # drawn.  The first frame draws everything on a clean canvas.
+            if self.canvas_drawn:
+                dirty_surfaces = [gui_surface for gui_surface in
+                                  self.gui_surfaces
+                                  if gui_surface.needs_rendering]
+            else:
+                dirty_surfaces = list(self.gui_surfaces)
 
-            if needs_rendering:
-                try:
-                    # First, flood the screen:
-                    self.canvas.fill(tto_globals.color_black)
+            if dirty_surfaces and tto_globals.governor and \
+                    tto_globals.governor.frame_shed():
+                # Shedding load.  Leave the surfaces dirty for a later frame.
+                self.pacer.frame_skip()
+                if self.render_thread:
+                    self.frame_requested.set()
+                return
 
-                    # Loop through each gui_surface added to the gui_surfaces
-                    for gui_surface in self.gui_surfaces:
+            if dirty_surfaces:
+                try:
+                    clock = self.pacer.clock
+                    tracer = tto_globals.tracer
+                    if tracer:
+                        frame_start = tracer.clock()
+                    self.pacer.frame_begin()
+
+                    # Everything in this frame is drawn from one snapshot
+                    state = tto_globals.snapshot
+
+                    if not self.canvas_drawn:
+                        # First, flood the screen:
+                        self.render_canvas.fill(tto_globals.color_black)
+
+                    # The areas of the display this frame changes
+                    update_rects = []
+
+                    # Loop through each gui_surface that needs rendering
+                    for gui_surface in dirty_surfaces:
+                        # Clear needs_rendering before drawing, so a change
+                        # flagged by the main loop mid-draw isn't lost
+                        gui_surface.needs_rendering = False
+                        gui_surface.state = state
                         # The drawControl method should update the control's
                         # visual elements and
                         # draw to the control's surface
+                        phase_start = clock()
                         gui_surface.draw_control()
+                        phase_end = clock()
+                        self.pacer.time_draw += phase_end - phase_start
+                        if tracer:
+                            tracer.span(gui_surface.trace_id, phase_start)
                         # Blit the control's surface to the canvas
-                        self.canvas.blit(gui_surface.surface,
-                                         [gui_surface.blit_x,
-                                          gui_surface.blit_y])
-                    pygame.display.update()
+                        rect = self.render_canvas.blit(gui_surface.surface,
+                                                       [gui_surface.blit_x,
+                                                        gui_surface.blit_y])
+                        if self.render_canvas is not self.canvas:
+                            # Scale just this surface's area up to the
+                            # display
+                            rect = self.render_scale_rect(rect)
+                        update_rects.append(rect)
+                        self.pacer.time_blit += clock() - phase_end
+
+                    if self.render_thread:
+                        # Hand the frame to the main loop to show, and wait
+                        # for it, so the next frame never draws over one
+                        # that's still being shown
+                        self.frame_presented.clear()
+                        self.frame_rects = update_rects
+                        while not self.frame_presented.wait(0.1):
+                            if not self.render_thread_running:
+                                break
+                    else:
+                        self.display_update(update_rects)
+
+                    self.pacer.frame_end()
+                    if tracer:
+                        tracer.span(span_frame, frame_start)
                 except Exception as e:
                     tto_globals.debugger.message("EXCEPTION",
                                                  "Error drawing pygame: {}".
                                                  format(e))
                     tto_globals.debugger.exit("Pygame render error.")
 
-    def handle_updates(self):
+    def render_scale_rect(self, rect):
+        """Scale rect of render_canvas up to the display, and return the
+        display rect it covers.
+        """
+        scale_x = self.canvas_width / self.render_width
+        scale_y = self.canvas_height / self.render_height
+        left = int(rect.left * scale_x)
+        top = int(rect.top * scale_y)
+        display_rect = pygame.Rect(left, top,
+                                   int(math.ceil(rect.right * scale_x)) -
+                                   left,
+                                   int(math.ceil(rect.bottom * scale_y)) -
+                                   top).clip(self.canvas.get_rect())
+        if display_rect.width and display_rect.height:
+            pygame.transform.scale(self.render_canvas.subsurface(rect),
+                                   display_rect.size,
+                                   self.canvas.subsurface(display_rect))
+        return display_rect
+
+    def handle_updates(self, now):
+        """Run update_control() on the surfaces whose refresh_policy lets
+        them update this input poll.
+        """
         if self.canvas:
+            input_events = bool(tto_globals.events)
+            governor = tto_globals.governor
             for gui_surface in self.gui_surfaces:
+                policy = gui_surface.refresh_policy
+                if policy == "hz":
+                    if now >= gui_surface.refresh_next:
+                        refresh_interval = 1 / gui_surface.refresh_hz
+                        if governor and governor.refresh_stretch > 1:
+                            # Shedding load.  Merge more in to each update.
+                            refresh_interval *= governor.refresh_stretch
+                            governor.refreshes_stretched += 1
+                        gui_surface.refresh_next = now + refresh_interval
+                    elif not input_events:
+                        continue
+                elif policy == "clock" and not input_events:
+                    continue
                 gui_surface.update_control()
 
+    def handle_updates_clock(self):
+        """Run update_control() on the clock synced surfaces whose clock
+        division has moved on.
+        """
+        if self.canvas:
+            playing, pulses_total = self.clock_seen
+            for gui_surface in self.clock_surfaces:
+                # Divisions start on pulse 1, the downbeat
+                division = (playing,
+                            (pulses_total - 1) // gui_surface.refresh_division)
+                if division != gui_surface.refresh_seen:
+                    gui_surface.refresh_seen = division
+                    gui_surface.update_control()
+
     def handle_input(self):
+        # Coalesce everything the Powermate did since the last input tick
+        # in to one tto_globals.events entry
+        if tto_globals.powermate:
+            tto_globals.powermate.poll()
+
         if self.canvas:
             # pygame.event.get() must be run regularly as part of the main
             # program run() loop, or else pygame goes unresponsive.
@@ -165,6 +457,9 @@ class TtoPygame(object):
                 if event.type == pygame.KEYDOWN:  # ESC to quit
                     if event.key == pygame.K_ESCAPE:
                         tto_globals.running = False
+                    # F12 writes out the trace so far, if tracing
+                    if event.key == pygame.K_F12 and tto_globals.tracer:
+                        tto_globals.tracer.write(background=True)
 
                 # Pass all events to the input_key handler
                 self.handle_input_key(event)
@@ -181,45 +476,68 @@ class TtoPygame(object):
                     event_type = "KD"  # KeyDown
 
                 event_label = "{}_{}".format(event_type, event.key)
-                tto_globals.debugger.message("PYGA",
-                                             "handle_input_key() detected: {}".
-                                             format(event_label))
+                tto_globals.debugger.message(category_pyga,
+                                             "handle_input_key() detected: {}",
+                                             event_label)
                 tto_globals.events[event_label] = {'type': event_type,
                                                    'keycode': event.key,
                                                    'event': event}
 
+    def layout(self, x, y, width, height, square=False):
+        """Convert a GUISurface position and size given in relative units,
+        fractions of the canvas width (x, width) and height (y, height), to
+        GUISurface constructor arguments at the render resolution.
+        If square, width is ignored and the surface is height x height.
+        """
+        surface_height = int(round(height * self.render_height))
+        surface_width = int(round(width * self.render_width))
+        if square:
+            surface_width = surface_height
+        return {'canvas_width': surface_width,
+                'canvas_height': surface_height,
+                'blit_x': int(round(x * self.render_width)),
+                'blit_y': int(round(y * self.render_height)),
+                'ui_scale': self.ui_scale}
+
     def init_gui_surfaces(self):
         """Set-up all GUI elements here, and append() each to gui_surfaces
         As part of the framerate-gated handle_graphics() execution, everything
         in gui_surfaces is iterated across and draw_control() /
         update_control() are called
+        Positions and sizes are fractions of the canvas width and height,
+        so the layout holds at any CanvasWidth / CanvasHeight / RenderScale.
         """
 
         # A Terminal that shows live updates to tto_globals.debugger.messages
-        gui_terminal = GUISurfaceTerminal(canvas_width=950,
-                                          canvas_height=260,
-                                          blit_x=960,
-                                          blit_y=390)
+        # Redrawn at most once per debugger coalescing window
+        terminal_hz = tto_globals.config['tto'].getfloat('TerminalHz')
+        if tto_globals.debugger.coalesce_window:
+            terminal_hz = min(terminal_hz,
+                              1 / tto_globals.debugger.coalesce_window)
+        gui_terminal = GUISurfaceTerminal(
+            refresh_hz=terminal_hz,
+            **self.layout(x=0.5, y=0.3611, width=0.4948, height=0.2407))
         self.gui_surfaces.append(gui_terminal)
 
         # The transport strip showing MIDI clock info, play/stop, quant info
-        gui_tstrip = GUISurfaceTransportStrip(canvas_width=950,
-                                              canvas_height=50,
-                                              blit_x=960,
-                                              blit_y=320)
+        gui_tstrip = GUISurfaceTransportStrip(**self.layout(x=0.5,
+                                                            y=0.2963,
+                                                            width=0.4948,
+                                                            height=0.0463))
         self.gui_surfaces.append(gui_tstrip)
 
         # A keyboard map showing all keys, mappings, button status, actions
         # This module maps keyboard input to actions downstream
-        gui_keyboard_map = GUISurfaceKeyboardMap(canvas_width=950,
-                                                 canvas_height=290,
-                                                 blit_x=960,
-                                                 blit_y=10)
+        gui_keyboard_map = GUISurfaceKeyboardMap(**self.layout(x=0.5,
+                                                               y=0.0093,
+                                                               width=0.4948,
+                                                               height=0.2685))
         self.gui_surfaces.append(gui_keyboard_map)
 
         # The control wheel developed as part of the Helm project
-        gui_helm = GUISurfaceHelm(canvas_width=930,
-                                  canvas_height=930,
-                                  blit_x=10,
-                                  blit_y=10)
+        gui_helm = GUISurfaceHelm(**self.layout(x=0.0052,
+                                                y=0.0093,
+                                                width=0.4844,
+                                                height=0.8611,
+                                                square=True))
         self.gui_surfaces.append(gui_helm)
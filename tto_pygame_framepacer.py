@@ -0,0 +1,135 @@
+"""tto_pygame_framepacer - frame pacing and frame-time telemetry for tto
+
+This module decides when pygame should render a frame, and records how long
+each rendered frame actually took.
+
+Frames are only rendered on demand: when no GUISurface is dirty, nothing is
+drawn at all, so an idle UI costs nothing.  While something is changing,
+frames are rendered no faster than fps_max.  If a frame runs over its budget,
+the frame slots it overran are dropped instead of being rendered late
+back-to-back, which keeps the cadence steady.
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+collections : deque for the frame-time history ring.
+time : perf_counter(), a monotonic high resolution clock.
+
+Classes
+-------
+FramePacer : On-demand frame scheduler with per-frame draw/blit/flip timings.
+"""
+
+import tto_globals
+import collections
+import time
+
+
+class FramePacer(object):
+    def __init__(self, fps_max=60, vsync=False, history=600):
+        # Render no faster than this many fps.  0 means uncapped.
+        self.fps_max = fps_max
+        self.frame_interval = 0
+        if self.fps_max > 0:
+            self.frame_interval = 1 / self.fps_max
+
+        # A frame that takes longer than frame_budget seconds is over budget
+        self.frame_budget = self.frame_interval
+
+        # If the display flip waits for vertical blank, the time spent in
+        # flip is mostly waiting, not work.  Leave it out of the budget.
+        self.vsync = vsync
+
+        # perf_counter() is monotonic, so wall clock changes (NTP, DST, etc)
+        # can never stall or burst the frame schedule
+        self.clock = time.perf_counter
+
+        # When the next frame may start
+        self.frame_next = self.clock()
+
+        # Per-phase timings of the frame in progress, in seconds
+        self.frame_start = 0
+        self.time_draw = 0
+        self.time_blit = 0
+        self.time_flip = 0
+
+        # Telemetry.
+        # frame_times holds (start, draw, blit, flip) for recent frames
+        self.frame_times = collections.deque(maxlen=history)
+        self.frames_rendered = 0
+        self.frames_dropped = 0
+        self.frames_over_budget = 0
+
+    def frame_due(self, now=None):
+        if now is None:
+            now = self.clock()
+        return now >= self.frame_next
+
+    def frame_begin(self):
+        self.frame_start = self.clock()
+        self.time_draw = 0
+        self.time_blit = 0
+        self.time_flip = 0
+
+    def frame_skip(self, now=None):
+        """Skip the frame that's due, and schedule the next one a frame
+        interval from now.
+        """
+        if now is None:
+            now = self.clock()
+        self.frame_next = now + self.frame_interval
+
+    def frame_end(self):
+        """Record the finished frame and schedule the next one.
+        Call after frame_begin() once the phase times have been accumulated.
+        """
+        now = self.clock()
+        self.frames_rendered += 1
+        self.frame_times.append((self.frame_start,
+                                 self.time_draw,
+                                 self.time_blit,
+                                 self.time_flip))
+
+        frame_work = self.time_draw + self.time_blit
+        if not self.vsync:
+            frame_work += self.time_flip
+
+        if self.frame_interval == 0:
+            self.frame_next = now
+            return
+
+        if frame_work > self.frame_budget:
+            # Drop every frame slot this frame overran, rather than
+            # rendering the backlog late
+            self.frames_over_budget += 1
+            frames_dropped = int(frame_work / self.frame_interval)
+            self.frames_dropped += frames_dropped
+            tto_globals.debugger.log_stat("Frames dropped", frames_dropped)
+            self.frame_next = self.frame_start + \
+                ((frames_dropped + 1) * self.frame_interval)
+        else:
+            self.frame_next = self.frame_start + self.frame_interval
+
+        # If we've been idle, the schedule is in the past.  Restart the
+        # cadence from now instead of bursting to catch up.
+        if self.frame_next < now:
+            self.frame_next = now
+
+    def stats(self):
+        """Summary of recent frame timings, in milliseconds."""
+        stats = {'frames_rendered': self.frames_rendered,
+                 'frames_dropped': self.frames_dropped,
+                 'frames_over_budget': self.frames_over_budget,
+                 'draw_ms': 0, 'blit_ms': 0, 'flip_ms': 0,
+                 'frame_ms_max': 0}
+        if self.frame_times:
+            count = len(self.frame_times)
+            stats['draw_ms'] = sum(f[1] for f in self.frame_times) / \
+                count * 1000
+            stats['blit_ms'] = sum(f[2] for f in self.frame_times) / \
+                count * 1000
+            stats['flip_ms'] = sum(f[3] for f in self.frame_times) / \
+                count * 1000
+            stats['frame_ms_max'] = max(f[1] + f[2] + f[3]
+                                        for f in self.frame_times) * 1000
+        return stats
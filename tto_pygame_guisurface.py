@@ -10,13 +10,19 @@ class GUISurface(object):
         self.canvas_width = canvas_width
         self.canvas_height = canvas_height
 
+        # ui_scale converts the fixed pixel measurements each GUISurface is
+        # designed around (a 1920x1080 canvas) to this surface's actual
+        # render resolution.  Use self.scaled() on any hard-coded pixel value.
+        self.ui_scale = kwargs.get('ui_scale', 1.0)
+
         self.color = kwargs.get('color', tto_globals.color_orange)
         self.color_bg = kwargs.get('color_bg', tto_globals.color_black)
         self.color_accent = kwargs.get('color_accent',
                                        tto_globals.color_orange_25)
 
         # This is a nice little default font
-        self.font = tto_fonts.font['small']
+        self.font_name = 'small'
+        self.font = tto_fonts.font[self.font_name]
 
         # The X location in which this entire control
         # should be blit to the screen canvas
@@ -33,19 +39,72 @@ class GUISurface(object):
 
         # self.needs_rendering:
         # If this is true for this GUI surface object, the screen will be
-        # re-rendered on the next main loop run.
-        # This will be set to False at the beginning of every execution of the
-        #   update_control method.
-        # Then, during execution of the update_control method, it will be set
+        # re-rendered on the next frame the frame pacer allows.
+        # During execution of the update_control method, it will be set
         #   to True if some change is detected which requires a re-render.
+        # It stays True until the frame is actually rendered, at which point
+        #   TtoPygame sets it back to False.  update_control may run several
+        #   times between frames, so it must never clear this itself.
         # As we come back around in the main loop, if True is detected here,
         # Everyone gets redrawn.
         # For now, set to True so we get an initial render.
+        # Only surfaces that need rendering are redrawn, blit, and updated
+        # on the display in a frame.
         self.needs_rendering = True
 
+        # self.trace_id:
+        # The trace span name for this surface's draw_control(), interned
+        # once here rather than every frame.  0 when not tracing.
+        tracer = tto_globals.tracer
+        self.trace_id = tracer.name_id(self.__class__.__name__) \
+            if tracer else 0
+
+        # self.refresh_policy:
+        # When TtoPygame runs this surface's update_control(), and so how
+        # often it can ask to be redrawn.
+        #   "change" : Every input poll.  For surfaces that only change on
+        #              key presses or key state, which are cheap to check.
+        #   "hz" : At most refresh_hz times a second, so a flood of changes
+        #          can't take more than that share of the frames.
+        #   "clock" : Once every refresh_division MIDI clock pulses, and on
+        #             transport start and stop, checked every main loop so
+        #             it lands as close to the pulse as a frame can.
+        # Whatever the policy, update_control() also runs on any input poll
+        # that brought tto_globals.events, so no key press is missed.
+        self.refresh_policy = kwargs.get('refresh_policy', "change")
+        self.refresh_hz = kwargs.get('refresh_hz', 10)
+        self.refresh_division = kwargs.get('refresh_division', 6)
+        # For "hz", the earliest update_control() may run again
+        self.refresh_next = 0
+
+        # self.static_layer:
+        # A cached copy of everything drawn by draw_static(), e.g. the
+        # background and border.  Built on first use by draw_background(),
+        # so those never need redrawing at any render scale.
+        self.static_layer = None
+
+        # self.state:
+        # The tto_snapshot.StateSnapshot this frame is being drawn from.
+        # TtoPygame sets this just before each draw_control() call.
+        # draw_control() must read musical state from here, not from
+        # tto_globals.key or tto_globals.midi, which may be changing
+        # underneath it on the main loop thread.
+        self.state = None
+
     def init_surface(self):
         pass
 
+    def scaled(self, pixels):
+        """ Scale a design-resolution pixel measurement to this surface's
+        render resolution.
+        """
+        return int(round(pixels * self.ui_scale))
+
+    def scaled_rect(self, left, top, width, height):
+        """ A pygame.Rect from design-resolution pixel measurements. """
+        return pygame.Rect(self.scaled(left), self.scaled(top),
+                           self.scaled(width), self.scaled(height))
+
     def draw_polygon(self, shape, width, color):
         pygame.draw.polygon(self.surface, color, shape.coordinates, width)
 
@@ -65,21 +124,51 @@ class GUISurface(object):
         self.surface.blit(text, [coordinates[0] - text_x,
                                  coordinates[1] - text_y])
 
+    def draw_text(self, coordinates, text_label, font_name, color,
+                  align="left"):
+        """ Draw unrotated text from the font's glyph atlas.
+        Much cheaper than draw_label() for many short, varying strings.
+        """
+        tto_fonts.draw_text(self.surface, coordinates, text_label, font_name,
+                            color, align)
+
+    def text_size(self, text_label, font_name):
+        """ The (width, height) draw_text() draws text_label at. """
+        return tto_fonts.text_size(text_label, font_name)
+
     def draw_control_border(self):
         """ Draw a control border
         # Rect(left, top, width, height)
         """
         rect_border = pygame.Rect(0, 0, self.canvas_width, self.canvas_height)
         pygame.draw.rect(self.surface, tto_globals.color_orange_50,
-                         rect_border, 2)
+                         rect_border, max(1, self.scaled(2)))
+
+    def draw_static(self):
+        """ Draw the parts of this surface that never change.
+        Minimally, the background and self.draw_control_border() for a
+        uniform program-wide GUI surface border between various elements.
+        Override and extend as necessary.  Only called once, by
+        draw_background().
+        """
+        self.surface.fill(self.color_bg)
+        self.draw_control_border()
+
+    def draw_background(self):
+        """ Start a frame from the cached static layer, building it with
+        draw_static() the first time.
+        """
+        if self.static_layer is None:
+            self.draw_static()
+            self.static_layer = self.surface.copy()
+        else:
+            self.surface.blit(self.static_layer, (0, 0))
 
     def draw_control(self):
         """ Draw the actual GUI elements on self.surface
-        Minimally, self.draw_control_border() for a uniform program-wide
-        GUI surface border between various elements.
+        Minimally, self.draw_background() for the static layer.
         """
-        self.surface.fill(self.color_bg)
-        self.draw_control_border()
+        self.draw_background()
 
     def update_control(self):
         """ Determines whether needs_rendering = True
@@ -87,4 +176,4 @@ class GUISurface(object):
         the tto_globals.events dict
         Override as necessary.
         """
-        self.needs_rendering = False
+        pass
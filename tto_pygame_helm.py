@@ -1,6 +1,9 @@
 from tto_pygame_guisurface import GUISurface
 import tto_fonts
 from tto_shapes import *
+import collections
+import pygame
+import time
 
 
 class GUISurfaceHelm(GUISurface):
@@ -12,30 +15,97 @@ class GUISurfaceHelm(GUISurface):
         # Radius for polar coord system
         self.r = int(self.canvas_height / 2)
 
-        # rotate_offset tracks the overall rotation of the wheel in degrees
-        # As the user rotates the wheel, this value is incremented/decremented
-        self.rotate_offset = 0
-
-        # rotate_offset_note tracks overall rotation, but for the selected
-        # note
-        self.rotate_offset_chord = 0
+        # Center of the wheel on self.surface
+        self.center = (int(self.r * 2 / 2) + tto_globals.canvas_margin,
+                       int(self.r * 2 / 2) + tto_globals.canvas_margin)
 
         # The circle is divided in to 12 segments
         # But if want a _side_ to be oriented upwards, not a _point_
         # then back it up an additional 1/24th of a circle
         self.offset_degrees = int(-360 / 24)
 
-    def draw_key_labels(self, shape, labels):
+        # Powermate detents turned but not yet enough to change key
+        self.powermate_rotation = 0
+        self.powermate_detents = tto_globals.config['tto'].\
+            getint('PowermateDetents')
+
+        # The wheel is drawn as a stack of cached layers, so that a frame is
+        # a handful of blits instead of ~100 font renders:
+        #   static layer (draw_static): background, border, fixed labels,
+        #       and the diatonic slices
+        #   'key' layer: the note names, which rotate with the key
+        #   currently playing highlights, drawn live
+        #   'degrees' layer: scale degree / triad / mode labels, fixed
+        #   'intervals' layer: chord interval numbers for the scale degree
+        #   'chord' layer: the scale degree pointer, which rotates with the
+        #       scale degree
+        # layer_cache maps (layer name, variant, angle) to (surface, rect).
+        # It holds the crisp layer for each key or scale degree at rest,
+        # plus rotated copies used while animating.  Least recently used
+        # entries are dropped past layer_cache_size.
+        self.layer_cache = collections.OrderedDict()
+        self.layer_cache_size = 24
+
+        # The "currently playing" highlight polygons never move, so work
+        # them out once
+        self.highlight_slices = WheelGeometry(
+            canvas_size=self.r * 2,
+            radii=[self.r - self.scaled(160)],
+            offset_degrees=self.offset_degrees).slices[0]
+
+        # Animated rotation.  Changing key or scale degree eases the
+        # rotating layers from where they are to where they're going over
+        # animation_time seconds.  0 snaps instantly, like the old helm.
+        self.animation_time = tto_globals.config['tto'].\
+            getint('HelmAnimationMs') / 1000
+        self.clock = time.perf_counter
+        # Per rotating layer: [variant, angle_from, angle_to, start time]
+        # variant is the key or scale degree being rotated to
+        self.animations = {'key': None, 'chord': None}
+        # Most recent angle drawn for each rotating layer
+        self.angles = {'key': None, 'chord': None}
+
+        # Per-frame CPU budget for drawing the helm.  While animating, if
+        # a frame goes over, rotated layers are snapped to a coarser
+        # angle_step, so more frames come straight from layer_cache, and
+        # the cheaper non-smoothed rotate is used.  The step carries over to
+        # the next animation, and only comes back down after a whole
+        # animation comfortably under budget, so an animation starts from
+        # what the last one needed rather than finding out again.
+        self.frame_budget = tto_globals.config['tto'].\
+            getfloat('HelmFrameBudgetMs') / 1000
+        self.angle_step = 1
+        self.angle_step_max = 8
+
+        # Rendering or rotating a layer costs more than the rest of a frame
+        # put together, so a frame does at most one.  Any other layer that
+        # needs one is drawn as it was last frame, from layers_drawn, and
+        # catching_up asks for another frame to finish the job.
+        self.layers_drawn = {}  # [layer name] = (surface, rect)
+        self.frame_layer_work = 0
+        self.catching_up = False
+
+        # Draw times of animation frames, for telemetry
+        self.animation_frame_times = collections.deque(maxlen=600)
+        self.animation_frames = 0
+        self.animation_frame_max = 0
+
+        # Last key state seen by update_control(), to detect changes
+        self.seen_key = None
+        self.seen_scale_degree = None
+        self.seen_notes_on = None
+
+    def draw_key_labels(self, shape, labels, current_key):
         coord_pair = 0
         for coordinates in shape.coordinates:
-            if (coord_pair >= tto_globals.key.current_key) and \
-               (coord_pair <= (tto_globals.key.current_key + 5)) and \
-                    (tto_globals.key.current_key in range(7)):
+            if (coord_pair >= current_key) and \
+               (coord_pair <= (current_key + 5)) and \
+                    (current_key in range(7)):
                 # sharps
                 note_label = labels[coord_pair]['sharpName']
             else:
                 note_label = labels[coord_pair]['noteName']
-            if tto_globals.key.current_key == coord_pair:
+            if current_key == coord_pair:
                 font = tto_fonts.font['medium_bold']
             else:
                 font = tto_fonts.font['medium']
@@ -47,129 +117,155 @@ class GUISurfaceHelm(GUISurface):
             coord_pair += 1
 
     def update_control(self):
-        self.needs_rendering = False
         # Handle the dict of events passed in for this update
-        # for event in tto_globals.events:
-        #    pass
-
-    def draw_control(self):
-
-        ####################
-        # Background stuff #
-        ####################
-
-        self.surface.fill(self.color_bg)
-
-        self.draw_control_border()
-
-        self.rotate_offset = int(tto_globals.key.current_key * (-360/12))
+        if 'RO_powermate' in tto_globals.events:
+            # Turning the knob clockwise turns the wheel clockwise, which
+            # is towards the 4ths.  Every powermate_detents detents of
+            # rotation is one key.
+            self.powermate_rotation += \
+                tto_globals.events['RO_powermate']['delta']
+            keys = int(self.powermate_rotation / self.powermate_detents)
+            if keys:
+                self.powermate_rotation -= keys * self.powermate_detents
+                tto_globals.key.set_key((tto_globals.key.current_key -
+                                         keys) % 12)
+
+        # Redraw whenever the key state changes, and on every frame while
+        # animating
+        key = tto_globals.key
+        if key.current_key != self.seen_key or \
+                key.current_scale_degree != self.seen_scale_degree or \
+                key.notes_on_mask != self.seen_notes_on:
+            self.seen_key = key.current_key
+            self.seen_scale_degree = key.current_scale_degree
+            self.seen_notes_on = key.notes_on_mask
+            self.needs_rendering = True
+        if self.animations['key'] or self.animations['chord'] or \
+                self.catching_up:
+            self.needs_rendering = True
+
+    ##########
+    # Layers #
+    ##########
+
+    def layer_render(self, draw_function, *args):
+        """Run draw_function on a fresh transparent layer instead of
+        self.surface, and return the layer cropped to a square centered on
+        the wheel, as (surface, rect).  Centered so it can be rotated about
+        the wheel center.
+        """
+        surface = self.surface
+        layer = pygame.Surface(surface.get_size(), pygame.SRCALPHA)
+        self.surface = layer
+        try:
+            draw_function(*args)
+        finally:
+            self.surface = surface
+
+        bounds = layer.get_bounding_rect()
+        half = max(self.center[0] - bounds.left,
+                   bounds.right - self.center[0],
+                   self.center[1] - bounds.top,
+                   bounds.bottom - self.center[1],
+                   1)
+        half = min(half, self.center[0], self.center[1])
+        rect = pygame.Rect(self.center[0] - half, self.center[1] - half,
+                           half * 2, half * 2)
+        layer = layer.subsurface(rect).copy()
+        if pygame.display.get_surface() is not None:
+            layer = layer.convert_alpha()
+        return layer, rect
+
+    def layer_get(self, name, variant, angle=None):
+        """Return (surface, rect) of a cached layer.  Without an angle, the
+        crisp layer for variant at rest.  With an angle, that layer rotated
+        to the given absolute angle in degrees, clockwise.
+        """
+        cache_key = (name, variant, angle)
+        if cache_key in self.layer_cache:
+            self.layer_cache.move_to_end(cache_key)
+            return self.layer_cache[cache_key]
+
+        if angle is None:
+            layer = self.layer_render(getattr(self, "layer_draw_" + name),
+                                      variant)
+        else:
+            layer, rect = self.layer_get(name, variant)
+            rest = self.layer_angle(name, variant)
+            if self.angle_step > 1:
+                # Over budget, so use the faster, unsmoothed rotate
+                rotated = pygame.transform.rotate(layer, rest - angle)
+            else:
+                rotated = pygame.transform.rotozoom(layer, rest - angle, 1)
+            layer = (rotated, rotated.get_rect(center=self.center))
+
+        self.layer_cache[cache_key] = layer
+        if len(self.layer_cache) > self.layer_cache_size:
+            self.layer_cache.popitem(last=False)
+        return layer
+
+    def layer_blit(self, name, variant, angle=None):
+        """Blit a layer from layer_get(), unless that would mean rendering
+        or rotating a second layer this frame.  Then blit what was drawn for
+        it last frame instead, and catch up next frame.
+        """
+        layer = self.layer_cache.get((name, variant, angle))
+        drawn = self.layers_drawn.get(name)
+        if layer is not None:
+            self.layer_cache.move_to_end((name, variant, angle))
+        elif drawn is not None and self.frame_layer_work:
+            # Already done this frame's one
+            layer = drawn
+            self.catching_up = True
+        elif drawn is not None and angle is not None and \
+                (name, variant, None) not in self.layer_cache:
+            # Rotating needs the crisp layer rendered first.  That's this
+            # frame's one, and the rotation is next frame's.
+            self.layer_get(name, variant)
+            self.frame_layer_work += 1
+            layer = drawn
+            self.catching_up = True
+        else:
+            # Nothing drawn for it yet, e.g. the first frame, has to be
+            # drawn now, whatever it costs
+            layer = self.layer_get(name, variant, angle)
+            self.frame_layer_work += 1
+        self.layers_drawn[name] = layer
+        self.surface.blit(*layer)
+
+    def layer_angle(self, name, variant):
+        """The resting angle of a rotating layer, in degrees clockwise."""
+        if name == "key":
+            return int(variant * (-360/12))
 
         # For the Chord Interval labels, rollover from position 6 to 11
         # because all the non-Diatonics live in positions 6-10
-        adjusted_scale_degree = tto_globals.key.current_scale_degree
-        if adjusted_scale_degree == 6:
-            adjusted_scale_degree = 11
-
-        self.rotate_offset_chord = int(adjusted_scale_degree *
-                                       (360/12))
-
-        #############
-        # Key label #
-        #############
-
-        for i in [0]:  # Wheel position 0
-            polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                    r=self.r-7,
-                                    slice_no=i)
-            self.draw_label(polygon.coordinates[1],
-                            polygon.degrees[0],
-                            "Key",
-                            tto_fonts.font['medium'],
-                            self.color)
-
-        #########################
-        # Labels for directions #
-        #########################
-
-        for i in [1]:  # Wheel position 1
-            polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                    r=self.r-7,
-                                    slice_no=i)
-            self.draw_label(polygon.coordinates[1],
-                            polygon.degrees[0],
-                            "5ths >",
-                            tto_fonts.font['medium'],
-                            self.color_accent)
-        for i in [11]:  # Wheel position 11
-            polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                    r=self.r-7,
-                                    slice_no=i)
-            self.draw_label(polygon.coordinates[1],
-                            polygon.degrees[0],
-                            "< 4ths",
-                            tto_fonts.font['medium'],
-                            self.color_accent)
+        if variant == 6:
+            variant = 11
+        return int(variant * (360/12))
 
+    def layer_draw_key(self, current_key):
         ############################
         # Draw the key note labels #
         ############################
-        # This uses self.rotate_offset, so it's a rotating layer
+        # Rotates with the key, so it's a rotating layer
         label_circle = ShapeWheel(canvas_size=self.r * 2,
-                                  r=self.r - 56,
-                                  offset_degrees=self.rotate_offset)
-        self.draw_key_labels(label_circle, tto_globals.key.notes)
-
-        ############################
-        # Draw the diatonic slices #
-        ############################
-        for i in [0, 1, 2, 3, 4, 5, 11]:
-            # Inner triangles bg color fill
-            polygon = ShapeWheelSlice(canvas_size=self.r * 2,
-                                      r=self.r - 70,
-                                      slice_no=i,
-                                      offset_degrees=self.offset_degrees)
-            self.draw_polygon(polygon, 0, self.color_accent)
-
-            # Outlines
-            polygon = ShapeWheelSlice(canvas_size=self.r * 2,
-                                      r=self.r - 12,
-                                      slice_no=i,
-                                      offset_degrees=self.offset_degrees)
-            self.draw_polygon(polygon, 1, self.color)
-
-        ########################################
-        # Highlight anything currently playing #
-        ########################################
-        for i in range(12):
-            # "Currently playing" highlights, if on:
-            if ((i + tto_globals.key.current_key) % 12) \
-                    in tto_globals.key.notes_on:
-                polygon = ShapeWheelSlice(canvas_size=self.r * 2,
-                                          r=self.r - 160,
-                                          slice_no=i,
-                                          offset_degrees=self.offset_degrees)
-                self.draw_polygon(polygon, 0, self.color)
+                                  r=self.r - self.scaled(56),
+                                  offset_degrees=self.layer_angle(
+                                      "key", current_key))
+        self.draw_key_labels(label_circle, tto_globals.key.notes,
+                             current_key)
 
+    def layer_draw_degrees(self, variant):
         ###################
         # Diatonic labels #
         ###################
 
-        # Scale Degree word label
-        polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                r=self.r - 100,
-                                slice_no=0,
-                                offset_degrees=self.rotate_offset_chord)
-        self.draw_label(polygon.coordinates[1],
-                        polygon.degrees[0],
-                        "Scale degree",
-                        tto_fonts.font['small_bold'],
-                        self.color_bg)
-
         # Scale Degree number & labels all the way around the wheel
         for label in tto_globals.key.fifths:
             # The actual digit label
             polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                    r=self.r - 130,
+                                    r=self.r - self.scaled(130),
                                     slice_no=label)
 
             self.draw_label(polygon.coordinates[1],
@@ -181,7 +277,7 @@ class GUISurfaceHelm(GUISurface):
 
             # The triad e.g. MAJ, min, dim
             polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                    r=self.r - 160,
+                                    r=self.r - self.scaled(160),
                                     slice_no=label)
             self.draw_label(polygon.coordinates[1],
                             polygon.degrees[0],
@@ -192,7 +288,7 @@ class GUISurfaceHelm(GUISurface):
 
             # The scale degree mode e.g. Ionian, Mixolydian, etc
             polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                    r=self.r - 180,
+                                    r=self.r - self.scaled(180),
                                     slice_no=label)
             self.draw_label(polygon.coordinates[1],
                             polygon.degrees[0],
@@ -201,15 +297,29 @@ class GUISurfaceHelm(GUISurface):
                             tto_fonts.font['x_small'],
                             self.color_bg)
 
+    def layer_draw_chord(self, current_scale_degree):
         #########################################
         # Selected scale degree chord intervals #
         #########################################
+        # Rotates with the scale degree, so it's a rotating layer
+        rotate_offset_chord = self.layer_angle("chord", current_scale_degree)
+
+        # Scale Degree word label
+        polygon = ShapeWheelRay(canvas_size=self.r * 2,
+                                r=self.r - self.scaled(100),
+                                slice_no=0,
+                                offset_degrees=rotate_offset_chord)
+        self.draw_label(polygon.coordinates[1],
+                        polygon.degrees[0],
+                        "Scale degree",
+                        tto_fonts.font['small_bold'],
+                        self.color_bg)
 
         # The up arrow ↑
         polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                r=self.r - 213,
+                                r=self.r - self.scaled(213),
                                 slice_no=0,
-                                offset_degrees=self.rotate_offset_chord)
+                                offset_degrees=rotate_offset_chord)
         self.draw_label(polygon.coordinates[1],
                         polygon.degrees[0],
                         "^",
@@ -218,38 +328,39 @@ class GUISurfaceHelm(GUISurface):
 
         # The chord interval words
         polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                r=self.r - 247,
+                                r=self.r - self.scaled(247),
                                 slice_no=0,
-                                offset_degrees=self.rotate_offset_chord)
+                                offset_degrees=rotate_offset_chord)
         self.draw_label(polygon.coordinates[1],
                         polygon.degrees[0],
                         "Chord",
                         tto_fonts.font['x_small'],
                         self.color_bg)
         polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                r=self.r - 263,
+                                r=self.r - self.scaled(263),
                                 slice_no=0,
-                                offset_degrees=self.rotate_offset_chord)
+                                offset_degrees=rotate_offset_chord)
         self.draw_label(polygon.coordinates[1],
                         polygon.degrees[0],
                         "interval",
                         tto_fonts.font['x_small'],
                         self.color_bg)
 
+    def layer_draw_intervals(self, current_scale_degree):
         # The 'slices' of tto_globals.key.fifths in the default order
         scale_degree_order = [11, 0, 1, 2, 3, 4, 5]
 
-        # Now Cut The Deck depending on tto_globals.key.current_scale_degree
-        if tto_globals.key.current_scale_degree > 0:
+        # Now Cut The Deck depending on current_scale_degree
+        if current_scale_degree > 0:
             scale_degree_order = \
-                scale_degree_order[7-tto_globals.key.current_scale_degree:] + \
-                scale_degree_order[0:7-tto_globals.key.current_scale_degree]
+                scale_degree_order[7-current_scale_degree:] + \
+                scale_degree_order[0:7-current_scale_degree]
 
         # Chord interval number all the way around the wheel
         for label in tto_globals.key.fifths:
             # The actual digit label
             polygon = ShapeWheelRay(canvas_size=self.r * 2,
-                                    r=self.r - 295,
+                                    r=self.r - self.scaled(295),
                                     slice_no=label)
             self.draw_label(polygon.coordinates[1],
                             polygon.degrees[0],
@@ -259,3 +370,174 @@ class GUISurfaceHelm(GUISurface):
                                 ["step"]),
                             tto_fonts.font['medium_bold'],
                             self.color_bg)
+
+    def draw_static(self):
+        """ Overriding GUISurface.draw_static()
+        """
+
+        ####################
+        # Background stuff #
+        ####################
+
+        super(self.__class__, self).draw_static()
+
+        #############
+        # Key label #
+        #############
+
+        for i in [0]:  # Wheel position 0
+            polygon = ShapeWheelRay(canvas_size=self.r * 2,
+                                    r=self.r - self.scaled(7),
+                                    slice_no=i)
+            self.draw_label(polygon.coordinates[1],
+                            polygon.degrees[0],
+                            "Key",
+                            tto_fonts.font['medium'],
+                            self.color)
+
+        #########################
+        # Labels for directions #
+        #########################
+
+        for i in [1]:  # Wheel position 1
+            polygon = ShapeWheelRay(canvas_size=self.r * 2,
+                                    r=self.r - self.scaled(7),
+                                    slice_no=i)
+            self.draw_label(polygon.coordinates[1],
+                            polygon.degrees[0],
+                            "5ths >",
+                            tto_fonts.font['medium'],
+                            self.color_accent)
+        for i in [11]:  # Wheel position 11
+            polygon = ShapeWheelRay(canvas_size=self.r * 2,
+                                    r=self.r - self.scaled(7),
+                                    slice_no=i)
+            self.draw_label(polygon.coordinates[1],
+                            polygon.degrees[0],
+                            "< 4ths",
+                            tto_fonts.font['medium'],
+                            self.color_accent)
+
+        ############################
+        # Draw the diatonic slices #
+        ############################
+        # These don't overlap the key note labels, so they can live on the
+        # static layer underneath them
+        for i in [0, 1, 2, 3, 4, 5, 11]:
+            # Inner triangles bg color fill
+            polygon = ShapeWheelSlice(canvas_size=self.r * 2,
+                                      r=self.r - self.scaled(70),
+                                      slice_no=i,
+                                      offset_degrees=self.offset_degrees)
+            self.draw_polygon(polygon, 0, self.color_accent)
+
+            # Outlines
+            polygon = ShapeWheelSlice(canvas_size=self.r * 2,
+                                      r=self.r - self.scaled(12),
+                                      slice_no=i,
+                                      offset_degrees=self.offset_degrees)
+            self.draw_polygon(polygon, 1, self.color)
+
+    ###########
+    # Drawing #
+    ###########
+
+    def animation_angle(self, name, variant, now):
+        """Where rotating layer name should be drawn this frame, in degrees,
+        starting or retargeting its animation if variant has changed.
+        Returns None when the layer is at rest.
+        """
+        animation = self.animations[name]
+        target = self.layer_angle(name, variant)
+        if animation is None:
+            if self.angles[name] is None or self.angles[name] == target or \
+                    self.animation_time <= 0:
+                self.angles[name] = target
+                return None
+            # Rotate the short way around
+            angle_from = target + \
+                ((self.angles[name] - target + 180) % 360) - 180
+            animation = [variant, angle_from, target, now]
+            self.animations[name] = animation
+        elif animation[0] != variant:
+            # Retarget mid-animation, starting from wherever we are now
+            angle_from = target + \
+                ((self.angles[name] - target + 180) % 360) - 180
+            animation[:] = [variant, angle_from, target, now]
+
+        progress = (now - animation[3]) / self.animation_time
+        if progress >= 1:
+            self.animations[name] = None
+            self.angles[name] = target
+            return None
+
+        # Ease in-out cubic
+        if progress < 0.5:
+            eased = 4 * progress * progress * progress
+        else:
+            eased = 1 - ((-2 * progress + 2) ** 3) / 2
+        angle = animation[1] + ((animation[2] - animation[1]) * eased)
+        self.angles[name] = angle
+
+        # Snap to angle_step so that frames can share rotated layers
+        return int(round(angle / self.angle_step) * self.angle_step) % 360
+
+    def draw_control(self):
+        frame_start = self.clock()
+        current_key = self.state.current_key
+        current_scale_degree = self.state.current_scale_degree
+
+        key_angle = self.animation_angle("key", current_key, frame_start)
+        chord_angle = self.animation_angle("chord", current_scale_degree,
+                                           frame_start)
+        self.frame_layer_work = 0
+        self.catching_up = False
+
+        self.draw_background()
+
+        self.layer_blit("key", current_key, key_angle)
+
+        ########################################
+        # Highlight anything currently playing #
+        ########################################
+        # Rotate the notes on mask once so bit i is wheel position i
+        notes_on = tto_globals.key.notes_on_rotated(current_key,
+                                                    self.state.notes_on)
+        i = 0
+        while notes_on:
+            # "Currently playing" highlights, if on:
+            if notes_on & 1:
+                pygame.draw.polygon(self.surface, self.color,
+                                    self.highlight_slices[i], 0)
+            notes_on >>= 1
+            i += 1
+
+        self.layer_blit("degrees", 0)
+        self.layer_blit("chord", current_scale_degree, chord_angle)
+        self.layer_blit("intervals", current_scale_degree)
+
+        if key_angle is not None or chord_angle is not None or \
+                self.catching_up:
+            frame_time = self.clock() - frame_start
+            self.animation_frame_times.append(frame_time)
+            self.animation_frames += 1
+            if frame_time > self.animation_frame_max:
+                self.animation_frame_max = frame_time
+            if frame_time > self.frame_budget:
+                self.angle_step = min(self.angle_step * 2,
+                                      self.angle_step_max)
+        elif self.animation_frames:
+            # Only step back down once a whole animation had room to spare
+            if self.animation_frame_max < self.frame_budget / 2 and \
+                    self.angle_step > 1:
+                self.angle_step = int(self.angle_step / 2)
+            tto_globals.debugger.message(
+                "PYGA",
+                "Helm animation: {} frames, mean {:.2f} ms, max {:.2f} ms, "
+                "angle step {}",
+                self.animation_frames,
+                (sum(self.animation_frame_times) /
+                 len(self.animation_frame_times)) * 1000,
+                self.animation_frame_max * 1000, self.angle_step)
+            self.animation_frames = 0
+            self.animation_frame_max = 0
@@ -1,5 +1,6 @@
 from tto_pygame_guisurface import GUISurface
 from tto_shapes import *
+from tto_debugger import category_keyb
 import pygame
 
 
@@ -211,6 +212,23 @@ class GUISurfaceKeyboardMap(GUISurface):
                 tto_globals.color_black
             i += 1
 
+        # fn 1 switches the arpeggiator on and off, fn 2 changes its mode
+        self.keyboard_layout[3][0]['setting'] = "arp"
+        self.keyboard_layout[3][0]['button_label_1'] = "Arp"
+        self.keyboard_layout[3][1]['setting'] = "arp_mode"
+        self.keyboard_layout[3][1]['button_label_1'] = "Mode"
+        self.update_arp_labels()
+
+        # fn 3-5 record, overdub and clear the looper
+        self.keyboard_layout[3][2]['setting'] = "loop_rec"
+        self.keyboard_layout[3][2]['button_label_1'] = "Rec"
+        self.keyboard_layout[3][3]['setting'] = "loop_dub"
+        self.keyboard_layout[3][3]['button_label_1'] = "Dub"
+        self.keyboard_layout[3][4]['setting'] = "loop_clear"
+        self.keyboard_layout[3][4]['button_label_1'] = "Clear"
+        self.looper_state = None
+        self.update_looper_labels()
+
         self.button_keyboard_codelist = \
             (96, 49, 50, 51, 52, 53, 54, 55, 56, 57, 48, 45,
              113, 119, 101, 114, 116, 121, 117, 105, 111, 112, 91, 93,
@@ -240,127 +258,153 @@ class GUISurfaceKeyboardMap(GUISurface):
 
         self.color = tto_globals.color_orange_50
 
+        # What draw_control() draws each button with, (bg color, fg color,
+        # label 1, label 2, label 3).  keyboard_layout is changed in place
+        # by update_control() on the main loop, so this is rebuilt whole
+        # from it after each change, for the render thread to read.
+        self.buttons = ()
+        self.buttons_publish()
+
+    def buttons_publish(self):
+        self.buttons = tuple(tuple((button['button_color_bg'],
+                                    button['button_color_fg'],
+                                    button['button_label_1'],
+                                    button['button_label_2'],
+                                    button['button_label_3'])
+                                   for button in row)
+                             for row in self.keyboard_layout)
+
+    def draw_static(self):
+        """ Overriding GUISurface.draw_static()
+        """
+        super(self.__class__, self).draw_static()
+
+        # Draw the keyboard row labels
+        self.draw_text(coordinates=(self.scaled(8),
+                                    self.scaled(7)),
+                       text_label="Key sig",
+                       font_name=self.font_name,
+                       color=self.color,
+                       align="left")
+        self.draw_text(coordinates=(self.scaled(8),
+                                    self.scaled(27)),
+                       text_label="Tone class",
+                       font_name=self.font_name,
+                       color=self.color,
+                       align="left")
+        self.draw_text(coordinates=(self.scaled(8),
+                                    self.scaled(47)),
+                       text_label="Tonal root",
+                       font_name=self.font_name,
+                       color=self.color,
+                       align="left")
+
+        self.draw_text(coordinates=(self.scaled(8),
+                                    self.scaled(27 + 71 - 10)),
+                       text_label="Scale",
+                       font_name=self.font_name,
+                       color=self.color,
+                       align="left")
+        self.draw_text(coordinates=(self.scaled(8),
+                                    self.scaled(27 + 71 + 10)),
+                       text_label="degree",
+                       font_name=self.font_name,
+                       color=self.color,
+                       align="left")
+
+        self.draw_text(coordinates=(self.scaled(8),
+                                    self.scaled(27 + (71 * 2) - 10)),
+                       text_label="Chord",
+                       font_name=self.font_name,
+                       color=self.color,
+                       align="left")
+        self.draw_text(coordinates=(self.scaled(8),
+                                    self.scaled(27 + (71 * 2) + 10)),
+                       text_label="interval",
+                       font_name=self.font_name,
+                       color=self.color,
+                       align="left")
+
+        self.draw_text(coordinates=(self.scaled(8),
+                                    self.scaled(27 + (71 * 3) - 10)),
+                       text_label="Control",
+                       font_name=self.font_name,
+                       color=self.color,
+                       align="left")
+        self.draw_text(coordinates=(self.scaled(8),
+                                    self.scaled(27 + (71 * 3) + 10)),
+                       text_label="buttons",
+                       font_name=self.font_name,
+                       color=self.color,
+                       align="left")
+
     def draw_control(self):
         """ Overriding GUISurface.draw_control()
         """
-        self.surface.fill(self.color_bg)
-        self.draw_control_border()
+        self.draw_background()
 
-        # Draw the keyboard row labels
-        self.draw_label(coordinates=(8, 7),
-                        degrees=0,
-                        text_label="Key sig",
-                        font=self.font,
-                        color=self.color,
-                        align="left")
-        self.draw_label(coordinates=(8, 27),
-                        degrees=0,
-                        text_label="Tone class",
-                        font=self.font,
-                        color=self.color,
-                        align="left")
-        self.draw_label(coordinates=(8, 47),
-                        degrees=0,
-                        text_label="Tonal root",
-                        font=self.font,
-                        color=self.color,
-                        align="left")
-
-        self.draw_label(coordinates=(8, 27 + 71 - 10),
-                        degrees=0,
-                        text_label="Scale",
-                        font=self.font,
-                        color=self.color,
-                        align="left")
-        self.draw_label(coordinates=(8, 27 + 71 + 10),
-                        degrees=0,
-                        text_label="degree",
-                        font=self.font,
-                        color=self.color,
-                        align="left")
-
-        self.draw_label(coordinates=(8, 27 + (71 * 2) - 10),
-                        degrees=0,
-                        text_label="Chord",
-                        font=self.font,
-                        color=self.color,
-                        align="left")
-        self.draw_label(coordinates=(8, 27 + (71 * 2) + 10),
-                        degrees=0,
-                        text_label="interval",
-                        font=self.font,
-                        color=self.color,
-                        align="left")
-
-        self.draw_label(coordinates=(8, 27 + (71 * 3) - 10),
-                        degrees=0,
-                        text_label="Control",
-                        font=self.font,
-                        color=self.color,
-                        align="left")
-        self.draw_label(coordinates=(8, 27 + (71 * 3) + 10),
-                        degrees=0,
-                        text_label="buttons",
-                        font=self.font,
-                        color=self.color,
-                        align="left")
+        buttons = self.buttons
 
         # Draw the keyboard
         for row in range(self.rows):
             for col in range(self.cols):
+                color_bg, color_fg, label_1, label_2, label_3 = \
+                    buttons[row][col]
                 # Background square color
-                rect_key = pygame.Rect(110 + (col * 70),
-                                       10 + (row * 70),
-                                       60,
-                                       60)
+                rect_key = self.scaled_rect(110 + (col * 70),
+                                            10 + (row * 70),
+                                            60,
+                                            60)
                 pygame.draw.rect(self.surface,
-                                 self.keyboard_layout[row][col]
-                                 ['button_color_bg'],
+                                 color_bg,
                                  rect_key,
                                  0)
                 # Foreground square border
-                rect_key = pygame.Rect(110 + (col * 70),
-                                       10 + (row * 70),
-                                       60,
-                                       60)
+                rect_key = self.scaled_rect(110 + (col * 70),
+                                            10 + (row * 70),
+                                            60,
+                                            60)
                 pygame.draw.rect(self.surface,
-                                 self.keyboard_layout[row][col]
-                                 ['button_color_fg'],
+                                 color_fg,
                                  rect_key,
                                  1)
                 # Per-button label 1 - 5 char width
-                self.draw_label(coordinates=(110 + (col * 70) + 4,
-                                             10 + (row * 70)),
-                                degrees=0,
-                                text_label="{}".format(
-                                    self.keyboard_layout[row][col]
-                                    ['button_label_1']),
-                                font=self.font,
-                                color=self.keyboard_layout[row][col]
-                                ['button_color_fg'],
-                                align="left")
+                self.draw_text(coordinates=(self.scaled(110 + (col * 70) + 4),
+                                            self.scaled(10 + (row * 70))),
+                               text_label="{}".format(label_1),
+                               font_name=self.font_name,
+                               color=color_fg,
+                               align="left")
                 # Per-button label 2 - 5 char width
-                self.draw_label(coordinates=(110 + (col * 70) + 4,
-                                             10 + (row * 70) + 20),
-                                degrees=0,
-                                text_label="{}".format(
-                                    self.keyboard_layout[row][col]
-                                    ['button_label_2']),
-                                font=self.font,
-                                color=self.keyboard_layout[row][col]
-                                ['button_color_fg'],
-                                align="left")
+                self.draw_text(coordinates=(self.scaled(110 + (col * 70) + 4),
+                                            self.scaled(10 + (row * 70) + 20)),
+                               text_label="{}".format(label_2),
+                               font_name=self.font_name,
+                               color=color_fg,
+                               align="left")
                 # Per-button label 3 - 5 char width
-                self.draw_label(coordinates=(110 + (col * 70) + 4,
-                                             10 + (row * 70) + 40),
-                                degrees=0,
-                                text_label="{}".format(
-                                    self.keyboard_layout[row][col]
-                                    ['button_label_3']),
-                                font=self.font,
-                                color=self.keyboard_layout[row][col]
-                                ['button_color_fg'],
-                                align="left")
+                self.draw_text(coordinates=(self.scaled(110 + (col * 70) + 4),
+                                            self.scaled(10 + (row * 70) + 40)),
+                               text_label="{}".format(label_3),
+                               font_name=self.font_name,
+                               color=color_fg,
+                               align="left")
+
+    def update_arp_labels(self):
+        arpeggiator = tto_globals.arpeggiator
+        if arpeggiator:
+            self.keyboard_layout[3][0]['button_label_2'] = \
+                "on" if arpeggiator.enabled else "off"
+            self.keyboard_layout[3][1]['button_label_2'] = arpeggiator.mode
+
+    def update_looper_labels(self):
+        looper = tto_globals.looper
+        if looper:
+            self.looper_state = looper.state
+            self.keyboard_layout[3][2]['button_label_2'] = \
+                looper.state if looper.state in ("armed", "record") else ""
+            self.keyboard_layout[3][3]['button_label_2'] = \
+                "on" if looper.state == "overdub" else ""
 
     def get_button_color(self, row, col, color_setting):
         # I had to make these to get this to lint cleanly
@@ -391,12 +435,17 @@ class GUISurfaceKeyboardMap(GUISurface):
     def update_control(self):
         """ Overriding GUISurface.update_control()
         """
-        self.needs_rendering = False
+        # The looper moves between states on the clock, too
+        if tto_globals.looper and \
+                tto_globals.looper.state != self.looper_state:
+            self.update_looper_labels()
+            self.needs_rendering = True
+
         for event in tto_globals.events:
             tto_globals.debugger.message(
-                "KEYB",
-                "GUISurfaceKeyboardMap update_control() saw event: {}".format(
-                    event))
+                category_keyb,
+                "GUISurfaceKeyboardMap update_control() saw event: {}",
+                event)
 
             keycode = tto_globals.events[event]['keycode']
 
@@ -430,6 +479,29 @@ class GUISurfaceKeyboardMap(GUISurface):
                         # Change the scale degree to the assoc. value
                         tto_globals.key.set_scale_degree(key_index)
 
+                    # fn buttons for the arpeggiator
+                    if tto_globals.arpeggiator and \
+                            self.keyboard_layout[row][col]['setting'] == \
+                            "arp":
+                        tto_globals.arpeggiator.set_enabled(
+                            not tto_globals.arpeggiator.enabled)
+                        self.update_arp_labels()
+                    if tto_globals.arpeggiator and \
+                            self.keyboard_layout[row][col]['setting'] == \
+                            "arp_mode":
+                        tto_globals.arpeggiator.mode_next()
+                        self.update_arp_labels()
+
+                    # fn buttons for the looper
+                    if tto_globals.looper:
+                        setting = self.keyboard_layout[row][col]['setting']
+                        if setting == "loop_rec":
+                            tto_globals.looper.record_toggle()
+                        if setting == "loop_dub":
+                            tto_globals.looper.overdub_toggle()
+                        if setting == "loop_clear":
+                            tto_globals.looper.clear()
+
                 # If the detected keystroke is to play a chord note:
                 if self.keyboard_layout[row][col]['setting'] == "chord":
 
@@ -445,3 +517,6 @@ class GUISurfaceKeyboardMap(GUISurface):
                         tto_globals.key.trigger(key_index,
                                                 keycode,
                                                 mode="stop")
+
+        if self.needs_rendering:
+            self.buttons_publish()
@@ -1,7 +1,18 @@
 from tto_pygame_guisurface import GUISurface
 from tto_shapes import *
+from bisect import bisect_right
+import pygame
 import time
 
+# Terminal filters, selected with F1 onwards.  None shows every message.
+# Pressing the key of the filter already shown goes back to showing all.
+terminal_filters = ((pygame.K_F1, None),
+                    (pygame.K_F2, "EXCEPTION"),
+                    (pygame.K_F3, "CLCK"),
+                    (pygame.K_F4, "MIDI"),
+                    (pygame.K_F5, "KEY_"),
+                    (pygame.K_F6, "INFO"))
+
 
 class GUISurfaceTerminal(GUISurface):
     def __init__(self, canvas_width, canvas_height, blit_x, blit_y, **kwargs):
@@ -12,6 +23,10 @@ class GUISurfaceTerminal(GUISurface):
         # 10 lines of logging shown by default
         self.log_lines = kwargs.get('log_lines', 10)
 
+        # Nobody reads a log faster than this.  A flood of messages costs
+        # at most refresh_hz redraws a second.
+        self.refresh_policy = kwargs.get('refresh_policy', "hz")
+
         # self.time_format for how to display timestamps on-screen
         # https://docs.python.org/3/library/time.html#time.strftime
         self.time_format = "%Y-%m-%d %H:%M:%S %z"
@@ -19,39 +34,130 @@ class GUISurfaceTerminal(GUISurface):
         # To prevent text screen runoff:
         self.log_lines_max_len = 94  # Truncate messages longer than this
 
+        # Only messages with this label are shown, or all if None
+        self.filter = None
+        self.filter_keys = dict(terminal_filters)
+
+        # How many lines back from the newest matching message the bottom
+        # line is.  0 follows new messages as they arrive.
+        self.scroll_offset = 0
+
+        # How many messages matched the filter last update, and the number
+        # of the newest, so the view can hold still while scrolled back
+        self.view_length = 0
+        self.view_last = -1
+
+        # The message dicts on screen, oldest first.  Picked out by
+        # update_control() on the main loop, drawn by draw_control().
+        self.rows = []
+
     def draw_control(self):
         """ Overriding GUISurface.draw_control()
         """
-        self.surface.fill(self.color_bg)
-        self.draw_control_border()
+        self.draw_background()
 
-        log_lines = tto_globals.debugger.messages[-self.log_lines:]
+        rows = self.rows
 
         line_spacing = int(self.canvas_height / self.log_lines)
-        for i in range(self.log_lines):
+        for i in range(len(rows)):
 
             message_string = "{} {}- {}".\
                 format(time.strftime(self.time_format,
-                                     time.localtime(log_lines[i]
-                                                    ['timestamp'])),
-                       log_lines[i]['severity'],
-                       log_lines[i]['message'])
+                                     time.localtime(rows[i]['timestamp'])),
+                       rows[i]['severity'],
+                       rows[i]['message'])
 
             if len(message_string) > self.log_lines_max_len:
                 message_string = "{} ...".format(
                     message_string[:(self.log_lines_max_len - 4)])
 
-            self.draw_label(coordinates=(7, (i * line_spacing) + 5),
-                            degrees=0,
-                            text_label=message_string,
-                            font=self.font,
-                            color=tto_globals.color_orange,
-                            align="left")
+            self.draw_text(coordinates=(self.scaled(7),
+                                        (i * line_spacing) + self.scaled(5)),
+                           text_label=message_string,
+                           font_name=self.font_name,
+                           color=tto_globals.color_orange,
+                           align="left")
+
+        # Say so if this isn't the live, unfiltered view
+        if self.filter or self.scroll_offset:
+            status = "[{}{}]".format(self.filter or "ALL",
+                                     " -{}".format(self.scroll_offset)
+                                     if self.scroll_offset else "")
+            # Measured as drawn, from the atlas advance where there is one
+            status_width, status_height = self.text_size(status,
+                                                         self.font_name)
+            status_x = self.canvas_width - status_width - self.scaled(7)
+            self.surface.fill(self.color_bg,
+                              pygame.Rect(status_x - self.scaled(4),
+                                          self.scaled(5),
+                                          status_width + self.scaled(8),
+                                          status_height))
+            self.draw_text(coordinates=(status_x, self.scaled(5)),
+                           text_label=status,
+                           font_name=self.font_name,
+                           color=tto_globals.color_orange_50,
+                           align="left")
+
+    def handle_keys(self):
+        # PageUp / PageDown scroll a page, Home goes to the oldest message
+        # held and End back to following new ones.  F-keys filter.
+        # Returns True if the view changed.
+        changed = False
+        page = max(1, self.log_lines - 1)
+        for event in tto_globals.events.values():
+            if event['type'] != "KD":
+                continue
+            keycode = event['keycode']
+            if keycode == pygame.K_PAGEUP:
+                self.scroll_offset += page
+            elif keycode == pygame.K_PAGEDOWN:
+                self.scroll_offset = max(0, self.scroll_offset - page)
+            elif keycode == pygame.K_HOME:
+                self.scroll_offset = self.view_length
+            elif keycode == pygame.K_END:
+                self.scroll_offset = 0
+            elif keycode in self.filter_keys:
+                severity = self.filter_keys[keycode]
+                if severity == self.filter:
+                    severity = None
+                self.filter = severity
+                self.scroll_offset = 0
+            else:
+                continue
+            changed = True
+        return changed
 
     def update_control(self):
         """ Overriding GUISurface.update_control()
         """
-        self.needs_rendering = False
-        if tto_globals.debugger.new_messages:
-            self.needs_rendering = True
-            tto_globals.debugger.new_messages = False
+        debugger = tto_globals.debugger
+        changed = self.handle_keys()
+
+        if debugger.new_messages:
+            debugger.new_messages = False
+            changed = True
+
+        if not changed:
+            return
+
+        # Other threads log too.  Hold the debugger still while reading it.
+        with debugger.lock:
+            view = debugger.messages_view(self.filter)
+            view_length = len(view)
+            if self.scroll_offset:
+                # Scrolled back.  Keep the same lines on screen as more
+                # arrive.
+                self.scroll_offset += view_length - \
+                    bisect_right(view, self.view_last)
+            self.view_length = view_length
+            self.view_last = view[-1] if view_length else -1
+            self.scroll_offset = min(self.scroll_offset,
+                                     max(0, view_length - self.log_lines))
+
+            # Only the lines that fit on screen are looked up
+            end = view_length - self.scroll_offset
+            messages = debugger.messages
+            messages_first = debugger.messages_first
+            self.rows = [messages[number - messages_first]
+                         for number in view[max(0, end - self.log_lines):end]]
+        self.needs_rendering = True
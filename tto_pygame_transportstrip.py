@@ -9,6 +9,11 @@ class GUISurfaceTransportStrip(GUISurface):
         super(self.__class__, self).__init__(canvas_width, canvas_height,
                                              blit_x, blit_y, **kwargs)
 
+        # Redraw on each quarter of a beat, as the clock gets there
+        self.refresh_policy = kwargs.get('refresh_policy', "clock")
+        if 'refresh_division' not in kwargs and tto_globals.midi:
+            self.refresh_division = max(1, tto_globals.midi.ppb // 4)
+
         self.downbeat_whole_indicator = False
         self.downbeat_half_indicator = False
         self.downbeat_quarter_indicator = False
@@ -16,8 +21,7 @@ class GUISurfaceTransportStrip(GUISurface):
     def draw_control(self):
         """ Overriding GUISurface.draw_control()
         """
-        self.surface.fill(self.color_bg)
-        self.draw_control_border()
+        self.draw_background()
 
         # Clock Playing Box #
         play_message_string = "clock stopped"
@@ -25,15 +29,15 @@ class GUISurfaceTransportStrip(GUISurface):
         color = tto_globals.color_orange_50
         border = 1
 
-        if tto_globals.midi and tto_globals.midi.transport_playing:
+        if self.state.transport_playing:
             play_message_string = "clock playing"
-            bpm = round(tto_globals.midi.bpm_detected)
+            bpm = round(self.state.bpm_detected)
             color = tto_globals.color_orange
-            border = 2
-        rect_border = pygame.Rect(10, 10, 154, 30)
+            border = max(1, self.scaled(2))
+        rect_border = self.scaled_rect(10, 10, 154, 30)
         pygame.draw.rect(self.surface, color,
                          rect_border, border)
-        self.draw_label(coordinates=(87, 23),
+        self.draw_label(coordinates=(self.scaled(87), self.scaled(23)),
                         degrees=0,
                         text_label=play_message_string,
                         font=self.font,
@@ -42,10 +46,10 @@ class GUISurfaceTransportStrip(GUISurface):
 
         # BPM Box #
         bpm_message_string = "{} BPM".format(bpm)
-        rect_border = pygame.Rect(174, 10, 110, 30)
+        rect_border = self.scaled_rect(174, 10, 110, 30)
         pygame.draw.rect(self.surface, color,
                          rect_border, border)
-        self.draw_label(coordinates=(227, 24),
+        self.draw_label(coordinates=(self.scaled(227), self.scaled(24)),
                         degrees=0,
                         text_label=bpm_message_string,
                         font=self.font,
@@ -54,10 +58,10 @@ class GUISurfaceTransportStrip(GUISurface):
 
         # Beat Monitor #
         beatmon_message_string = "MIDI Clock"
-        rect_border = pygame.Rect(294, 10, 214, 30)
+        rect_border = self.scaled_rect(294, 10, 214, 30)
         pygame.draw.rect(self.surface, color,
                          rect_border, border)
-        self.draw_label(coordinates=(307, 15),
+        self.draw_label(coordinates=(self.scaled(307), self.scaled(15)),
                         degrees=0,
                         text_label=beatmon_message_string,
                         font=self.font,
@@ -71,26 +75,25 @@ class GUISurfaceTransportStrip(GUISurface):
         #    is filled in.  Otherwise border is 1 and the box is outlined.
         border = (not self.downbeat_whole_indicator) * 1
 
-        rect_border = pygame.Rect(420, 10, 30, 30)
+        rect_border = self.scaled_rect(420, 10, 30, 30)
         pygame.draw.rect(self.surface, color,
                          rect_border, border)
 
         border = (not self.downbeat_half_indicator) * 1
 
-        rect_border = pygame.Rect(449, 10, 30, 30)
+        rect_border = self.scaled_rect(449, 10, 30, 30)
         pygame.draw.rect(self.surface, color,
                          rect_border, border)
 
         border = (not self.downbeat_quarter_indicator) * 1
 
-        rect_border = pygame.Rect(478, 10, 30, 30)
+        rect_border = self.scaled_rect(478, 10, 30, 30)
         pygame.draw.rect(self.surface, color,
                          rect_border, border)
 
     def update_control(self):
         """ Overriding GUISurface.update_control()
         """
-        self.needs_rendering = False
         if tto_globals.midi and tto_globals.midi.transport_new_messages:
             self.needs_rendering = True
             tto_globals.midi.transport_new_messages = False
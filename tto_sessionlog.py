@@ -0,0 +1,380 @@
+"""tto_sessionlog - structured binary session log for tto
+
+This module writes every debugger message to an append-only binary log file,
+one file per session, and reads it back afterwards to answer questions like
+"how many clock dropouts were there, and when?".
+
+Records are small and fixed-header, so a log of a whole show stays compact
+and can be scanned quickly.  Message text isn't repeated: a message template
+is written once in a definition record, and each message after that is just
+the template's id and its arguments.  Category names are defined the same
+way.  The file is self-describing, no other table is needed to read it.
+
+File layout
+-----------
+magic  b"TTOLOG\\x00\\x01"
+then records, each a record_header then payload_length bytes of payload:
+    float64 timestamp    time.time()
+    uint8   level        DEBUG, INFO, WARNING, ERROR, CRITICAL
+    uint8   category     Category id, see category definition records
+    uint16  message_id   Template id, or one of the ids below
+    uint16  payload_length
+
+message_id
+    message_literal      Payload is the whole message, UTF-8
+    message_template_def Payload is uint16 template id, then template UTF-8
+    message_category_def Payload is the category name, UTF-8.  The record's
+                         category is the id being defined.
+    anything else        A template instance.  Payload is the arguments,
+                         each a type byte then the value, see args_pack()
+
+Usage
+-----
+python tto_sessionlog.py LOG [--start S] [--end S] [--level L]
+                             [--category C ...] [--count [--by FIELD]]
+
+--start / --end are seconds from the start of the log.  Without --count,
+matching records are printed.  With --count, they're totalled by category,
+level, or message template.
+
+Requirements
+------------
+argparse : Command line parsing for the query tool.
+collections : Counter for aggregates.
+mmap : Scan logs without reading them into memory.
+os : Log file paths.
+struct : Record packing.
+sys : Command line entry point.
+threading : Lock so records from different threads don't interleave.
+time : Timestamps for display.
+
+Classes
+-------
+SessionLogWriter : Buffered append-only session log writer.
+SessionLogReader : mmap'd session log scanner.
+
+Functions
+---------
+args_pack() : Encode template arguments in to a payload.
+args_unpack() : Decode a payload back in to template arguments.
+"""
+
+import argparse
+import collections
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+log_magic = b"TTOLOG\x00\x01"
+
+record_header = struct.Struct('<dBBHH')
+
+message_literal = 0xFFFF
+message_template_def = 0xFFFE
+message_category_def = 0xFFFD
+message_template_max = 0xFFFC  # Template ids are 0 up to here
+
+# Severity levels.  The same numbers as Python's logging module, so they're
+# familiar and leave room in between.
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+CRITICAL = 50
+
+level_names = {DEBUG: "DEBUG",
+               INFO: "INFO",
+               WARNING: "WARNING",
+               ERROR: "ERROR",
+               CRITICAL: "CRITICAL"}
+
+# The debugger labels messages like "MIDI" or "EXCEPTION".  Each label is a
+# category with the level its messages are logged at.
+# [label] = (category id, level)
+label_categories = {"DEBG": (0, DEBUG),
+                    "INFO": (1, INFO),
+                    "EXCEPTION": (2, ERROR),
+                    "EXIT": (3, CRITICAL),
+                    "MIDI": (4, DEBUG),
+                    "KEY_": (5, DEBUG),
+                    "PYGA": (6, DEBUG),
+                    "KEYB": (7, DEBUG),
+                    "FONT": (8, DEBUG),
+                    "CLCK": (9, WARNING)}
+
+# Argument type bytes
+arg_int = b"i"
+arg_float = b"f"
+arg_str = b"s"
+arg_int_struct = struct.Struct('<q')
+arg_float_struct = struct.Struct('<d')
+arg_str_length = struct.Struct('<H')
+
+
+def args_pack(args):
+    """Encode template arguments.  ints and floats are stored as binary
+    values, anything else as its str().
+    """
+    payload = bytearray()
+    for arg in args:
+        if isinstance(arg, int) and not isinstance(arg, bool) and \
+                -(1 << 63) <= arg < (1 << 63):
+            payload += arg_int
+            payload += arg_int_struct.pack(arg)
+        elif isinstance(arg, float):
+            payload += arg_float
+            payload += arg_float_struct.pack(arg)
+        else:
+            text = str(arg).encode("utf-8", "replace")[:0xFFFF]
+            payload += arg_str
+            payload += arg_str_length.pack(len(text))
+            payload += text
+    return bytes(payload)
+
+
+def args_unpack(payload):
+    args = []
+    offset = 0
+    while offset < len(payload):
+        arg_type = payload[offset:offset + 1]
+        offset += 1
+        if arg_type == arg_int:
+            args.append(arg_int_struct.unpack_from(payload, offset)[0])
+            offset += arg_int_struct.size
+        elif arg_type == arg_float:
+            args.append(arg_float_struct.unpack_from(payload, offset)[0])
+            offset += arg_float_struct.size
+        else:
+            length = arg_str_length.unpack_from(payload, offset)[0]
+            offset += arg_str_length.size
+            args.append(bytes(payload[offset:offset + length]).decode(
+                "utf-8", "replace"))
+            offset += length
+    return args
+
+
+class SessionLogWriter(object):
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Buffered, so most records are a memory copy.  Flushed on anything
+        # at ERROR or above, and on close.
+        self.file = open(path, "ab", buffering=1 << 16)
+        if self.file.tell() == 0:
+            self.file.write(log_magic)
+
+        # [template] = template id, and [label] = (category id, level), for
+        # the ones already defined in this file
+        self.templates = {}
+        self.categories = {}
+
+        self.records_written = 0
+
+        # Held while writing a record and any definitions it needs, so
+        # writes from different threads can't interleave
+        self.lock = threading.RLock()
+
+    def category(self, timestamp, label):
+        """(category id, level) for a debugger label, defining the category
+        in the log the first time it's seen.
+        """
+        category = self.categories.get(label)
+        if category is None:
+            category = label_categories.get(label)
+            if category is None:
+                # A label nobody told us about.  Give it a new id.
+                category = (min(max([c[0] for c in
+                                     self.categories.values()] +
+                                    [c[0] for c in
+                                     label_categories.values()]) + 1, 255),
+                            INFO)
+            name = label.encode("utf-8", "replace")[:0xFFFF]
+            self.file.write(record_header.pack(timestamp, category[1],
+                                               category[0],
+                                               message_category_def,
+                                               len(name)))
+            self.file.write(name)
+            self.categories[label] = category
+        return category
+
+    def write_literal(self, timestamp, label, message, level=None):
+        with self.lock:
+            category_id, category_level = self.category(timestamp, label)
+            if level is None:
+                level = category_level
+            payload = str(message).encode("utf-8", "replace")[:0xFFFF]
+            self.file.write(record_header.pack(timestamp, level, category_id,
+                                               message_literal, len(payload)))
+            self.file.write(payload)
+            self.records_written += 1
+            if level >= ERROR:
+                self.file.flush()
+
+    def write_template(self, timestamp, label, template, args, level=None):
+        with self.lock:
+            category_id, category_level = self.category(timestamp, label)
+            if level is None:
+                level = category_level
+            template_id = self.templates.get(template)
+            if template_id is None:
+                template_id = len(self.templates)
+                if template_id > message_template_max:
+                    # Out of ids.  Not going to happen, but stay correct.
+                    self.write_literal(timestamp, label,
+                                       template.format(*args), level)
+                    return
+                definition = struct.pack('<H', template_id) + \
+                    template.encode("utf-8", "replace")[:0xFFFD]
+                self.file.write(record_header.pack(timestamp, level,
+                                                   category_id,
+                                                   message_template_def,
+                                                   len(definition)))
+                self.file.write(definition)
+                self.templates[template] = template_id
+            payload = args_pack(args)[:0xFFFF]
+            self.file.write(record_header.pack(timestamp, level, category_id,
+                                               template_id, len(payload)))
+            self.file.write(payload)
+            self.records_written += 1
+            if level >= ERROR:
+                self.file.flush()
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class SessionLogReader(object):
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(log_magic)] != log_magic:
+            raise ValueError("{} is not a tto session log".format(path))
+
+        # Filled in from definition records while scanning
+        self.templates = {}
+        self.categories = {}
+
+    def records(self):
+        """Yield (timestamp, level, category id, message id, payload) for
+        every message record, in order.  Definition records are read in to
+        self.templates and self.categories on the way past.
+        """
+        log = self.map
+        offset = len(log_magic)
+        end = len(log)
+        unpack_from = record_header.unpack_from
+        header_size = record_header.size
+        while offset + header_size <= end:
+            timestamp, level, category, message_id, length = \
+                unpack_from(log, offset)
+            offset += header_size
+            if offset + length > end:
+                # Cut short, e.g. tto was killed mid-write
+                break
+            payload = log[offset:offset + length]
+            offset += length
+            if message_id == message_category_def:
+                self.categories[category] = payload.decode("utf-8", "replace")
+            elif message_id == message_template_def:
+                template_id = struct.unpack_from('<H', payload)[0]
+                self.templates[template_id] = payload[2:].decode(
+                    "utf-8", "replace")
+            else:
+                yield timestamp, level, category, message_id, payload
+
+    def message_text(self, message_id, payload):
+        if message_id == message_literal:
+            return payload.decode("utf-8", "replace")
+        template = self.templates.get(message_id, "<template {}>".format(
+            message_id))
+        args = args_unpack(payload)
+        try:
+            return template.format(*args)
+        except (IndexError, KeyError, ValueError):
+            return "{} {}".format(template, args)
+
+    def start_time(self):
+        for record in self.records():
+            return record[0]
+        return 0
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def log_query(arguments):
+    reader = SessionLogReader(arguments.log)
+    start_time = reader.start_time()
+    level_min = 0
+    if arguments.level:
+        level_min = {name: level for level, name in level_names.items()}[
+            arguments.level.upper()]
+    categories = set(arguments.category or [])
+
+    counts = collections.Counter()
+    for timestamp, level, category, message_id, payload in reader.records():
+        offset = timestamp - start_time
+        if arguments.start is not None and offset < arguments.start:
+            continue
+        if arguments.end is not None and offset > arguments.end:
+            continue
+        if level < level_min:
+            continue
+        category_name = reader.categories.get(category, str(category))
+        if categories and category_name not in categories:
+            continue
+
+        if arguments.count:
+            if arguments.by == "category":
+                counts[category_name] += 1
+            elif arguments.by == "level":
+                counts[level_names.get(level, str(level))] += 1
+            else:
+                counts[reader.templates.get(message_id, "(literal)")
+                       if message_id != message_literal
+                       else "(literal)"] += 1
+        else:
+            print("{} {:10.3f} {:<8} {:<9} {}".format(
+                time.strftime("%H:%M:%S", time.localtime(timestamp)),
+                offset,
+                level_names.get(level, level),
+                category_name,
+                reader.message_text(message_id, payload)))
+
+    if arguments.count:
+        for name, count in counts.most_common():
+            print("{:8d} {}".format(count, name))
+        print("{:8d} total".format(sum(counts.values())))
+    reader.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a tto session log")
+    parser.add_argument("log", help="Session log file")
+    parser.add_argument("--start", type=float,
+                        help="Seconds from the start of the log")
+    parser.add_argument("--end", type=float,
+                        help="Seconds from the start of the log")
+    parser.add_argument("--level", choices=sorted(
+        name.lower() for name in level_names.values()),
+        help="Minimum severity")
+    parser.add_argument("--category", action="append",
+                        help="Only this category, e.g. MIDI.  Repeatable")
+    parser.add_argument("--count", action="store_true",
+                        help="Count matching records instead of listing them")
+    parser.add_argument("--by", choices=("category", "level", "message"),
+                        default="category",
+                        help="What --count totals by")
+    log_query(parser.parse_args())
+    sys.exit(0)
@@ -1,6 +1,15 @@
 import math
 import tto_globals
 
+# NumPy is optional.  With it, WheelGeometry works out a whole wheel in one
+# batch with find_coordinates_numpy().  Without it, find_coordinates_math()
+# does it with math, one point at a time, and returns nested lists in the
+# same layout.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Shape(object):
     def __init__(self, **kwargs):
@@ -26,7 +35,8 @@ class Shape(object):
         self.origin_x = int(self.canvas_size / 2) + tto_globals.canvas_margin
         # Center of the canvas Y
         self.origin_y = int(self.canvas_size / 2) + tto_globals.canvas_margin
-        self.circle_divisions = 12  # 12-slices around the circle
+        # 12-slices around the circle by default
+        self.circle_divisions = kwargs.get('circle_divisions', 12)
         # slice_no for specifying a pizza-like division of a circle
         self.slice_no = kwargs.get('slice_no', 1)
         # offset_orientation is a number of degrees added to everything
@@ -74,7 +84,7 @@ class ShapeNotesList(Shape):
 
 class ShapeWheel(Shape):
     def find_coordinates(self):
-        for i in range(12):
+        for i in range(self.circle_divisions):
             self.coordinates.append(
                 # One corner of the triangle along the circle radius r,
                 # at sliceNo*1/12circle
@@ -211,3 +221,85 @@ class ShapeWheelRay(Shape):
             int(-((360 / self.circle_divisions) * self.slice_no))
             - self.offset_degrees
         )
+
+
+class WheelGeometry(object):
+    def __init__(self, canvas_size, radii, circle_divisions=12,
+                 offset_degrees=0):
+        """Every ring, slice and ray coordinate of a wheel with
+        circle_divisions divisions, at each radius in radii, worked out at
+        once.  The same points ShapeWheel, ShapeWheelSlice and ShapeWheelRay
+        give, for any number of divisions.
+
+        With NumPy these are contiguous int32 arrays:
+            ring[r][n] : (x, y) of point n on the circle of radius radii[r]
+            slices[r][n] : slice n as 3 (x, y) points, origin first
+            rays[r][n] : ray n as 2 (x, y) points, origin first
+            degrees[n] : label rotation at point n
+        any of which can go straight to pygame.draw.polygon() etc.
+        Without NumPy they're nested lists of the same shape.
+        """
+        self.canvas_size = canvas_size
+        self.radii = list(radii)
+        self.circle_divisions = circle_divisions
+        self.offset_degrees = offset_degrees
+
+        # Same coordinate system as Shape
+        self.origin_x = int(canvas_size / 2) + tto_globals.canvas_margin
+        self.origin_y = int(canvas_size / 2) + tto_globals.canvas_margin
+        self.offset_orientation = 90
+
+        if numpy is not None:
+            self.find_coordinates_numpy()
+        else:
+            self.find_coordinates_math()
+
+    def find_coordinates_numpy(self):
+        division = 360 / self.circle_divisions
+        steps = numpy.arange(self.circle_divisions + 1)
+        angles = numpy.radians((division * steps) + self.offset_degrees +
+                               self.offset_orientation)
+        radii = numpy.asarray(self.radii, dtype=numpy.float64)[:, None]
+
+        # Truncate toward zero like int() does in Shape, so the points are
+        # identical.  One extra point closes the circle for the slices.
+        points = numpy.empty((len(self.radii), self.circle_divisions + 1, 2),
+                             dtype=numpy.int32)
+        points[:, :, 0] = self.origin_x - \
+            numpy.trunc(radii * numpy.cos(angles))
+        points[:, :, 1] = self.origin_y - \
+            numpy.trunc(radii * numpy.sin(angles))
+
+        self.ring = numpy.ascontiguousarray(points[:, :-1])
+
+        self.slices = numpy.empty((len(self.radii), self.circle_divisions,
+                                   3, 2), dtype=numpy.int32)
+        self.slices[:, :, 0] = (self.origin_x, self.origin_y)
+        self.slices[:, :, 1] = points[:, :-1]
+        self.slices[:, :, 2] = points[:, 1:]
+
+        self.rays = numpy.ascontiguousarray(self.slices[:, :, :2])
+
+        self.degrees = (-(division * steps[:-1])).astype(numpy.int32) - \
+            self.offset_degrees
+
+    def find_coordinates_math(self):
+        division = 360 / self.circle_divisions
+        origin = (self.origin_x, self.origin_y)
+        self.ring = []
+        self.slices = []
+        self.rays = []
+        for r in self.radii:
+            points = []
+            for i in range(self.circle_divisions + 1):
+                angle = math.radians((division * i) + self.offset_degrees +
+                                     self.offset_orientation)
+                points.append((self.origin_x - int(r * math.cos(angle)),
+                               self.origin_y - int(r * math.sin(angle))))
+            self.ring.append(points[:-1])
+            self.slices.append([(origin, points[i], points[i + 1])
+                                for i in range(self.circle_divisions)])
+            self.rays.append([(origin, points[i])
+                              for i in range(self.circle_divisions)])
+        self.degrees = [int(-(division * i)) - self.offset_degrees
+                        for i in range(self.circle_divisions)]
@@ -0,0 +1,181 @@
+"""tto_sharedstate - shared-memory musical state block for tto
+
+This module publishes tto's live musical state into a small fixed-layout
+shared memory region, so that any number of local processes (a second
+display, a lighting controller, a monitor) can follow along without being
+loaded into tto itself.
+
+The region is guarded by a seqlock.  The writer bumps the sequence number to
+an odd value, writes the fields, then bumps it to the next even value.  A
+reader notes the sequence number, unpacks the fields straight out of the
+shared buffer, and checks the sequence number again.  If it changed or was
+odd, a write overlapped the read and the reader simply retries.  Readers
+never block the writer and never take a lock.  A write takes microseconds,
+so a reader that's still seeing one after read_retries tries gives up with
+TimeoutError: the writer died mid-write.
+
+Layout (little-endian, 40 bytes)
+--------------------------------
+offset  0  uint32   seq           Seqlock sequence number, odd while writing
+offset  4  uint16   version       Layout version, state_layout_version
+offset  8  uint8    current_key   Key.current_key 0-11
+offset  9  uint8    scale_degree  Key.current_scale_degree 0-6
+offset 10  uint16   notes_on      Key.notes_on_mask, bit n is key.notes n
+offset 12  uint8    transport     1 if TtoMidi.transport_playing
+offset 16  uint32   clock_pulses  TtoMidi.clock_pulses
+offset 24  float64  bpm           TtoMidi.bpm_detected
+offset 32  float64  timestamp     time.time() of the last write
+
+Usage
+-----
+python tto_sharedstate.py [name]  # Print state changes as they happen
+
+Requirements
+------------
+multiprocessing.shared_memory : The shared memory region (Python 3.8+).
+os : Shared memory name handling.
+struct : Fixed-layout field packing.
+sys : Command line arguments.
+time : Write timestamps.
+
+Classes
+-------
+SharedStateWriter : Owns the region and publishes snapshots into it.
+SharedStateReader : Attaches to the region and reads consistent snapshots.
+"""
+
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+import os
+import struct
+import sys
+import time
+
+state_layout_version = 1
+
+# Everything after the sequence number
+state_fields = struct.Struct('<HxxBBHBxxxIxxxxdd')
+state_fields_offset = 4
+state_size = state_fields_offset + state_fields.size
+
+# How many times a reader tries to get a consistent read before giving up
+read_retries = 100000
+
+
+class SharedStateWriter(object):
+    def __init__(self, name):
+        self.name = name
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=state_size)
+        except FileExistsError:
+            # Left over from a previous run that didn't exit cleanly
+            self.shm = shared_memory.SharedMemory(name=name)
+        # The sequence number as a 32-bit array element, so that each
+        # update is one aligned store
+        self.seq_view = self.shm.buf[0:4].cast('I')
+        self.seq = self.seq_view[0] & ~1
+        self.write(0, 0, 0, False, 0, 0)
+
+    def write(self, current_key, scale_degree, notes_on, transport_playing,
+              clock_pulses, bpm):
+        self.seq_view[0] = self.seq + 1  # Odd: write in progress
+        state_fields.pack_into(self.shm.buf, state_fields_offset,
+                               state_layout_version,
+                               current_key,
+                               scale_degree,
+                               notes_on,
+                               int(transport_playing),
+                               clock_pulses,
+                               float(bpm),
+                               time.time())
+        self.seq = (self.seq + 2) & 0xFFFFFFFF
+        self.seq_view[0] = self.seq  # Even: consistent
+
+    def write_snapshot(self, snapshot):
+        """Publish a tto_snapshot.StateSnapshot."""
+        self.write(snapshot.current_key,
+                   snapshot.current_scale_degree,
+                   snapshot.notes_on,
+                   snapshot.transport_playing,
+                   snapshot.clock_pulses,
+                   snapshot.bpm_detected)
+
+    def close(self):
+        self.seq_view.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedStateReader(object):
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Readers don't own the region.  Without this, Python's resource
+        # tracker would unlink it out from under tto when the reader exits.
+        # The tracker knows it by its POSIX name, with the leading slash
+        # that SharedMemory.name leaves off.
+        tracked_name = self.shm.name
+        if os.name == "posix":
+            tracked_name = "/" + tracked_name
+        resource_tracker.unregister(tracked_name, 'shared_memory')
+        self.seq_view = self.shm.buf[0:4].cast('I')
+
+    def read(self):
+        """Return a consistent snapshot as a dict, retrying around any
+        concurrent write.  Also returns the sequence number as 'seq', which
+        readers can compare to skip unchanged states.  Raises TimeoutError
+        if there's a write in progress for read_retries tries in a row.
+        """
+        buf = self.shm.buf
+        seq_view = self.seq_view
+        for retry in range(read_retries):
+            seq = seq_view[0]
+            if seq & 1:
+                continue
+            fields = state_fields.unpack_from(buf, state_fields_offset)
+            if seq_view[0] == seq:
+                break
+        else:
+            raise TimeoutError("Shared state write never finished, seq {}".
+                               format(seq_view[0]))
+        if fields[0] != state_layout_version:
+            raise ValueError("Shared state layout version {}, expected {}".
+                             format(fields[0], state_layout_version))
+        return {'seq': seq,
+                'current_key': fields[1],
+                'scale_degree': fields[2],
+                'notes_on': fields[3],
+                'transport_playing': bool(fields[4]),
+                'clock_pulses': fields[5],
+                'bpm': fields[6],
+                'timestamp': fields[7]}
+
+    def seq(self):
+        """The current sequence number.  Cheap enough to poll."""
+        return self.seq_view[0]
+
+    def close(self):
+        self.seq_view.release()
+        self.shm.close()
+
+
+if __name__ == "__main__":
+    reader = SharedStateReader(sys.argv[1] if len(sys.argv) > 1
+                               else "tto_state")
+    last_seq = None
+    try:
+        while True:
+            if reader.seq() != last_seq:
+                try:
+                    state = reader.read()
+                except TimeoutError as e:
+                    print(e)
+                    time.sleep(1)
+                    continue
+                last_seq = state['seq']
+                print("key {current_key:2d} degree {scale_degree} "
+                      "notes {notes_on:012b} playing {transport_playing:d} "
+                      "pulse {clock_pulses:2d} bpm {bpm:6.1f}".format(**state))
+            time.sleep(0.001)
+    except KeyboardInterrupt:
+        reader.close()
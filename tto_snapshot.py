@@ -0,0 +1,86 @@
+"""tto_snapshot - immutable musical state snapshots for tto
+
+The logic loop owns tto_globals.key and tto_globals.midi and mutates them
+constantly.  Anything that only needs to look at that state, like the
+renderer, reads a StateSnapshot instead.  A new snapshot is published by
+replacing tto_globals.snapshot, which is a single atomic reference
+assignment, so readers on other threads never see a half-updated state and
+the logic loop never waits on them.
+
+publish() runs every main loop, but Key and TtoMidi each count changes to the
+state copied here in state_changes, so it only builds a snapshot when one of
+those counts has moved, e.g. on a key press or a clock pulse.
+
+GUISurfaces keep their other per-frame data the same way.  update_control()
+on the main loop builds it and replaces it whole, like the terminal's rows
+of message dicts, which are never changed once logged, and the keyboard
+map's buttons tuple.  draw_control() only reads those.
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+collections : namedtuple for the immutable snapshot type.
+
+Classes
+-------
+StateSnapshot : Immutable copy of the Key and TtoMidi transport state.
+
+Functions
+---------
+capture() : Build a StateSnapshot from the live Key and TtoMidi objects.
+publish() : Capture and publish a new tto_globals.snapshot if the state has
+            changed, and mirror it to the shared memory state block when
+            that is enabled.
+"""
+
+import tto_globals
+import collections
+
+StateSnapshot = collections.namedtuple(
+    'StateSnapshot',
+    ['current_key',  # Key.current_key 0-11
+     'current_scale_degree',  # Key.current_scale_degree 0-6
+     'notes_on',  # Key.notes_on_mask, 12 bit mask of key.notes 0-11
+     'transport_playing',  # TtoMidi.transport_playing
+     'bpm_detected',  # TtoMidi.bpm_detected
+     'clock_pulses',  # TtoMidi.clock_pulses
+     'downbeat_whole',  # TtoMidi.downbeat_whole
+     'downbeat_half',  # TtoMidi.downbeat_half
+     'downbeat_quarter'])  # TtoMidi.downbeat_quarter
+
+
+def capture():
+    key = tto_globals.key
+    midi = tto_globals.midi
+    if midi:
+        return StateSnapshot(key.current_key,
+                             key.current_scale_degree,
+                             key.notes_on_mask,
+                             midi.transport_playing,
+                             midi.bpm_detected,
+                             midi.clock_pulses,
+                             midi.downbeat_whole,
+                             midi.downbeat_half,
+                             midi.downbeat_quarter)
+    return StateSnapshot(key.current_key,
+                         key.current_scale_degree,
+                         key.notes_on_mask,
+                         False, 0, 0, False, False, False)
+
+
+# The Key and TtoMidi state_changes the current snapshot was captured at
+published_changes = None
+
+
+def publish():
+    global published_changes
+    midi = tto_globals.midi
+    changes = (tto_globals.key.state_changes,
+               midi.state_changes if midi else -1)
+    if changes == published_changes:
+        return
+    published_changes = changes
+    snapshot = capture()
+    if tto_globals.shared_state and snapshot != tto_globals.snapshot:
+        tto_globals.shared_state.write_snapshot(snapshot)
+    tto_globals.snapshot = snapshot
@@ -0,0 +1,196 @@
+"""tto_trace - timeline tracing for tto
+
+Records begin / end spans for main loop phases, frames, each GUISurface's
+draw_control(), display.update(), and MIDI messages received, relayed and
+sent, and writes them out as a Chrome trace event JSON file.  Open it in
+chrome://tracing or https://ui.perfetto.dev to look at a single bad frame or
+stall on a timeline, which aggregate counters can't explain.
+
+Tracing is opt-in, with TraceEnabled.  When it's off, tto_globals.tracer is
+None and every call site is skipped.  When it's on, spans go in to a ring of
+preallocated arrays, so recording one is a few array stores and never
+allocates.  Once the ring is full the oldest spans are overwritten, so the
+trace always holds the last TraceSpans spans.
+
+Main loop phases mostly take a microsecond or two while the loop idles.
+Phase spans shorter than TraceMinUs aren't kept, so the ring isn't filled
+with those.
+
+A trace is written on exit, and whenever F12 is pressed, to a new
+tto_trace_<date>_<time>_<milliseconds>.json in TraceDir.
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+array : Preallocated span storage.
+json : Trace event output.
+os : Trace file paths.
+threading : Thread ids and names, background writes.
+time : perf_counter() for timestamps, and file names.
+
+Classes
+-------
+TtoTracer : Span ring buffer and Chrome trace writer.
+"""
+
+import tto_globals
+from array import array
+import json
+import os
+import threading
+import time
+
+# Span names used on hot paths, interned up front.  The rest, like each
+# GUISurface's draw and each type of MIDI message received, are interned by
+# name_id() once, when the surface is made or the type first arrives, and
+# the caller keeps the id.
+span_names = ("loop_pygame",
+              "loop_midi",
+              "loop_snapshot",
+              "frame",
+              "display_update",
+              "midi_relay",
+              "midi_send",
+              "midi_clock_out")
+
+span_loop_pygame = 0
+span_loop_midi = 1
+span_loop_snapshot = 2
+span_frame = 3
+span_display_update = 4
+span_midi_relay = 5
+span_midi_send = 6
+span_midi_clock_out = 7
+
+
+class TtoTracer(object):
+    def __init__(self, spans=65536, min_duration=0.00002, trace_dir=""):
+        self.spans_size = max(1, spans)
+        self.min_duration = min_duration
+        self.trace_dir = trace_dir
+
+        # The ring.  Span n is at index n % spans_size.
+        self.span_begin = array('d', [0]) * self.spans_size
+        self.span_end = array('d', [0]) * self.spans_size
+        self.span_name = array('H', [0]) * self.spans_size
+        self.span_arg = array('i', [0]) * self.spans_size
+        self.span_thread = array('Q', [0]) * self.spans_size
+        self.spans_total = 0
+
+        # [name] = name id, and the reverse
+        self.names = list(span_names)
+        self.name_ids = {name: i for i, name in enumerate(self.names)}
+
+        self.clock = time.perf_counter
+        self.time_started = self.clock()
+
+        # The last trace file name used, so two writes in the same
+        # millisecond don't overwrite one another
+        self.file_name_last = None
+        self.file_name_repeats = 0
+
+        tto_globals.debugger.message("INFO",
+                                     "Tracing the last {} spans".format(
+                                         self.spans_size))
+
+    def name_id(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def span(self, name_id, begin, arg=-1):
+        """Record a span from begin, a self.clock() time, to now."""
+        end = self.clock()
+        # Not locked.  If the render thread and the main loop record at the
+        # same moment, one span may be lost, which a trace can live with.
+        i = self.spans_total % self.spans_size
+        self.spans_total += 1
+        self.span_begin[i] = begin
+        self.span_end[i] = end
+        self.span_name[i] = name_id
+        self.span_arg[i] = arg
+        self.span_thread[i] = threading.get_ident()
+
+    def phase(self, name_id, begin):
+        """Record a main loop phase span from begin to now, if it took
+        longer than min_duration.
+        """
+        if self.clock() - begin >= self.min_duration:
+            self.span(name_id, begin)
+
+    def spans_copy(self):
+        """The ring's arrays, copied and rotated oldest span first.  Array
+        slices, so quick enough to take on the main loop.
+        """
+        count = min(self.spans_total, self.spans_size)
+        first = (self.spans_total - count) % self.spans_size
+        return [(ring[first:] + ring[:first])[:count]
+                for ring in (self.span_begin, self.span_end, self.span_name,
+                             self.span_arg, self.span_thread)]
+
+    def trace_events(self, spans, names):
+        thread_names = {thread.ident: thread.name
+                        for thread in threading.enumerate()}
+        thread_ids = {}
+        events = []
+        for begin, end, name_id, arg, thread in zip(*spans):
+            if thread not in thread_ids:
+                thread_ids[thread] = len(thread_ids) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": 1,
+                               "tid": thread_ids[thread],
+                               "args": {"name": thread_names.get(
+                                   thread, str(thread))}})
+            event = {"name": names[name_id], "ph": "X", "pid": 1,
+                     "tid": thread_ids[thread],
+                     "ts": round((begin - self.time_started) * 1000000, 3),
+                     "dur": round((end - begin) * 1000000, 3)}
+            if arg >= 0:
+                event["args"] = {"arg": arg}
+            events.append(event)
+        return events
+
+    def write(self, background=False):
+        """Write the spans recorded so far to a new trace file.  If
+        background, everything after copying the ring happens on its own
+        thread, so the main loop carries on recording meanwhile.
+        """
+        now = time.time()
+        file_name = "{}_{:03d}".format(
+            time.strftime("tto_trace_%Y%m%d_%H%M%S", time.localtime(now)),
+            int(now * 1000) % 1000)
+        if file_name == self.file_name_last:
+            self.file_name_repeats += 1
+        else:
+            self.file_name_last = file_name
+            self.file_name_repeats = 0
+        if self.file_name_repeats:
+            file_name += "_{}".format(self.file_name_repeats)
+        path = os.path.join(os.path.expanduser(self.trace_dir or "."),
+                            file_name + ".json")
+        spans = self.spans_copy()
+        names = list(self.names)
+        if background:
+            threading.Thread(target=self.write_spans,
+                             args=(path, spans, names),
+                             name="tto trace writer", daemon=True).start()
+        else:
+            self.write_spans(path, spans, names)
+
+    def write_spans(self, path, spans, names):
+        events = self.trace_events(spans, names)
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "w") as trace_file:
+                json.dump({"traceEvents": events,
+                           "displayTimeUnit": "ms"}, trace_file)
+            tto_globals.debugger.message("INFO",
+                                         "Wrote {} trace events to {}".format(
+                                             len(events), path))
+        except OSError as e:
+            tto_globals.debugger.message("EXCEPTION",
+                                         "Writing trace {}: {}".format(
+                                             path, e))
@@ -0,0 +1,330 @@
+"""tto_virtualmidi - in-process virtual MIDI backend for tto
+
+With MidiBackend = virtual, TtoMidi.port_open() opens these stand-ins
+instead of real ports, so tto can be run, load tested and soak tested with
+no MIDI hardware.
+
+VirtualInput makes its own traffic, per MidiVirtualTraffic, from any mix of
+generators:
+
+clock=BPM : MIDI clock at BPM, after a start message.
+notes=N : N note messages a second, note_on / note_off pairs.
+cc=N : N control change messages a second, e.g. cc=20000 for a storm.
+jitter=MS : Each message arrives up to MS milliseconds late, at random.
+
+Generators run on a fixed schedule from when the port opens, and messages
+are made lazily whenever tto polls the port, so there's no extra thread.
+Like a real port, the input only buffers so much.  Messages that would
+overflow it are dropped and counted as overruns.
+
+Each generated message is stamped with the time it was due in its mido
+time attribute.  mido keeps that through the copy TtoMidi relays to MIDI
+Out, so VirtualOutput can measure every message's loopback latency, from
+due on MIDI In to sent on MIDI Out, in to a histogram.  Messages tto makes
+itself have a time of 0 and are only counted.
+
+Usage
+-----
+python tto_virtualmidi.py [--seconds S] [--traffic SPEC] [--report-every S]
+                          [--fail-over MS]
+
+Runs tto against the virtual backend for S seconds, reporting throughput
+and loopback latency every --report-every seconds and at the end.  With
+--fail-over, exits 1 if the loopback p99 is over MS milliseconds.
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+argparse : Command line parsing for the soak test.
+array : Latency histogram.
+atexit : Take tto's own exit handler out of the way in the soak test.
+collections : deque for the input buffer.
+os : Select SDL's dummy video driver for the soak test.
+random : Jitter.
+sys : Exit status.
+threading : Soak test timer.
+time : perf_counter() timestamps.
+mido : Port base classes and messages.
+
+Classes
+-------
+TrafficGenerator : Fixed rate stream of one kind of MIDI message.
+VirtualInput : MIDI In stand-in fed by traffic generators.
+VirtualOutput : MIDI Out stand-in measuring loopback latency.
+
+Functions
+---------
+parse_traffic() : Parse the MidiVirtualTraffic config setting.
+"""
+
+import tto_globals
+import argparse
+import atexit
+import collections
+import os
+import random
+import sys
+import threading
+import time
+from array import array
+
+import mido
+
+# Loopback latency histogram.  10 microsecond buckets up to 100 ms, and a
+# count of anything slower.
+latency_bucket = 0.00001
+latency_buckets = 10000
+
+# Messages a VirtualInput holds before it starts dropping them
+input_buffer_size = 4096
+
+traffic_generators = ("clock", "notes", "cc", "jitter")
+
+
+def parse_traffic(traffic_config):
+    """Parse a MidiVirtualTraffic setting like "clock=120, cc=20000,
+    jitter=2" in to {"clock": 120.0, "cc": 20000.0, "jitter": 2.0}.
+    """
+    traffic = {}
+    for setting in traffic_config.strip('"').split(","):
+        setting = setting.strip()
+        if not setting:
+            continue
+        if "=" not in setting:
+            raise ValueError("'{}' should be name=value".format(setting))
+        name, value = setting.split("=", 1)
+        name = name.strip().lower()
+        if name not in traffic_generators:
+            raise ValueError("Unknown traffic '{}', expected one of {}".
+                             format(name, ", ".join(traffic_generators)))
+        traffic[name] = float(value)
+        if traffic[name] < 0:
+            raise ValueError("{} can't be negative".format(name))
+    return traffic
+
+
+class TrafficGenerator(object):
+    def __init__(self, rate, messages, jitter=0.0, start=None):
+        # rate messages a second, taken in turn from messages, a list of
+        # mido messages.  Each is up to jitter seconds late.
+        self.interval = 1 / rate
+        self.messages = messages
+        self.jitter = jitter
+        self.sent = 0
+
+        # When the next message is due, before jitter, and after it
+        if start is None:
+            start = time.perf_counter()
+        self.start = start
+        self.due = start
+        self.arrives = self.due + (random.random() * jitter)
+
+    def generate(self, now, queue):
+        """Append every message that's arrived by now to queue, each
+        stamped with when it was due.  Returns how many.
+        """
+        count = 0
+        while now >= self.arrives:
+            queue.append(self.messages[self.sent % len(self.messages)].copy(
+                time=self.due))
+            self.sent += 1
+            count += 1
+            # Scheduled from the start, so the rate doesn't drift
+            self.due = self.start + (self.sent * self.interval)
+            self.arrives = self.due + (random.random() * self.jitter)
+        return count
+
+
+class VirtualInput(mido.ports.BaseInput):
+    def __init__(self, name, traffic=None):
+        super(VirtualInput, self).__init__(name=name)
+        traffic = traffic or {}
+        jitter = traffic.get("jitter", 0) / 1000
+        start = time.perf_counter()
+        self.generators = []
+
+        # Messages ready for tto to read.  Replaces the parser's queue that
+        # BaseInput.receive() reads from.
+        self._messages = collections.deque()
+
+        if traffic.get("clock"):
+            self._messages.append(mido.Message("start", time=start))
+            self.generators.append(TrafficGenerator(
+                traffic["clock"] * 24 / 60, [mido.Message("clock")],
+                jitter, start))
+        if traffic.get("notes"):
+            notes = []
+            for note in (60, 64, 67, 72, 67, 64):
+                notes.append(mido.Message("note_on", note=note,
+                                          velocity=100))
+                notes.append(mido.Message("note_off", note=note))
+            self.generators.append(TrafficGenerator(traffic["notes"], notes,
+                                                    jitter, start))
+        if traffic.get("cc"):
+            self.generators.append(TrafficGenerator(
+                traffic["cc"],
+                [mido.Message("control_change", control=1, value=value)
+                 for value in range(128)],
+                jitter, start))
+
+        self.messages_generated = 0
+        self.overruns = 0
+
+    def _receive(self, block=True):
+        now = time.perf_counter()
+        for generator in self.generators:
+            self.messages_generated += generator.generate(now,
+                                                          self._messages)
+        overrun = len(self._messages) - input_buffer_size
+        if overrun > 0:
+            # Full.  Lose the newest, like a real port's buffer would.
+            for i in range(overrun):
+                self._messages.pop()
+            self.overruns += overrun
+        return None
+
+
+class VirtualOutput(mido.ports.BaseOutput):
+    def __init__(self, name):
+        super(VirtualOutput, self).__init__(name=name)
+
+    def _open(self, **kwargs):
+        self.messages_sent = 0
+        self.messages_looped = 0
+        self.latency_histogram = array('Q', [0]) * latency_buckets
+        self.latency_over = 0
+        self.latency_max = 0.0
+        self.latency_total = 0.0
+
+    def _send(self, midi_msg):
+        self.messages_sent += 1
+        if midi_msg.time:
+            # Came from a VirtualInput
+            latency = time.perf_counter() - midi_msg.time
+            self.messages_looped += 1
+            self.latency_total += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+            bucket = int(latency / latency_bucket)
+            if bucket < latency_buckets:
+                self.latency_histogram[max(0, bucket)] += 1
+            else:
+                self.latency_over += 1
+
+    def latency_percentile(self, percentile):
+        """Loopback latency in seconds that percentile % of messages were
+        at or under, to the bucket.
+        """
+        target = self.messages_looped * percentile / 100
+        count = 0
+        for bucket in range(latency_buckets):
+            count += self.latency_histogram[bucket]
+            if count >= target:
+                return (bucket + 1) * latency_bucket
+        return self.latency_max
+
+    def latency_report(self):
+        if not self.messages_looped:
+            return "no messages looped back"
+        return "latency mean {:.3f} p50 {:.3f} p90 {:.3f} p99 {:.3f} " \
+               "p99.9 {:.3f} max {:.3f} ms".format(
+                   self.latency_total / self.messages_looped * 1000,
+                   self.latency_percentile(50) * 1000,
+                   self.latency_percentile(90) * 1000,
+                   self.latency_percentile(99) * 1000,
+                   self.latency_percentile(99.9) * 1000,
+                   self.latency_max * 1000)
+
+
+def soak_report(started):
+    port_in = tto_globals.midi.ports.get("MidiInPort")
+    port_out = tto_globals.midi.ports.get("MidiOutPort")
+    seconds = time.perf_counter() - started
+    print("{:8.1f} s  in {} ({:.0f}/s)  out {} ({:.0f}/s)  overruns {}  "
+          "clock dropouts {}  bpm {:.2f}".format(
+              seconds,
+              port_in.messages_generated,
+              port_in.messages_generated / seconds,
+              port_out.messages_sent,
+              port_out.messages_sent / seconds,
+              port_in.overruns,
+              tto_globals.midi.clock_dropouts,
+              tto_globals.midi.bpm_detected))
+    print("           " + port_out.latency_report())
+    if tto_globals.midi.out_scheduler:
+        print("           MIDI Out scheduler {}".format(
+            tto_globals.midi.out_scheduler.stats()))
+    if tto_globals.governor:
+        print("           load shedding {}".format(
+            tto_globals.governor.stats()))
+    sys.stdout.flush()
+
+
+def soak_timer(seconds, report_every, started):
+    # Report now and then, and end the run after seconds
+    end = started + seconds
+    report_next = started + report_every
+    while tto_globals.running:
+        now = time.perf_counter()
+        if now >= end:
+            break
+        if report_every and now >= report_next:
+            report_next += report_every
+            soak_report(started)
+        time.sleep(min(0.1, end - now))
+    tto_globals.running = False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="tto soak and throughput test on virtual MIDI")
+    parser.add_argument("--seconds", type=float, default=10,
+                        help="How long to run")
+    parser.add_argument("--traffic", default="clock=120, notes=20, cc=1000",
+                        help="MidiVirtualTraffic for MIDI In")
+    parser.add_argument("--report-every", type=float, default=0,
+                        help="Report every this many seconds as well")
+    parser.add_argument("--fail-over", type=float,
+                        help="Exit 1 if loopback p99 is over this many ms")
+    arguments = parser.parse_args()
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import tto
+
+    tto_globals.debugger.printEnabled = False
+    tto_globals.config['tto']['FullScreen'] = 'False'
+    tto_globals.config['tto']['MidiBackend'] = 'virtual'
+    tto_globals.config['tto']['MidiInEnabled'] = 'True'
+    tto_globals.config['tto']['MidiOutEnabled'] = 'True'
+    tto_globals.config['tto']['MidiVirtualTraffic'] = arguments.traffic
+    tto_globals.config['tto']['ClockSource'] = 'midi'
+    tto_globals.config['tto']['SessionLogDir'] = ''
+
+    tto.tto_init()
+    # Clean up here instead, without tto_terminate()'s sys.exit()
+    atexit.unregister(tto.tto_terminate)
+
+    soak_started = time.perf_counter()
+    tto_globals.running = True
+    timer = threading.Thread(target=soak_timer,
+                             args=(arguments.seconds, arguments.report_every,
+                                   soak_started),
+                             name="tto soak timer", daemon=True)
+    timer.start()
+    try:
+        tto.tto_run()
+    finally:
+        timer.join()
+        soak_report(soak_started)
+        p99 = tto_globals.midi.ports["MidiOutPort"].latency_percentile(99)
+        try:
+            tto.tto_terminate()
+        except SystemExit:
+            pass
+
+    status = 0
+    if arguments.fail_over is not None and p99 * 1000 > arguments.fail_over:
+        print("FAIL: loopback p99 {:.3f} ms over {:.3f} ms".format(
+            p99 * 1000, arguments.fail_over))
+        status = 1
+    sys.exit(status)
@@ -0,0 +1,214 @@
+"""tto_voices - voice allocation for tto
+
+This module sits between Key and TtoMidi and decides which voice, and which
+MIDI channel, each note plays on.
+
+Downstream synths only have so many voices.  Rather than let the synth drop
+notes however it likes, tto keeps at most MaxPolyphony notes sounding and,
+when a new note needs a voice, steals one itself and sends the stolen note a
+proper note off first.  VoiceStealing picks which: the 'oldest' voice, or the
+'quietest' (lowest velocity, oldest first among equals).
+
+Notes can also be spread round robin over several MIDI channels with
+MidiOutChannels, e.g. "2-5" or "2,3,4,5", so that each note has a channel to
+itself for MPE-style per-note control.  Left empty, everything plays on
+TtoMidi.channel_out as before.
+
+Voices live in fixed arrays indexed by voice number.  Free voices are a
+stack, sounding voices are a doubly linked list from oldest to newest, and
+each MIDI note number maps straight to its voice, so allocating, releasing
+and stealing the oldest voice are all O(1) with no allocation.
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+tto_debugger : Log message category codes.
+array : Per channel voice counts.
+
+Classes
+-------
+VoiceManager : Voice allocator with a polyphony limit, stealing and channel
+               round robin.
+
+Functions
+---------
+parse_channels() : Parse the MidiOutChannels config setting.
+"""
+
+import tto_globals
+from array import array
+from tto_debugger import category_midi
+
+# Marks an empty link, or a MIDI note with no voice
+no_voice = -1
+
+
+class VoiceManager(object):
+    def __init__(self, max_polyphony=16, stealing="oldest", channels=None):
+        self.max_polyphony = max(1, max_polyphony)
+
+        if stealing not in ("oldest", "quietest"):
+            tto_globals.debugger.message("EXCEPTION",
+                                         "Unknown VoiceStealing '{}', "
+                                         "using 'oldest'".format(stealing))
+            stealing = "oldest"
+        self.stealing = stealing
+
+        # MIDI channels 0-15 to round robin over.  None means whatever
+        # TtoMidi.channel_out is at the time.
+        self.channels = channels or [None]
+        self.channel_next = 0
+        # Voices sounding on each entry of self.channels.  All of them can
+        # be on one channel, so this has to count past 255.
+        self.channel_voices = array('I', [0]) * len(self.channels)
+
+        # Per voice state, indexed by voice number
+        self.voice_note = bytearray(self.max_polyphony)
+        self.voice_velocity = bytearray(self.max_polyphony)
+        self.voice_channel = bytearray(self.max_polyphony)  # channels index
+
+        # Sounding voices as a doubly linked list, oldest first
+        self.voice_prev = [no_voice] * self.max_polyphony
+        self.voice_next = [no_voice] * self.max_polyphony
+        self.oldest = no_voice
+        self.newest = no_voice
+
+        # Free voices as a stack
+        self.voices_free = list(range(self.max_polyphony - 1, -1, -1))
+
+        # [MIDI note number] = voice number playing it
+        self.note_voice = [no_voice] * 128
+
+        # Telemetry
+        self.voices_stolen = 0
+
+        tto_globals.debugger.message("MIDI",
+                                     "Voices: {} max, steal {}, channels {}".
+                                     format(self.max_polyphony,
+                                            self.stealing,
+                                            [c + 1 if c is not None
+                                             else "out"
+                                             for c in self.channels]))
+
+    def voices_sounding(self):
+        return self.max_polyphony - len(self.voices_free)
+
+    def link(self, voice):
+        # Append voice to the newest end of the sounding list
+        self.voice_prev[voice] = self.newest
+        self.voice_next[voice] = no_voice
+        if self.newest == no_voice:
+            self.oldest = voice
+        else:
+            self.voice_next[self.newest] = voice
+        self.newest = voice
+
+    def unlink(self, voice):
+        prev_voice = self.voice_prev[voice]
+        next_voice = self.voice_next[voice]
+        if prev_voice == no_voice:
+            self.oldest = next_voice
+        else:
+            self.voice_next[prev_voice] = next_voice
+        if next_voice == no_voice:
+            self.newest = prev_voice
+        else:
+            self.voice_prev[next_voice] = prev_voice
+
+    def steal_choose(self):
+        if self.stealing == "quietest":
+            # Walk oldest to newest, so the oldest of the quietest wins.
+            # At most max_polyphony voices.
+            voice = self.oldest
+            quietest = voice
+            while voice != no_voice:
+                if self.voice_velocity[voice] < \
+                        self.voice_velocity[quietest]:
+                    quietest = voice
+                voice = self.voice_next[voice]
+            return quietest
+        return self.oldest
+
+    def release(self, voice):
+        # Turn off whatever voice is playing and return it to the free stack
+        note = self.voice_note[voice]
+        self.unlink(voice)
+        self.note_voice[note] = no_voice
+        self.voices_free.append(voice)
+        channel_index = self.voice_channel[voice]
+        self.channel_voices[channel_index] -= 1
+        tto_globals.midi.send(note, "stop",
+                              channel=self.channels[channel_index])
+
+    def note_on(self, note, velocity=100):
+        if self.note_voice[note] != no_voice:
+            # Already sounding, so retrigger it on a fresh voice
+            self.release(self.note_voice[note])
+
+        if not self.voices_free:
+            voice = self.steal_choose()
+            tto_globals.debugger.message(category_midi,
+                                         "Voice {} stolen from note {}",
+                                         voice, self.voice_note[voice])
+            self.voices_stolen += 1
+            tto_globals.debugger.log_stat("Voices stolen", 1)
+            self.release(voice)
+
+        voice = self.voices_free.pop()
+
+        # Round robin, but skip past channels that still have a note on, so
+        # a note gets a channel to itself whenever there's one free
+        channel_index = self.channel_next
+        for i in range(len(self.channels)):
+            if not self.channel_voices[channel_index]:
+                break
+            channel_index = (channel_index + 1) % len(self.channels)
+        else:
+            channel_index = self.channel_next
+        self.channel_next = (channel_index + 1) % len(self.channels)
+        self.channel_voices[channel_index] += 1
+        channel = self.channels[channel_index]
+
+        self.voice_note[voice] = note
+        self.voice_velocity[voice] = velocity
+        self.voice_channel[voice] = channel_index
+        self.note_voice[note] = voice
+        self.link(voice)
+        tto_globals.midi.send(note, "play", channel=channel,
+                              velocity=velocity)
+
+    def note_off(self, note):
+        voice = self.note_voice[note]
+        if voice == no_voice:
+            # Stolen earlier, and already sent its note off then
+            return
+        self.release(voice)
+
+    def all_notes_off(self):
+        while self.oldest != no_voice:
+            self.release(self.oldest)
+
+
+def parse_channels(channels_config):
+    """Parse a MidiOutChannels setting like "2-5" or "1,3,5" (channels
+    1-16) into a list of channels 0-15, or None if it's empty.  Raises
+    ValueError for a channel out of range or a range that runs backwards.
+    """
+    channels = []
+    for channel_range in channels_config.strip('"').split(","):
+        channel_range = channel_range.strip()
+        if not channel_range:
+            continue
+        if "-" in channel_range:
+            first, last = channel_range.split("-", 1)
+            if int(last) < int(first):
+                raise ValueError("MIDI channel range {} runs backwards".
+                                 format(channel_range))
+            channels.extend(range(int(first) - 1, int(last)))
+        else:
+            channels.append(int(channel_range) - 1)
+    for channel in channels:
+        if channel not in range(16):
+            raise ValueError("MIDI channel {} out of range 1-16".format(
+                channel + 1))
+    return channels or None
@@ -0,0 +1,122 @@
+"""tto_watchdog - main loop stall watchdog for tto
+
+When the main loop blocks, MIDI In isn't read, notes hang and the UI
+freezes, and afterwards nothing says where the time went.  The watchdog is
+a thread that looks in on the main loop every quarter of WatchdogStallMs.
+tto_run() counts a heartbeat every main loop run, which is one integer add,
+so when nothing is wrong the cost is that and a thread waking up a few
+times a second.
+
+If the heartbeat hasn't moved for over WatchdogStallMs, the main loop
+thread's stack is taken from sys._current_frames() while it's still stuck,
+and logged under WDOG on one line, innermost call first, with how long the
+stall has gone on so far.  When the heartbeat moves again the stall's whole
+length is logged, and added to the trace if tracing.  Times are to within a
+check interval, as that's how often the watchdog looks.
+
+Requirements
+------------
+tto_globals : Program-wide global variable module for tto.
+tto_sessionlog : Log level codes.
+os : Trimming file paths in stacks.
+sys : _current_frames().
+threading : The watchdog thread.
+time : perf_counter() for stall times.
+traceback : Reading the stack.
+
+Classes
+-------
+StallWatchdog : Main loop heartbeat monitor and stack capture.
+"""
+
+import tto_globals
+import os
+import sys
+import threading
+import time
+import traceback
+from tto_sessionlog import INFO, WARNING
+
+
+class StallWatchdog(object):
+    def __init__(self, threshold=0.2):
+        # A heartbeat later than this many seconds is a stall
+        self.threshold = threshold
+        self.check_interval = max(0.01, threshold / 4)
+
+        # Counted by the main loop every run
+        self.beats = 0
+
+        self.clock = time.perf_counter
+        self.thread = None
+        self.thread_watched = None  # Thread id of the main loop
+        self.stopping = threading.Event()
+
+        # Counters
+        self.stalls = 0
+        self.stall_total = 0.0
+        self.stall_max = 0.0
+
+    def start(self):
+        """Start watching the calling thread's heartbeat."""
+        self.thread_watched = threading.get_ident()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run,
+                                       name="tto watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        beats_seen = self.beats
+        beat_time = self.clock()  # When beats_seen was first seen
+        stalled = False
+        while not self.stopping.wait(self.check_interval):
+            now = self.clock()
+            beats = self.beats
+            if beats != beats_seen:
+                if stalled:
+                    self.stall_end(beat_time, now)
+                    stalled = False
+                beats_seen = beats
+                beat_time = now
+            elif not stalled and now - beat_time > self.threshold:
+                stalled = True
+                self.stall_begin(now - beat_time)
+
+    def stall_begin(self, stalled_for):
+        frame = sys._current_frames().get(self.thread_watched)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        # Frames refer back to everything they hold.  Don't keep it.
+        del frame
+        tto_globals.debugger.message(
+            "WDOG", "Main loop stalled {:.0f} ms so far, in {}",
+            stalled_for * 1000,
+            " < ".join("{}:{} {}".format(os.path.basename(entry.filename),
+                                         entry.lineno, entry.name)
+                       for entry in reversed(stack)),
+            level=WARNING)
+
+    def stall_end(self, begin, end):
+        stalled_for = end - begin
+        self.stalls += 1
+        self.stall_total += stalled_for
+        if stalled_for > self.stall_max:
+            self.stall_max = stalled_for
+        tto_globals.debugger.message("WDOG",
+                                     "Main loop stall ended after {:.0f} ms",
+                                     stalled_for * 1000, level=INFO)
+        tracer = tto_globals.tracer
+        if tracer:
+            tracer.span(tracer.name_id("main_loop_stall"), begin)
+
+    def stats(self):
+        return {'stalls': self.stalls,
+                'stall_total_ms': round(self.stall_total * 1000, 1),
+                'stall_max_ms': round(self.stall_max * 1000, 1)}